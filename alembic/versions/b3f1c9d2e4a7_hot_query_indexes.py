@@ -0,0 +1,77 @@
+"""hot_query_indexes
+
+Revision ID: b3f1c9d2e4a7
+Revises: 70841a63a938
+Create Date: 2026-10-17 02:10:41.528310
+
+Deletes data: rows sharing a hash_id in the tables below are reduced to the latest one before the unique
+indexes are built, the dropped rows are logged per table and can't be restored by the downgrade.
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op, context
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f1c9d2e4a7'
+down_revision: Union[str, None] = '70841a63a938'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# tables holding one row per hash_id
+unique_hash_id_tables = (
+    'kemono_creator', 'kemono_user', 'kemono_posts_info', 'kemono_post', 'formatter_params'
+)
+
+
+def log_duplicates(table: str):
+    if context.is_offline_mode():
+        logger.warning(f"Duplicated hash_id rows of {table} will be deleted, the count is unknown in offline mode")
+        return
+    duplicates = op.get_bind().execute(sa.text(
+        f'SELECT hash_id, COUNT(*) - 1 FROM {table} GROUP BY hash_id HAVING COUNT(*) > 1'
+    )).all()
+    if duplicates:
+        samples = ", ".join(hash_id for hash_id, _ in duplicates[:10])
+        logger.warning(
+            f"Deleting {sum(count for _, count in duplicates)} duplicated rows of {len(duplicates)} hash_id "
+            f"from {table}, the latest row of each is kept: {samples}{', ...' if len(duplicates) > 10 else ''}"
+        )
+
+
+def upgrade() -> None:
+    for table in unique_hash_id_tables:
+        log_duplicates(table)
+        # keep the latest row of duplicated hash_id, otherwise the unique index can't be built
+        op.execute(
+            f'DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY hash_id)'
+        )
+        op.create_index(op.f(f'ix_{table}_hash_id'), table, ['hash_id'], unique=True)
+    op.create_index(op.f('ix_kemono_post_user_hash_id'), 'kemono_post', ['user_hash_id'], unique=False)
+    op.create_index(op.f('ix_kemono_post_posts_info_hash_id'), 'kemono_post', ['posts_info_hash_id'], unique=False)
+    op.create_index(op.f('ix_kemono_attachment_hash_id'), 'kemono_attachment', ['hash_id'], unique=False)
+    op.create_index(op.f('ix_kemono_attachment_post_hash_id'), 'kemono_attachment', ['post_hash_id'], unique=False)
+    op.create_index(op.f('ix_kemono_file_hash_id'), 'kemono_file', ['hash_id'], unique=False)
+    op.create_index(op.f('ix_kemono_file_post_hash_id'), 'kemono_file', ['post_hash_id'], unique=False)
+    op.drop_index('ix_kemono_file_user_hash_id', table_name='kemono_file')
+    op.create_index(
+        'ix_kemono_file_user_hash_id_formatter_name', 'kemono_file', ['user_hash_id', 'formatter_name'], unique=False
+    )
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_kemono_file_user_hash_id_formatter_name', table_name='kemono_file')
+    op.create_index(op.f('ix_kemono_file_user_hash_id'), 'kemono_file', ['user_hash_id'], unique=False)
+    op.drop_index(op.f('ix_kemono_file_post_hash_id'), table_name='kemono_file')
+    op.drop_index(op.f('ix_kemono_file_hash_id'), table_name='kemono_file')
+    op.drop_index(op.f('ix_kemono_attachment_post_hash_id'), table_name='kemono_attachment')
+    op.drop_index(op.f('ix_kemono_attachment_hash_id'), table_name='kemono_attachment')
+    op.drop_index(op.f('ix_kemono_post_posts_info_hash_id'), table_name='kemono_post')
+    op.drop_index(op.f('ix_kemono_post_user_hash_id'), table_name='kemono_post')
+    for table in reversed(unique_hash_id_tables):
+        op.drop_index(op.f(f'ix_{table}_hash_id'), table_name=table)
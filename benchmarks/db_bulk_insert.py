@@ -0,0 +1,81 @@
+'''
+Compare rows/s of the ORM `add_all` path against the Core bulk insert path for posts and attachments.
+
+    python benchmarks/db_bulk_insert.py -posts 5000 -attachments 10
+'''
+if __name__ == '__main__':
+    import sys, os
+    sys.path.append(os.getcwd())
+
+import argparse
+import asyncio
+import tempfile
+from time import perf_counter
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from kemonobakend.database import AsyncCombineSession, create_all
+from kemonobakend.database.models import KemonoPostCreate, KemonoAttachmentCreate
+from kemonobakend.utils import path_join
+
+
+def make_posts(posts_count: int, attachments_per_post: int):
+    posts = []
+    for i in range(posts_count):
+        post_hash_id = f"post_{i:08d}"
+        attachments = [
+            KemonoAttachmentCreate(
+                hash_id=f"{post_hash_id}_{j:04d}", name=f"{j}.png", path=f"/data/{i}/{j}.png",
+                size=1024 * j, sha256=f"{i:032d}{j:032d}", idx=j,
+                user_hash_id="bench_user", post_hash_id=post_hash_id
+            )
+            for j in range(attachments_per_post)
+        ]
+        posts.append(KemonoPostCreate(
+            hash_id=post_hash_id, post_id=str(i), service="fanbox", user_id="1",
+            server_id="", channel_id="", title=f"post {i}", content="x" * 256,
+            published="2024-01-01T00:00:00", user_hash_id="bench_user",
+            posts_info_hash_id="bench_info", attachments=attachments
+        ))
+    return posts
+
+async def orm_insert(session: AsyncCombineSession, posts: list[KemonoPostCreate]):
+    await session.kemono_post.add_posts(posts, commit=False)
+    for post in posts:
+        await session.kemono_attachment.add_attachments(post.attachments, commit=False)
+    await session.commit()
+
+async def bulk_insert(session: AsyncCombineSession, posts: list[KemonoPostCreate]):
+    await session.kemono_post.bulk_add_posts(posts, commit=False)
+    await session.kemono_attachment.bulk_add_attachments(
+        [attachment for post in posts for attachment in post.attachments], commit=False
+    )
+    await session.commit()
+
+async def run(posts_count: int, attachments_per_post: int, repeat: int):
+    posts = make_posts(posts_count, attachments_per_post)
+    rows = posts_count * (attachments_per_post + 1)
+    print(f"posts: {posts_count}, attachments per post: {attachments_per_post}, rows: {rows}")
+    for name, fn in (("orm", orm_insert), ("bulk", bulk_insert)):
+        best = float("inf")
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                engine = create_async_engine("sqlite+aiosqlite:///" + path_join(tmp, "bench.db"))
+                await create_all(engine)
+                async with AsyncCombineSession(engine) as session:
+                    begin = perf_counter()
+                    await fn(session, posts)
+                    best = min(best, perf_counter() - begin)
+                await engine.dispose()
+        print(f"{name:>5}: {best:.3f}s ({rows / best:,.0f} rows/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Posts/attachments insert benchmark")
+    parser.add_argument("-posts", type=int, default=5000, help="Number of posts, default is 5000")
+    parser.add_argument("-attachments", type=int, default=10, help="Attachments per post, default is 10")
+    parser.add_argument("-repeat", type=int, default=3, help="Runs per path, the best one is reported, default is 3")
+    args = parser.parse_args()
+    asyncio.run(run(args.posts, args.attachments, args.repeat))
+
+if __name__ == '__main__':
+    main()
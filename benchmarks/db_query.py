@@ -0,0 +1,101 @@
+'''
+Time the hot lookups (hash_id, posts by user, attachments by post, files by user and formatter)
+with and without the secondary indexes.
+
+    python benchmarks/db_query.py -posts 20000 -attachments 5 -queries 500
+'''
+if __name__ == '__main__':
+    import sys, os
+    sys.path.append(os.getcwd())
+
+import argparse
+import asyncio
+import random
+import tempfile
+from time import perf_counter
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, select
+
+from kemonobakend.database import AsyncCombineSession, create_all
+from kemonobakend.database.models import KemonoPost, KemonoAttachment, KemonoFile
+from kemonobakend.utils import path_join
+
+from benchmarks.db_bulk_insert import make_posts
+
+
+async def populate(engine, posts_count: int, attachments_per_post: int, users: int):
+    posts = make_posts(posts_count, attachments_per_post)
+    files = []
+    for i, post in enumerate(posts):
+        user_hash_id = f"user_{i % users}"
+        post.user_hash_id = user_hash_id
+        for attachment in post.attachments:
+            attachment.user_hash_id = user_hash_id
+            files.append({
+                "hash_id": f"file_{attachment.hash_id}", "hash_id_type": "base", "idx": attachment.idx,
+                "sha256": attachment.sha256, "save_path": attachment.path, "root": "/data",
+                "folder": str(i), "file_name": attachment.name, "formatter_name": f"fmt_{i % 3}",
+                "attachment_hash_id": attachment.hash_id, "post_hash_id": post.hash_id,
+                "user_hash_id": user_hash_id,
+            })
+    async with AsyncCombineSession(engine) as session:
+        await session.kemono_post.bulk_add_posts(posts, commit=False)
+        await session.kemono_attachment.bulk_add_attachments(
+            [attachment for post in posts for attachment in post.attachments], commit=False
+        )
+        await session.kemono_file.bulk_insert(files, commit=False)
+        await session.commit()
+    return posts
+
+async def time_queries(engine, posts, queries: int):
+    sample = random.Random(0).sample(posts, min(queries, len(posts)))
+    cases = {
+        "post by hash_id": lambda p: select(KemonoPost.id).where(KemonoPost.hash_id == p.hash_id),
+        "posts by user": lambda p: select(KemonoPost.id).where(KemonoPost.user_hash_id == p.user_hash_id),
+        "attachments by post": lambda p: select(KemonoAttachment.id).where(KemonoAttachment.post_hash_id == p.hash_id),
+        "files by user+formatter": lambda p: select(KemonoFile.id).where(
+            KemonoFile.user_hash_id == p.user_hash_id, KemonoFile.formatter_name == "fmt_0"
+        ),
+    }
+    results = {}
+    async with AsyncCombineSession(engine) as session:
+        for name, build in cases.items():
+            begin = perf_counter()
+            for post in sample:
+                (await session.exec(build(post))).all()
+            results[name] = (perf_counter() - begin) / len(sample)
+    return results
+
+async def drop_secondary_indexes(engine):
+    async with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+async def run(posts_count: int, attachments_per_post: int, users: int, queries: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine("sqlite+aiosqlite:///" + path_join(tmp, "bench.db"))
+        await create_all(engine)
+        posts = await populate(engine, posts_count, attachments_per_post, users)
+        print(f"posts: {posts_count}, attachments/files: {posts_count * attachments_per_post}, users: {users}")
+        indexed = await time_queries(engine, posts, queries)
+        await drop_secondary_indexes(engine)
+        scanned = await time_queries(engine, posts, queries)
+        await engine.dispose()
+    print(f"{'query':<26}{'indexed':>12}{'no index':>12}{'speedup':>10}")
+    for name in indexed:
+        print(f"{name:<26}{indexed[name]*1e3:>10.3f}ms{scanned[name]*1e3:>10.3f}ms{scanned[name]/indexed[name]:>9.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot query benchmark")
+    parser.add_argument("-posts", type=int, default=20000, help="Number of posts, default is 20000")
+    parser.add_argument("-attachments", type=int, default=5, help="Attachments (and files) per post, default is 5")
+    parser.add_argument("-users", type=int, default=50, help="Number of users the posts are spread over, default is 50")
+    parser.add_argument("-queries", type=int, default=300, help="Lookups per query kind, default is 300")
+    args = parser.parse_args()
+    asyncio.run(run(args.posts, args.attachments, args.users, args.queries))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+'''
+Benchmark how fast `Downloader` starts tasks against a local stub HTTP server.
+
+    python benchmarks/downloader_dispatch.py -n 2000 -c 16 -size 4KB
+'''
+if __name__ == '__main__':
+    import sys, os
+    sys.path.append(os.getcwd())
+
+import argparse
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
+from time import perf_counter
+
+from aiohttp import web, ClientSession, TCPConnector
+
+from kemonobakend.downloader import Downloader, DownloadProperties, ProgressTracker
+from kemonobakend.utils import to_bytes, path_join
+from kemonobakend.utils.progress import DownloadProgress
+
+
+class StubSessionPool:
+    '''Minimal stand-in for SessionPool: one shared direct session, no proxies.'''
+    def __init__(self):
+        self.session = ClientSession(connector=TCPConnector(limit=0))
+    
+    @asynccontextmanager
+    async def get(self, *args, **kwargs):
+        yield self.session
+    
+    async def close(self):
+        await self.session.close()
+
+def make_app(payload: bytes):
+    async def handle(request: web.Request):
+        if range_header := request.headers.get("Range"):
+            start, end = range_header.removeprefix("bytes=").split("-")
+            start, end = int(start), int(end or len(payload) - 1)
+            return web.Response(
+                status=206, body=payload[start:end+1],
+                headers={"Content-Range": f"bytes {start}-{end}/{len(payload)}"}
+            )
+        return web.Response(body=payload)
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    return app
+
+class DispatchRecorder(Downloader):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started_at: list[float] = []
+    
+    def _put_task(self, task_id, task):
+        self.started_at.append(perf_counter())
+        super()._put_task(task_id, task)
+
+async def run(count: int, concurrent: int, size: int, port: int, direct_write: bool = False):
+    payload = b"\0" * size
+    runner = web.AppRunner(make_app(payload))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    
+    session_pool = StubSessionPool()
+    with tempfile.TemporaryDirectory() as tmp:
+        prop = DownloadProperties(
+            session_pool=session_pool,
+            progress_tracker=ProgressTracker(DownloadProgress(disable=True)),
+            tmp_path=path_join(tmp, "tmp"),
+            max_tasks_concurrent=concurrent,
+            per_task_max_concurrent=1,
+            direct_write=direct_write,
+        )
+        downloader = DispatchRecorder(prop)
+        downloader.start()
+        begin = perf_counter()
+        for i in range(count):
+            downloader.create_task(
+                f"http://127.0.0.1:{port}/file_{i}", path_join(tmp, "res", f"file_{i}"),
+                file_name=f"file_{i}", file_size=size, file_sha256=None
+            )
+        await downloader.wait_any_tasks_done(count)
+        elapsed = perf_counter() - begin
+        await downloader.stop()
+    await session_pool.close()
+    await runner.cleanup()
+    
+    started = downloader.started_at
+    start_span = (started[-1] - started[0]) if len(started) > 1 else 0
+    print(f"tasks: {count}, concurrent: {concurrent}, size: {size}B, direct_write: {direct_write}")
+    print(f"started: {len(started)} tasks in {start_span:.3f}s ({len(started) / max(start_span, 1e-9):.1f} tasks/s)")
+    print(f"completed: {count} tasks in {elapsed:.3f}s ({count / elapsed:.1f} tasks/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloader dispatch benchmark")
+    parser.add_argument("-n", "-count", type=int, default=1000, help="Number of download tasks, default is 1000")
+    parser.add_argument("-c", "-concurrent", type=int, default=16, help="Maximum concurrent tasks, default is 16")
+    parser.add_argument("-size", type=str, default="4KB", help="Size of each stub file, default is 4KB")
+    parser.add_argument("--direct_write", action="store_true", help="Write ranges directly into the final file")
+    parser.add_argument("-port", type=int, default=18765, help="Port of the stub HTTP server, default is 18765")
+    args = parser.parse_args()
+    asyncio.run(run(args.n, args.c, to_bytes(args.size), args.port, args.direct_write))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Compare download scheduling policies on a mixed batch: a few large files queued in front of many small ones,
+served by a local stub HTTP server with a shared bandwidth limit.
+
+    python benchmarks/downloader_schedule.py -large 4 -large_size 64MB -small 400 -small_size 256KB -bandwidth 64MB
+'''
+if __name__ == '__main__':
+    import sys, os
+    sys.path.append(os.getcwd())
+
+import argparse
+import asyncio
+import tempfile
+
+from aiohttp import web
+
+from kemonobakend.downloader import Downloader, DownloadProperties, ProgressTracker
+from kemonobakend.utils import to_bytes, path_join
+from kemonobakend.utils.progress import DownloadProgress
+
+from benchmarks.downloader_dispatch import StubSessionPool
+
+
+def make_app(sizes: dict[str, int], bandwidth: int):
+    '''Ranges are streamed in 64KB steps, the bandwidth is shared by all open responses.'''
+    block = b"\0" * 64 * 1024
+    active = 0
+    async def handle(request: web.Request):
+        nonlocal active
+        size = sizes[request.match_info["name"]]
+        start, end = 0, size - 1
+        if range_header := request.headers.get("Range"):
+            start, end = range_header.removeprefix("bytes=").split("-")
+            start, end = int(start), int(end or size - 1)
+        response = web.StreamResponse(
+            status=206 if range_header else 200,
+            headers={"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)}
+        )
+        await response.prepare(request)
+        active += 1
+        try:
+            pos = start
+            while pos <= end:
+                n = min(len(block), end - pos + 1)
+                await response.write(block[:n])
+                pos += n
+                await asyncio.sleep(n * active / bandwidth)
+        finally:
+            active -= 1
+        return response
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    return app
+
+async def run_policy(policy: str, small_file_slots: int, files: list[tuple[str, int]], concurrent: int, port: int):
+    session_pool = StubSessionPool()
+    with tempfile.TemporaryDirectory() as tmp:
+        prop = DownloadProperties(
+            session_pool=session_pool,
+            progress_tracker=ProgressTracker(DownloadProgress(disable=True)),
+            tmp_path=path_join(tmp, "tmp"),
+            max_tasks_concurrent=concurrent,
+            per_task_max_concurrent=4,
+            direct_write=True,
+            schedule_policy=policy,
+            small_file_slots=small_file_slots,
+        )
+        downloader = Downloader(prop)
+        for name, size in files:
+            downloader.create_task(
+                f"http://127.0.0.1:{port}/{name}", path_join(tmp, "res", name),
+                file_name=name, file_size=size, file_sha256=None, background_result=False
+            )
+        downloader.start()
+        await downloader.wait_any_tasks_done(len(files))
+        await downloader.stop()
+    await session_pool.close()
+    return downloader.stats
+
+async def run(large: int, large_size: int, small: int, small_size: int, bandwidth: int, concurrent: int, port: int):
+    # large files first, the order a creator's archives and images usually come in
+    files = [(f"large_{i}", large_size) for i in range(large)] + [(f"small_{i}", small_size) for i in range(small)]
+    runner = web.AppRunner(make_app(dict(files), bandwidth))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    # columns past the small file count would have no value
+    firsts = [count for count in (10, 100) if count < small] + [small]
+    print(f"files: {large} x {large_size}B + {small} x {small_size}B, bandwidth: {bandwidth}B/s, concurrent: {concurrent}")
+    print(f"{'policy':<22}" + "".join(f"{f'first {count}':>12}" for count in firsts) + f"{'makespan':>12}")
+    for policy, small_file_slots in (("fifo", 0), ("sjf", 0), ("fifo", 2), ("sjf", 2)):
+        stats = await run_policy(policy, small_file_slots, files, concurrent, port)
+        cells = "".join(f"{stats.time_to_first(count):>11.2f}s" for count in firsts)
+        print(f"{f'{policy} small_slots={small_file_slots}':<22}{cells}{stats.makespan:>11.2f}s")
+    await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloader scheduling policy benchmark")
+    parser.add_argument("-large", type=int, default=4, help="Number of large files queued first, default is 4")
+    parser.add_argument("-large_size", type=str, default="64MB", help="Size of each large file, default is 64MB")
+    parser.add_argument("-small", type=int, default=400, help="Number of small files, default is 400")
+    parser.add_argument("-small_size", type=str, default="256KB", help="Size of each small file, default is 256KB")
+    parser.add_argument("-bandwidth", type=str, default="64MB", help="Bandwidth of the stub server per second, default is 64MB")
+    parser.add_argument("-c", "-concurrent", type=int, default=8, help="Maximum concurrent tasks, default is 8")
+    parser.add_argument("-port", type=int, default=18766, help="Port of the stub HTTP server, default is 18766")
+    args = parser.parse_args()
+    asyncio.run(run(
+        args.large, to_bytes(args.large_size), args.small, to_bytes(args.small_size),
+        to_bytes(args.bandwidth), args.c, args.port
+    ))
+
+if __name__ == '__main__':
+    main()
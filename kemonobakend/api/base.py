@@ -6,6 +6,7 @@ from contextlib import asynccontextmanager
 from typing import Any, Callable, Optional, Coroutine
 
 from kemonobakend.session_pool import SessionPool
+from kemonobakend.utils.aiotools import RateLimiter
 from kemonobakend.kemono.builtins import get_service_site
 from kemonobakend.log import logger
 from kemonobakend.config import settings
@@ -36,10 +37,26 @@ class ApiBuilder:
             url = url.with_query(query)
         return str(url)
 
+_rate_limiters: dict[str, RateLimiter] = {}
+
+def get_rate_limiter(url: str) -> Optional[RateLimiter]:
+    '''Requests per second limiter of the site (`kemono` / `coomer`) the url belongs to, shared by all API objects.'''
+    host = URL(url).host or ""
+    site = host.split(".")[-2] if "." in host else host
+    if site not in _rate_limiters:
+        rate = settings.kemono_api.site_rate_limits.get(site)
+        _rate_limiters[site] = RateLimiter(rate) if rate else None
+    return _rate_limiters[site]
+
 class BaseAPI:
     session_pool: SessionPool = None
     __api_url_map__: dict
     
+    @staticmethod
+    async def wait_rate_limit(url: str):
+        if (rate_limiter := get_rate_limiter(url)) is not None:
+            await rate_limiter.acquire()
+    
     async def fetch(
         self, 
         url: str, 
@@ -57,6 +74,7 @@ class BaseAPI:
                 return await resp.json()
             return_callable = _return_callable
         while retry > 0:
+            await self.wait_rate_limit(url)
             async with self.session_pool.get(priority_type="ping") as session:
                 func: Callable[..., Optional[ClientResponse]] = getattr(session, method.lower())
                 timeout = kwargs.pop("timeout", None) or ClientTimeout(total=20, connect=10, sock_connect=10, sock_read=12)
@@ -105,6 +123,7 @@ class BaseAPI:
             **kwargs
         ):
         while retry > 0:
+            await self.wait_rate_limit(url)
             try:
                 async with self.session_pool.get(priority_type="ping") as session:
                     func: Callable[..., Optional[ClientResponse]] = getattr(session, method.lower())
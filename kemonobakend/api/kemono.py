@@ -10,7 +10,7 @@ from typing import Optional, Awaitable, Callable, TypeVar, Union, Any
 from aiohttp import ClientResponse
 from kemonobakend.database.models import (
     KemonoCreatorCreate, KemonoUser, KemonoUserCreate, 
-    KemonoPostsInfoCreate,
+    KemonoPostsInfoCreate, KemonoPostCreate,
     KemonoAttachmentCreate)
 from kemonobakend.database.model_builder import (
     build_kemono_user_by_kwd, build_kemono_creator,
@@ -1502,6 +1502,33 @@ class Posts:
         posts_info = posts_info or build_kemono_posts_info(kemono_user, len(posts))
         kemono_posts = [build_kemono_post(info=posts_info, **post) for post in posts]
         return kemono_posts
+    
+    async def build_new_posts(
+        self, 
+        kemono_user: Union[KemonoUser, KemonoUserCreate], 
+        known: dict[str, Optional[str]], 
+        posts_info: KemonoPostsInfoCreate
+    ) -> Optional[list[KemonoPostCreate]]:
+        '''
+        Page the creator's posts from the newest and keep the ones that are not in `known` (post hash_id -> edited)
+        or were edited since, stopping at the first page that brings nothing new.
+        Returns None for discord servers, whose posts are paged per channel and must be built in full.
+        '''
+        if kemono_user.service == "discord":
+            return None
+        new_posts = []
+        offset = 0
+        while True:
+            page = await self.api.get_creator_posts(kemono_user.service, kemono_user.user_id, offset=offset)
+            if not isinstance(page, list):
+                raise PartySuAPIError("Failed to fetch posts")
+            posts = [build_kemono_post(info=posts_info, **post) for post in page]
+            changed = [post for post in posts if post.hash_id not in known or known[post.hash_id] != post.edited]
+            new_posts.extend(changed)
+            logger.info(f"Fetched page {offset // 50 + 1}, {len(changed)} new or edited posts\tfor {kemono_user.service}/{kemono_user.user_id}")
+            if not changed or len(page) < 50:
+                return new_posts
+            offset += 50
 
 class Attachments:
     def __init__(self, api: "KemonoAPI"):
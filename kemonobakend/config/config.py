@@ -7,6 +7,23 @@ class ProgramConfig(BaseModel):
     log_level: str = Field(default="INFO")
     log_file: str = Field(default="logs/kemonobakend.log")
     database_path: str = Field(default="data/db/kemonobakend.db")
+    database_pragmas: dict = Field(default={
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256*1024*1024,
+        "cache_size": -64*1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+    })
+    database_read_pool_size: int = Field(default=4)
+    hash_workers: int = Field(default=4)
+    hash_use_process: bool = Field(default=False)
+    hash_cache_enabled: bool = Field(default=True)
+    hash_cache_max_entries: int = Field(default=5_000_000)
+    resource_index_enabled: bool = Field(default=True)
+    resource_index_persist: bool = Field(default=False)
+    files_gen_workers: int = Field(default=0)
+    batch_concurrency: int = Field(default=8)
 
 class ProxiesConfig(BaseModel):
     default_proxies: Union[str, list[Proxy]] = Field(default="fanqie_01")
@@ -17,6 +34,10 @@ class SessionPoolConfig(BaseModel):
 
 class KemonoAPIConfig(BaseModel):
     get_discord_channel_all_posts_timeout: int = Field(default=60)
+    site_rate_limits: dict = Field(default={
+        "kemono": 4,
+        "coomer": 4,
+    })
     
 class DownloadConfig(BaseModel):
     max_concurrent_downloads: int = Field(default=8)
@@ -24,6 +45,17 @@ class DownloadConfig(BaseModel):
     max_retries: int = Field(default=3)
     timeout_kwargs: dict = Field(default={"connect": 10})
     tmp_path: str = Field(default="downloads/tmp")
+    direct_write: bool = Field(default=False)
+    hash_window_size: int = Field(default=64*1024*1024)
+    adaptive_chunks: bool = Field(default=True)
+    adaptive_initial_chunks: int = Field(default=4)
+    adaptive_min_chunk_size: int = Field(default=1024*1024)
+    adaptive_interval: float = Field(default=2.0)
+    adaptive_min_gain: float = Field(default=0.1)
+    hedge_tail_size: int = Field(default=2*1024*1024)
+    schedule_policy: str = Field(default="sjf")
+    small_file_size: int = Field(default=8*1024*1024)
+    small_file_slots: int = Field(default=2)
     auto_chunks_dict: dict = Field(default={
         "0-2MB": 4,
         "2-5MB": 6,
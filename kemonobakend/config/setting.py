@@ -1,3 +1,4 @@
+import os
 from pydantic import BaseModel, Field
 from pathlib import Path
 
@@ -27,8 +28,11 @@ class Settings(Config):
         if not CONFIG_PATH.exists():
             self.init()
         else:
-            self.load()
-            self.save()
+            data = self.load()
+            # only write back when fields were added or normalized, worker processes of the files pool
+            # import the settings at the same time and must not read a half written file
+            if data != self.dict():
+                self.save()
     
     def init(self):
         super().__init__()
@@ -39,8 +43,11 @@ class Settings(Config):
         data = json_load(CONFIG_PATH)
         obj = Config.model_validate(data)
         self.__dict__.update(obj.__dict__)
+        return data
     
     def save(self, config_dict: dict = None):
         if config_dict is None:
             config_dict = self.dict()
-        json_dump(config_dict, CONFIG_PATH)
\ No newline at end of file
+        tmp_path = CONFIG_PATH.with_name(f"{CONFIG_PATH.name}.{os.getpid()}.tmp")
+        json_dump(config_dict, tmp_path)
+        os.replace(tmp_path, CONFIG_PATH)
\ No newline at end of file
@@ -1 +1,2 @@
-from .combine import AsyncCombineSession, create_all, drop_all
\ No newline at end of file
+from .combine import AsyncCombineSession, create_all, drop_all
+from .writer import DatabaseWriter
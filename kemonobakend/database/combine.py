@@ -46,9 +46,9 @@ async def drop_all(engine: AsyncEngine):
 
 class AsyncCombineSession(AsyncSession, AbsHandler):
     __set_handlers__ = AbsHandler.__builtin_handlers__
-    def __init__(self, engine: AsyncEngine = e, include_handlers: Optional[Tuple[Type[BaseSessionHandle]]]=None):
+    def __init__(self, engine: AsyncEngine = e, include_handlers: Optional[Tuple[Type[BaseSessionHandle]]]=None, **kwargs):
         self.engine = engine
-        super().__init__(engine)
+        super().__init__(engine, **kwargs)
         if include_handlers is None:
             include_handlers = self.__set_handlers__
         
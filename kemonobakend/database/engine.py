@@ -1,10 +1,41 @@
 from pathlib import Path
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from kemonobakend.config import settings
 
-engine = create_async_engine("sqlite+aiosqlite:///" + settings.program.database_path)
+def set_sqlite_pragmas(engine: AsyncEngine, pragmas: dict, query_only: bool = False):
+    '''Apply `PRAGMA key=value` on every new DBAPI connection of the engine.'''
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f"PRAGMA {key}={value}")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    return engine
+
+def create_sqlite_engine(path: str, pragmas: dict = None, read_only: bool = False, pool_size: int = None, **kwargs):
+    '''
+    Create an aiosqlite engine with the pragmas profile applied on connect.
+    A read only engine refuses writes (`query_only`), so with WAL its pooled connections
+    can serve queries alongside the single writer engine.
+    '''
+    # aiosqlite defaults to NullPool for files, which would reopen (and re-apply pragmas) per session
+    kwargs.setdefault("poolclass", AsyncAdaptedQueuePool)
+    if pool_size is not None:
+        kwargs.setdefault("pool_size", pool_size)
+    engine = create_async_engine("sqlite+aiosqlite:///" + path, **kwargs)
+    return set_sqlite_pragmas(engine, pragmas or {}, query_only=read_only)
 
 _db_path = Path(settings.program.database_path)
 if not _db_path.parent.exists():
     _db_path.parent.mkdir(parents=True)
+
+engine = create_sqlite_engine(settings.program.database_path, settings.program.database_pragmas)
+read_engine = create_sqlite_engine(
+    settings.program.database_path, settings.program.database_pragmas,
+    read_only=True, pool_size=settings.program.database_read_pool_size
+)
@@ -2,5 +2,5 @@ from sqlmodel import SQLModel, Field
 from typing import Optional
 
 class Base(SQLModel):
-    hash_id: Optional[str] = Field(nullable=False)
+    hash_id: Optional[str] = Field(nullable=False, index=True)
     hash_id_type: Optional[str] = Field(default="base")
\ No newline at end of file
@@ -15,4 +15,5 @@ class FormatterParamsCreate(FormatterParamsBase):
 
 class FormatterParams(FormatterParamsBase, table=True):
     __tablename__ = "formatter_params"
+    hash_id: Optional[str] = Field(nullable=False, index=True, unique=True)
     id: Optional[int] = Field(default=None, primary_key=True)
\ No newline at end of file
@@ -11,7 +11,7 @@ class KemonoAttachmentBase(Base):
     sha256: Optional[str] = Field(default=None, nullable=True)
     idx: Optional[int]    = Field(default=None, nullable=True)
     user_hash_id: str     = Field(nullable=False, foreign_key="kemono_user.hash_id", index=True)
-    post_hash_id: str     = Field(nullable=False, foreign_key="kemono_post.hash_id")
+    post_hash_id: str     = Field(nullable=False, foreign_key="kemono_post.hash_id", index=True)
 
 class KemonoAttachmentCreate(KemonoAttachmentBase):
     post: "KemonoPostCreate" = None
@@ -18,6 +18,7 @@ class KemonoCreatorCreate(KemonoCreatorBase):
 class KemonoCreator(KemonoCreatorBase, table=True):
     __tablename__ = "kemono_creator"
     __name__ = "Kemono creator"
+    hash_id: Optional[str] = Field(nullable=False, index=True, unique=True)
     id: Optional[int] = Field(default=None, primary_key=True)
     kemono_users: list["KemonoUser"] = Relationship(
         back_populates="kemono_creator", 
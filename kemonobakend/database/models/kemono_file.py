@@ -1,4 +1,4 @@
-from sqlmodel import Field, Relationship
+from sqlmodel import Field, Relationship, Index
 from typing import Optional
 
 from .base import Base
@@ -15,8 +15,8 @@ class KemonoFileBase(Base):
 
     formatter_name: str = Field(index=True)
     attachment_hash_id: str = Field(foreign_key="kemono_attachment.hash_id")
-    post_hash_id: str = Field(foreign_key="kemono_post.hash_id")
-    user_hash_id: str = Field(foreign_key="kemono_user.hash_id", index=True)
+    post_hash_id: str = Field(foreign_key="kemono_post.hash_id", index=True)
+    user_hash_id: str = Field(foreign_key="kemono_user.hash_id")
 
 class KemonoFileCreate(KemonoFileBase):
     def to_sqlmodel(self):
@@ -25,4 +25,8 @@ class KemonoFileCreate(KemonoFileBase):
 class KemonoFile(KemonoFileBase, table=True):
     __tablename__ = "kemono_file"
     __name__ = "Kemono file"
+    __table_args__ = (
+        # get_files_by_user, also serves lookups by user_hash_id alone
+        Index("ix_kemono_file_user_hash_id_formatter_name", "user_hash_id", "formatter_name"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
\ No newline at end of file
@@ -13,8 +13,8 @@ class PostBase(Base):
     edited: Optional[str]    = Field(default=None, nullable=True)
     embeds: str              = Field(default="[]", description="JSON str")
     links: str               = Field(default="[]", description="JSON str")
-    user_hash_id: str        = Field(nullable=False, foreign_key="kemono_user.hash_id")
-    posts_info_hash_id: str  = Field(nullable=False, foreign_key="kemono_posts_info.hash_id")
+    user_hash_id: str        = Field(nullable=False, foreign_key="kemono_user.hash_id", index=True)
+    posts_info_hash_id: str  = Field(nullable=False, foreign_key="kemono_posts_info.hash_id", index=True)
 
 class DiscordChannelBase(PostBase):
     server_id: str      = Field(nullable=False)
@@ -40,6 +40,7 @@ class KemonoPostCreate(KemonoPostBase, DiscordChannelBase):
 class KemonoPost(KemonoPostBase, DiscordChannelBase, table=True):
     __tablename__ = "kemono_post"
     __name__ = "Kemono post"
+    hash_id: Optional[str] = Field(nullable=False, index=True, unique=True)
     id: Optional[int]   = Field(default=None, primary_key=True)
     attachments: list["KemonoAttachment"] = Relationship(back_populates="post", sa_relationship_kwargs={"lazy": "joined"})
     info: "KemonoPostsInfo" = Relationship(back_populates="posts", sa_relationship_kwargs={"lazy": "joined"})
@@ -17,6 +17,7 @@ class KemonoPostsInfoCreate(KemonoPostsInfoBase):
 
 class KemonoPostsInfo(KemonoPostsInfoBase, table=True):
     __tablename__ = "kemono_posts_info"
+    hash_id: Optional[str] = Field(nullable=False, index=True, unique=True)
     id: Optional[int] = Field(default=None, primary_key=True)
     
     posts: list["KemonoPost"] = Relationship(back_populates="info", sa_relationship_kwargs={"lazy": "joined"})
@@ -25,6 +25,7 @@ class KemonoUserCreate(KemonoUserBase):
 class KemonoUser(KemonoUserBase, table=True):
     __tablename__ = "kemono_user"
     __name__ = "Kemono user"
+    hash_id: Optional[str] = Field(nullable=False, index=True, unique=True)
     id: Optional[int] = Field(default=None, primary_key=True)
     kemono_creator: "KemonoCreator" = Relationship(
         back_populates="kemono_users", 
@@ -3,6 +3,6 @@ from .kemono_creator import KemonoCreatorHandle
 from .kemono_user import KemonoUserHandle
 from .kemono_post import KemonoPostHandle
 from .kemono_posts_info import KemonoPostsInfoHandle
-from .kemono_attachment import KemonoAttachmentHandle
+from .kemono_attachment import KemonoAttachmentHandle, AttachmentRow
 from .kemono_file import KemonoFileHandle
 from .formatter_params import FormatterParamsHandle
\ No newline at end of file
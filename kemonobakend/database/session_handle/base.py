@@ -1,4 +1,6 @@
-from sqlmodel import SQLModel, select, or_
+from sqlmodel import SQLModel, select, or_, insert, delete, update
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel.sql.expression import SelectOfScalar
 from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi import HTTPException
@@ -27,16 +29,75 @@ class BaseSessionHandle:
         if commit:
             await self.session.commit()
 
+    async def bulk_insert(self, rows: list[dict], batch_size: int = 1000, commit: bool = True) -> int:
+        '''Insert plain dict rows with Core executemany, bypassing the ORM unit of work.'''
+        if not rows:
+            return 0
+        # pending ORM changes (e.g. deletes of the rows being replaced) must hit the db first
+        await self.session.flush()
+        conn = await self.session.connection()
+        statement = insert(self.__model__class__.__table__)
+        for i in range(0, len(rows), batch_size):
+            await conn.execute(statement, rows[i:i+batch_size])
+        if commit:
+            await self.session.commit()
+        return len(rows)
+
+    async def bulk_upsert(self, rows: list[dict], batch_size: int = 1000, commit: bool = True) -> int:
+        '''`INSERT ... ON CONFLICT(hash_id) DO UPDATE` of plain dict rows, every row must carry the same keys.'''
+        if not rows:
+            return 0
+        await self.session.flush()
+        conn = await self.session.connection()
+        table = self.__model__class__.__table__
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.hash_id],
+            set_={key: statement.excluded[key] for key in rows[0] if key not in ("id", "hash_id")},
+        )
+        for i in range(0, len(rows), batch_size):
+            await conn.execute(statement, rows[i:i+batch_size])
+        if commit:
+            await self.session.commit()
+        return len(rows)
+
+    async def bulk_update(self, rows: list[dict], batch_size: int = 1000, commit: bool = True) -> int:
+        '''Update plain dict rows by their `id` with Core executemany, every row must carry the same keys.'''
+        if not rows:
+            return 0
+        await self.session.flush()
+        conn = await self.session.connection()
+        table = self.__model__class__.__table__
+        values = {key: bindparam(key) for key in rows[0] if key != "id"}
+        # the id bind can't share the column name with the SET values
+        statement = update(table).where(table.c.id == bindparam("_id")).values(values)
+        for i in range(0, len(rows), batch_size):
+            await conn.execute(statement, [{**row, "_id": row["id"]} for row in rows[i:i+batch_size]])
+        if commit:
+            await self.session.commit()
+        return len(rows)
+
     async def delete(self, obj: T, commit: bool = True):
         await self.session.delete(obj)
         if commit:
             await self.session.commit()
     
-    async def delete_all(self, objs: list[T], commit: bool = True) -> None:
-        for obj in objs:
-            await self.delete(obj, commit=False)
+    async def delete_all(self, objs: list[T], commit: bool = True, batch_size: int = 500) -> int:
+        ids = [obj.id for obj in objs if obj.id is not None]
+        count = 0
+        for i in range(0, len(ids), batch_size):
+            count += await self.delete_where(self.__model__class__.id.in_(ids[i:i+batch_size]), commit=False)
+        if commit:
+            await self.session.commit()
+        return count
+    
+    async def delete_where(self, *whereclause, commit: bool = True) -> int:
+        '''Set-based `DELETE ... WHERE`, returns the number of deleted rows.'''
+        statement = delete(self.__model__class__).where(*whereclause)
+        result = await self.session.exec(statement)
         if commit:
             await self.session.commit()
+        return result.rowcount
     
     async def update(self, obj: T, commit: bool = True):
         return await self.add(obj, commit)
@@ -1,9 +1,25 @@
-from sqlmodel import select
-from typing import Union, Type, Tuple
+from sqlmodel import select, func, update
+from sqlalchemy import bindparam
+from typing import Union, Type, Tuple, Optional, NamedTuple, AsyncIterator, Sequence
 from kemonobakend.database.models import KemonoAttachment, KemonoAttachmentCreate, KemonoPost
 from kemonobakend.database.model_builder import build_kemono_attachments
 from .base import BaseSessionHandle
 
+class AttachmentRow(NamedTuple):
+    '''Column-only view of KemonoAttachment, enough to plan downloads.'''
+    hash_id: str
+    name: str
+    path: str
+    type: str
+    size: Optional[int]
+    sha256: Optional[str]
+    idx: Optional[int]
+    user_hash_id: str
+    post_hash_id: str
+    id: int
+
+_attachment_row_columns = tuple(getattr(KemonoAttachment, field) for field in AttachmentRow._fields)
+
 class KemonoAttachmentHandle(BaseSessionHandle):
     __model__class__: Type[KemonoAttachment] = KemonoAttachment
     async def add_attachments(self, attachments: list[KemonoAttachmentCreate], commit: bool = True):
@@ -13,6 +29,10 @@ class KemonoAttachmentHandle(BaseSessionHandle):
         ]
         await self.add_all(attachments, commit)
     
+    async def bulk_add_attachments(self, attachments: list[KemonoAttachmentCreate], commit: bool = True) -> int:
+        rows = [attachment.model_dump(exclude={"post"}) for attachment in attachments]
+        return await self.bulk_insert(rows, commit=commit)
+    
     async def add_attachments_by_kwds(self, args: list[dict], post_hash_id: str = None):
         attachments = build_kemono_attachments(post_hash_id, args)
         await self.add_all(attachments)
@@ -23,11 +43,41 @@ class KemonoAttachmentHandle(BaseSessionHandle):
         attachments = (await self.session.exec(statement)).unique().all()
         return attachments
     
+    async def stream_attachment_rows(self, user_hash_ids: list[str], where: Sequence = (), batch_size: int = 2000) -> AsyncIterator[list[AttachmentRow]]:
+        '''Yield `AttachmentRow` batches of the users' attachments, no ORM objects are built.'''
+        statement = (
+            select(*_attachment_row_columns)
+            .where(KemonoAttachment.user_hash_id.in_(user_hash_ids), *where)
+            .order_by(KemonoAttachment.id)
+            .execution_options(yield_per=batch_size)
+        )
+        results = await self.session.stream(statement)
+        async for rows in results.partitions():
+            yield [AttachmentRow._make(row) for row in rows]
+    
+    async def set_sizes(self, sizes: dict[str, int], commit: bool = True) -> int:
+        '''Store file sizes found while downloading, `{attachment hash_id: size}`.'''
+        if not sizes:
+            return 0
+        conn = await self.session.connection()
+        table = KemonoAttachment.__table__
+        statement = update(table).where(table.c.hash_id == bindparam("_hash_id")).values(size=bindparam("size"))
+        await conn.execute(statement, [{"_hash_id": hash_id, "size": size} for hash_id, size in sizes.items()])
+        if commit:
+            await self.session.commit()
+        return len(sizes)
+    
+    async def count_by_user(self, user_hash_id: str) -> int:
+        statement = select(func.count()).select_from(KemonoAttachment).where(KemonoAttachment.user_hash_id == user_hash_id)
+        return (await self.session.exec(statement)).one()
+    
     async def get_attachments_kwds_by_post(self, post_hash_id: str):
         statement = select(KemonoAttachment).where(KemonoAttachment.post_hash_id == post_hash_id)
         results = await self.session.exec(statement)
         return results.unique().all()
 
-    async def delete_all_by_user(self, user_hash_id: str, commit: bool = True):
-        attachments = await self.get_attachments_by_user(user_hash_id)
-        await self.delete_all(attachments, commit)
\ No newline at end of file
+    async def delete_all_by_user(self, user_hash_id: str, commit: bool = True) -> int:
+        return await self.delete_where(KemonoAttachment.user_hash_id == user_hash_id, commit=commit)
+    
+    async def delete_all_by_posts(self, post_hash_ids: list[str], commit: bool = True) -> int:
+        return await self.delete_where(KemonoAttachment.post_hash_id.in_(post_hash_ids), commit=commit)
@@ -11,6 +11,10 @@ class KemonoCreatorHandle(BaseSessionHandle):
         kemono_creator = creator.to_sqlmodel()
         return await self.add(kemono_creator, commit=commit)
     
+    async def upsert_creators(self, creators: list[KemonoCreatorCreate], commit: bool = True) -> int:
+        rows = [creator.model_dump(exclude={"kemono_users"}) for creator in creators]
+        return await self.bulk_upsert(rows, commit=commit)
+    
     async def get_creator_by_name(self, name: str) -> KemonoCreator:
         statement = select(KemonoCreator).where(KemonoCreator.name == name)
         result = (await self.session.exec(statement)).first()
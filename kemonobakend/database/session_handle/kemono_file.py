@@ -2,6 +2,7 @@ from sqlmodel import select
 from typing import Union, Type, Tuple
 from kemonobakend.database.models import KemonoFile, KemonoFileCreate
 from kemonobakend.database.model_builder import build_kemono_file_by_kwd
+from kemonobakend.log import logger
 
 from .base import BaseSessionHandle
 
@@ -32,26 +33,18 @@ class KemonoFileHandle(BaseSessionHandle):
         statement = select(KemonoFile).where(KemonoFile.post_hash_id == post_hash_id)
         return (await self.session.exec(statement)).all()
     
-    async def delete_files_by_formatter_name(self, formatter_name: str, commit: bool = True):
-        statement = select(KemonoFile).where(KemonoFile.formatter_name == formatter_name)
-        files = (await self.session.exec(statement)).all()
+    async def delete_files_by_formatter_name(self, formatter_name: str, commit: bool = True) -> int:
         try:
-            for file in files:
-                await self.delete(file, commit=False)
-            if commit:
-                await self.session.commit()
+            return await self.delete_where(KemonoFile.formatter_name == formatter_name, commit=commit)
         except Exception as e:
-            return False
-        return True
+            logger.error(f"Error deleting kemono files of formatter {formatter_name}: {e}")
+            return 0
 
-    async def delete_files_by_user(self, user_hash_id: str, formatter_name: str, commit: bool = True):
-        statement = select(KemonoFile).where(KemonoFile.user_hash_id == user_hash_id, KemonoFile.formatter_name == formatter_name)
-        files = (await self.session.exec(statement)).all()
+    async def delete_files_by_user(self, user_hash_id: str, formatter_name: str, commit: bool = True) -> int:
         try:
-            for file in files:
-                await self.delete(file, commit=False)
-            if commit:
-                await self.session.commit()
+            return await self.delete_where(
+                KemonoFile.user_hash_id == user_hash_id, KemonoFile.formatter_name == formatter_name, commit=commit
+            )
         except Exception as e:
-            return False
-        return True
\ No newline at end of file
+            logger.error(f"Error deleting kemono files of user {user_hash_id} with formatter {formatter_name}: {e}")
+            return 0
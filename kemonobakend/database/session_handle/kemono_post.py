@@ -1,6 +1,7 @@
-from sqlmodel import select
+from sqlmodel import select, update
+from sqlalchemy import Row
 from fastapi import HTTPException
-from typing import Type
+from typing import Type, Optional
 from kemonobakend.database.models import KemonoPost, KemonoPostCreate
 from kemonobakend.database.model_builder import build_kemono_post
 from .base import BaseSessionHandle
@@ -15,6 +16,14 @@ class KemonoPostHandle(BaseSessionHandle):
         posts = [post.to_sqlmodel() for post in posts]
         return await self.add_all(posts, commit)
     
+    async def bulk_add_posts(self, posts: list[KemonoPostCreate], commit: bool = True) -> int:
+        rows = [post.model_dump(exclude={"attachments", "info"}) for post in posts]
+        return await self.bulk_insert(rows, commit=commit)
+    
+    async def bulk_upsert_posts(self, posts: list[KemonoPostCreate], commit: bool = True) -> int:
+        rows = [post.model_dump(exclude={"attachments", "info"}) for post in posts]
+        return await self.bulk_upsert(rows, commit=commit)
+    
     async def add_post_by_kwd(self, commit: bool = True, **kwargs) -> KemonoPost:
         try:
             post = build_kemono_post(**kwargs)
@@ -27,14 +36,32 @@ class KemonoPostHandle(BaseSessionHandle):
         results = await self.session.exec(statement)
         return results.unique().all()
     
-    async def delete_all_by_user(self, user_hash_id: str, commit: bool = True):
-        statement = select(KemonoPost).where(KemonoPost.user_hash_id == user_hash_id)
+    async def get_post_rows_by_user(self, user_hash_id: str) -> dict[str, Row]:
+        '''Plain column rows of the user's posts keyed by hash_id, for filters that look at the post.'''
+        statement = select(*KemonoPost.__table__.columns).where(KemonoPost.user_hash_id == user_hash_id)
         results = await self.session.exec(statement)
-        posts = results.all()
-        await self.delete_all(posts, commit)
+        return {row.hash_id: row for row in results.all()}
     
-    async def delete_all_by_info(self, posts_info_hash_id: str, commit: bool = True):
-        statement = select(KemonoPost).where(KemonoPost.posts_info_hash_id == posts_info_hash_id)
-        results = await self.fetch_all(statement)
-        await self.delete_all(results, commit)
+    async def get_edited_by_user(self, user_hash_id: str) -> dict[str, Optional[str]]:
+        '''`edited` of the user's posts keyed by hash_id, what an incremental sync compares against.'''
+        statement = select(KemonoPost.hash_id, KemonoPost.edited).where(KemonoPost.user_hash_id == user_hash_id)
+        results = await self.session.exec(statement)
+        return dict(results.all())
+    
+    async def set_posts_info_by_user(self, user_hash_id: str, posts_info_hash_id: str, commit: bool = True) -> int:
+        statement = (
+            update(KemonoPost)
+            .where(KemonoPost.user_hash_id == user_hash_id)
+            .values(posts_info_hash_id=posts_info_hash_id)
+        )
+        result = await self.session.exec(statement)
+        if commit:
+            await self.session.commit()
+        return result.rowcount
+    
+    async def delete_all_by_user(self, user_hash_id: str, commit: bool = True) -> int:
+        return await self.delete_where(KemonoPost.user_hash_id == user_hash_id, commit=commit)
 
+    
+    async def delete_all_by_info(self, posts_info_hash_id: str, commit: bool = True) -> int:
+        return await self.delete_where(KemonoPost.posts_info_hash_id == posts_info_hash_id, commit=commit)
\ No newline at end of file
@@ -1,4 +1,5 @@
 from sqlmodel import select
+from sqlalchemy.orm import noload
 from typing import Type
 from datetime import datetime
 from kemonobakend.database.models import KemonoPostsInfoCreate, KemonoPostsInfo
@@ -26,5 +27,6 @@ class KemonoPostsInfoHandle(BaseSessionHandle):
         return await self.fetch_one(statement)
     
     async def get_info_by_user_hash_id(self, user_hash_id: str) -> KemonoPostsInfo:
-        statement = select(KemonoPostsInfo).where(KemonoPostsInfo.user_hash_id == user_hash_id)
+        # the posts are queried by user when needed, joining them all here only to read the info is wasted
+        statement = select(KemonoPostsInfo).where(KemonoPostsInfo.user_hash_id == user_hash_id).options(noload(KemonoPostsInfo.posts))
         return await self.fetch_one(statement)
\ No newline at end of file
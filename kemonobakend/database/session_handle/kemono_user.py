@@ -1,4 +1,4 @@
-from sqlmodel import select, or_
+from sqlmodel import select
 from typing import Type
 from kemonobakend.database.models import KemonoUser, KemonoUserCreate
 from kemonobakend.database.model_builder import build_kemono_user_by_kwd
@@ -12,6 +12,10 @@ class KemonoUserHandle(BaseSessionHandle):
         user = user.to_sqlmodel()
         return await self.add(user, commit)
     
+    async def upsert_users(self, users: list[KemonoUserCreate], commit: bool = True) -> int:
+        rows = [user.model_dump(exclude={"kemono_creator"}) for user in users]
+        return await self.bulk_upsert(rows, commit=commit)
+    
     async def add_user_by_kwd(self, commit: bool = True, **kwargs) -> KemonoUser:
         user = build_kemono_user_by_kwd(**kwargs)
         return await self.add(user, commit)
@@ -31,7 +35,7 @@ class KemonoUserHandle(BaseSessionHandle):
     async def get_users(self, user_hash_ids: list[str]) -> list[KemonoUser]:
         if not user_hash_ids:
             return []
-        statement = select(KemonoUser).where(or_(KemonoUser.hash_id == hash_id for hash_id in user_hash_ids))
+        statement = select(KemonoUser).where(KemonoUser.hash_id.in_(user_hash_ids))
         return await self.fetch_all(statement)
     
     async def get_users_by_link_accounts(self, link_accounts: list[dict]):
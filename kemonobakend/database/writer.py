@@ -0,0 +1,153 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from kemonobakend.log import logger
+
+from .combine import AsyncCombineSession
+
+WriteFunc = Callable[[AsyncCombineSession], Awaitable[Any]]
+
+class WriteCommand:
+    __slots__ = ("func", "future")
+
+    def __init__(self, func: WriteFunc, future: asyncio.Future):
+        self.func = func
+        self.future = future
+
+class DatabaseWriter:
+    '''
+    Single writer task for the sqlite database. Producers `submit` write commands, async callables taking
+    an `AsyncCombineSession` and writing with `commit=False`; the task drains the queue and runs the
+    commands it finds in one transaction, so many small writes cost one commit.
+    A failing batch is rolled back and its commands are retried one transaction each,
+    so a bad command only fails its own submitter. If the task itself dies (e.g. it is cancelled),
+    the commands it holds or has queued fail instead of leaving their submitters waiting.
+    '''
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        lock: Optional[asyncio.Lock] = None,
+        max_batch: int = 256,
+        max_delay: float = 0.01
+    ):
+        self.engine = engine
+        # shared with other write sessions of the same engine, when there are any
+        self.lock = lock or asyncio.Lock()
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue[Optional[WriteCommand]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.is_running:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        '''Write everything already submitted, then stop the task.'''
+        if self.is_running:
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+
+    async def submit(self, func: WriteFunc) -> Any:
+        '''
+        Queue `func` and wait until its transaction is committed, returns what `func` returned.
+        A submitter cancelled before its command runs drops the command, once the batch is running it still commits.
+        '''
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(WriteCommand(func, future))
+        return await future
+
+    async def write(self, handle: str, method: str, *args, **kwargs) -> Any:
+        '''Shortcut for one handle call, e.g. `write("kemono_file", "bulk_insert", rows)`.'''
+        async def func(session: AsyncCombineSession):
+            return await getattr(getattr(session, handle), method)(*args, commit=False, **kwargs)
+        return await self.submit(func)
+
+    async def _next_batch(self) -> tuple[list[WriteCommand], bool]:
+        command = await self._queue.get()
+        if command is None:
+            return [], True
+        batch = [command]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                # producers often submit right after each other, give them a moment to join the batch
+                command = await asyncio.wait_for(self._queue.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            if command is None:
+                return batch, True
+            batch.append(command)
+        return batch, False
+
+    async def _run(self):
+        stop = False
+        batch: list[WriteCommand] = []
+        try:
+            while not stop:
+                batch, stop = await self._next_batch()
+                batch = [command for command in batch if not command.future.cancelled()]
+                if batch:
+                    await self._run_batch(batch)
+        except BaseException as e:
+            logger.error(f"Database writer stopped: {e!r}")
+            raise
+        finally:
+            error = RuntimeError("Database writer stopped")
+            for command in batch:
+                self._set_exception(command, error)
+            while not self._queue.empty():
+                command = self._queue.get_nowait()
+                if command is not None:
+                    self._set_exception(command, error)
+
+    async def _run_batch(self, batch: list[WriteCommand]):
+        async with self.lock:
+            try:
+                results = await self._execute(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._set_exception(batch[0], e)
+                    return
+                logger.warning(f"Write batch of {len(batch)} failed, retrying one by one: {e}")
+                for command in batch:
+                    try:
+                        result, = await self._execute([command])
+                    except Exception as e:
+                        self._set_exception(command, e)
+                    else:
+                        self._set_result(command, result)
+                return
+        for command, result in zip(batch, results):
+            self._set_result(command, result)
+
+    async def _execute(self, batch: list[WriteCommand]) -> list[Any]:
+        # results are read after the commit, e.g. rows a command loaded to diff against
+        async with AsyncCombineSession(self.engine, expire_on_commit=False) as session:
+            try:
+                results = [await command.func(session) for command in batch]
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+        return results
+
+    @staticmethod
+    def _set_result(command: WriteCommand, result: Any):
+        if not command.future.done():
+            command.future.set_result(result)
+
+    @staticmethod
+    def _set_exception(command: WriteCommand, exc: BaseException):
+        if not command.future.done():
+            command.future.set_exception(exc)
@@ -1,2 +1,2 @@
 from .downloader import Downloader
-from .types import DownloadResult, DownloadStatus, ProgressTracker, DownloadProperties
\ No newline at end of file
+from .types import DownloadResult, DownloadStatus, DownloadStats, ProgressTracker, DownloadProperties
\ No newline at end of file
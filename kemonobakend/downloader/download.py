@@ -1,6 +1,9 @@
 import os
+import sys
 import asyncio
+import bisect
 from aiohttp import (
+    ClientResponse,
     ClientError,
         ClientPayloadError, 
         ClientResponseError, 
@@ -15,16 +18,21 @@ from aiohttp import (
 )
 import hashlib
 from aiofiles import open as aio_open
+from contextlib import asynccontextmanager, AsyncExitStack
 from pathlib import Path
 from time import time as now_time
 from typing import Optional, Awaitable
 
-from kemonobakend.utils import async_verify_file_sha256, path_join, IdGenerator
+from kemonobakend.config import settings
+from kemonobakend.utils import async_verify_file_sha256, path_join, os_fspath, IdGenerator, get_hash_service
 from kemonobakend.log import logger
 from .types import (
     DownloadInfo, DownloadResult, DownloadProperties, DownloadStatus,
-    get_ranges, TaskId
+    get_ranges, ranges_from_starts, TaskId, PREVIEW_FILE_TYPES
 )
+from .writer import PositionalFileWriter, ChunkStateFile
+from .hasher import StreamingHasher
+from .planner import ChunkPlanner
 
 
 class DownloadController:
@@ -66,6 +74,9 @@ class DownloadController:
         if self.task.status.is_cancelled:
             return True
 
+# cancel message of a worker whose range was finished by its hedged request
+HEDGE_WON = "hedged request finished the range"
+
 class DownloadSchedulerTask:
     def __init__(self, scheduler: 'DownloadScheduler', range):
         self.scheduler = scheduler
@@ -73,20 +84,60 @@ class DownloadSchedulerTask:
         
         self.start_pos = range[0]
         self.end_pos = range[1]
-        self.range_str = f"{self.start_pos}-{self.end_pos}"
-        self.range_size = self.end_pos - self.start_pos + 1
         self.chunk_size = 1024 * 256
         self.handle_size = 1024 * 512
         self.now_size = 0
+        self.done = False
         self.mode: str = "wb"
-        self.chunk_path = Path(path_join(self.download_task.prop.tmp_path, f'{self.download_task.info.file_name}_{self.range_str}.part'))
-        self.last_speed_check = None
-        self.speed_check_interval = 10
+        # named by the start only, a split moves the end of the range while its part file is open
+        self.chunk_path = Path(path_join(self.download_task.prop.tmp_path, f'{self.download_task.part_name}_{self.start_pos}.part'))
+        self.worker: Optional[asyncio.Task] = None
+        self.hedge: Optional[asyncio.Task] = None
+        self._hedge_data: Optional[tuple[int, bytes]] = None
+        self._stream_start: Optional[tuple[float, int]] = None
+    
+    @property
+    def range_str(self):
+        return f"{self.start_pos}-{self.end_pos}"
+    
+    @property
+    def range_size(self):
+        return self.end_pos - self.start_pos + 1
+    
+    @property
+    def remaining_size(self):
+        return self.range_size - self.now_size
+    
+    @property
+    def streaming(self):
+        return self._stream_start is not None and not self.done
+    
+    @property
+    def speed(self) -> float:
+        '''Average speed of the current request.'''
+        if self._stream_start is None:
+            return 0.0
+        start_time, start_size = self._stream_start
+        return (self.now_size - start_size) / max(now_time() - start_time, 1e-3)
+    
+    @property
+    def eta(self) -> float:
+        speed = self.speed
+        return self.remaining_size / speed if speed > 0 else float("inf")
+    
+    def truncate(self, end_pos: int):
+        '''Move the end of the range back, the running request stops there and the tail belongs to another range.'''
+        range_str = self.range_str
+        self.end_pos = end_pos
+        if self.scheduler.direct_write:
+            self.scheduler.state.rename(range_str, self.range_str)
     
     def update_progress(self, size):
         self.download_task.prop.progress_tracker.advance(self.download_task.task_id, size)
     
     def pre_start(self):
+        if self.scheduler.direct_write:
+            return self._pre_start_direct()
         if not self.chunk_path.parent.exists():
             self.chunk_path.parent.mkdir(parents=True)
         if self.chunk_path.exists():
@@ -105,26 +156,123 @@ class DownloadSchedulerTask:
         else:
             self.mode = 'wb'
         return True
+    
+    def _pre_start_direct(self):
+        written_size = self.scheduler.state.get(self.range_str)
+        if written_size >= self.range_size:
+            logger.debug(f"File: {self.download_task.info.file_name} range {self.range_str} already written, skipping download")
+            return False
+        elif written_size != self.now_size:
+            self.now_size = written_size
+            self.update_progress(written_size)
+            logger.debug(f"File: {self.download_task.info.file_name} range {self.range_str} resumed at {written_size}/{self.range_size}")
+        return True
+    
+    @asynccontextmanager
+    async def open_writer(self):
+        '''Yield an async write function, which writes to the part file or directly to the final file.'''
+        if self.scheduler.direct_write:
+            async def write(chunk: bytes):
+                offset = self.start_pos + self.now_size
+                await self.scheduler.writer.write(offset, chunk)
+                if self.scheduler.hasher is not None:
+                    self.scheduler.hasher.feed(offset, chunk)
+                self.scheduler.state.update(self.range_str, self.now_size + len(chunk))
+                self.scheduler.state.save()
+            yield write
+        else:
+            async with aio_open(self.chunk_path, self.mode) as f:
+                await f.seek(self.now_size)
+                yield f.write
 
     async def download(self, retries=3):
         self._retries = retries
         self.scheduler.running_count += 1
         try:
             while self._retries > 0:
-                ret = await self._download()
-                if ret == "resume" or ret == "speed_check":
+                try:
+                    ret = await self._download()
+                except asyncio.CancelledError as e:
+                    # cancelled outside of the request, e.g. while taking a session
+                    if not self.hedge_won(e):
+                        raise
+                    ret = "hedged"
+                if ret == "resume":
                     continue
                 elif ret == "cancel":
                     self.download_task.result.message = "Cancelled by user"
                     return False
-                elif ret is True:
+                elif ret == "hedged":
+                    await self.write_hedge()
+                    ret = True
+                if ret is True:
+                    if self._stream_start is not None:
+                        self.scheduler.range_speeds.append(self.speed)
+                    self.scheduler.trigger_hash_catch_up()
                     return True
                 self._retries -= 1
             return False
         finally:
+            self.done = True
+            if self.hedge is not None:
+                self.hedge.cancel()
             self.scheduler.running_count -= 1
             self.scheduler.wait_count -= 1
     
+    def start_hedge(self):
+        '''Request the rest of a straggling range again on another session, the first one to finish wins.'''
+        self.hedge = asyncio.create_task(self._hedge(self.start_pos + self.now_size, self.end_pos))
+    
+    async def _hedge(self, start: int, end: int):
+        try:
+            async with self.download_task.prop.session_pool.get() as session:
+                async with session.get(self.download_task.info.url, headers={'Range': f'bytes={start}-{end}'}) as response:
+                    if response.status != 206:
+                        return
+                    data = await response.read()
+        except Exception as e:
+            logger.debug(f"File: {self.download_task.info.file_name} hedged request of range {start}-{end} failed: {e}")
+            return
+        # the range is not split any more once it is hedged, only check that the worker has not won
+        if self.done or len(data) != end - start + 1 or end != self.end_pos:
+            return
+        self._hedge_data = (start, data)
+        self.worker.cancel(msg=HEDGE_WON)
+    
+    def hedge_won(self, e: asyncio.CancelledError) -> bool:
+        '''
+        Whether `e` is the cancellation sent by the hedge of this range, which is then swallowed.
+        Any other cancellation, also one arriving together with it, must go on.
+        '''
+        if self._hedge_data is None or e.args != (HEDGE_WON,):
+            return False
+        return asyncio.current_task().uncancel() == 0
+    
+    async def write_hedge(self):
+        '''Write the hedged bytes the worker has not written yet.'''
+        start, data = self._hedge_data
+        chunk = data[self.start_pos + self.now_size - start:]
+        # the part file exists already, do not truncate it
+        self.mode = 'r+b'
+        async with self.open_writer() as write:
+            await write(chunk)
+        self.now_size += len(chunk)
+        self.download_task.result.downloaded_size += len(chunk)
+        self.update_progress(len(chunk))
+        logger.debug(f"File: {self.download_task.info.file_name} range {self.range_str} finished by the hedged request")
+    
+    @asynccontextmanager
+    async def open_response(self, range_start: int):
+        '''Response for the rest of the range, the one left open by the size probe of the task when it fits.'''
+        if (first_response := self.download_task.take_first_response(range_start)) is not None:
+            stack, response = first_response
+            async with stack:
+                yield response
+            return
+        async with self.download_task.prop.session_pool.get() as session:
+            async with session.get(self.download_task.info.url, headers={'Range': f'bytes={range_start}-{self.end_pos}'}) as response:
+                yield response
+    
     async def _download(self):
         def todo(size):
             nonlocal chunked_size
@@ -135,84 +283,92 @@ class DownloadSchedulerTask:
         if not self.pre_start():
             self.update_progress(self.range_size)
             return True
-        async with self.download_task.prop.session_pool.get() as session:
-            await self.download_task.controller.start()
-            range_start = self.start_pos + self.now_size
-            try:
-                async with session.get(self.download_task.info.url, headers={'Range': f'bytes={range_start}-{self.end_pos}'}) as response:
-                    if response.status == 206:
-                        async with aio_open(self.chunk_path, self.mode) as f:
-                            await f.seek(self.now_size)
-                            chunked_size = 0
-                            async for chunk in response.content.iter_chunked(self.chunk_size):
-                                chunk_size = len(chunk)
-                                await f.write(chunk)
-                                self.now_size += chunk_size
-                                self.download_task.result.downloaded_size += chunk_size
-                                self.update_progress(chunk_size)
-                                if self.speed_check():
-                                    return "speed_check"
-                                if todo(chunk_size):
-                                    if await self.download_task.controller.handle_pause():
-                                        return "resume"
-                                    if await self.download_task.controller.handle_cancel():
-                                        return "cancel"
-                                    chunked_size = 0
-                            return True
-                    elif response.status == 200:
-                        logger.warning(f"Download of file: {self.download_task.info.file_name} may have no range support")
-                        return False
-                    elif response.status == 416:
-                        logger.warning(f"Download of file: {self.download_task.info.file_name} range {self.start_pos}-{self.end_pos} is out of bounds")
-                        return False
-                    elif response.status == 429:
-                        logger.warning(f"Download of file: {self.download_task.info.file_name} rate limit exceeded")
-                        await asyncio.sleep(2)
-                    elif response.status == 404:
-                        logger.error(f"Download of file: {self.download_task.info.file_name} not found, url: {self.download_task.info.url}")
-                    elif response.status >= 500:
-                        logger.error(f"Download of file: {self.download_task.info.file_name} failed with Server Error [{response.status}]")
-                    else:
-                        logger.error(f"Download of file: {self.download_task.info.file_name} failed with wrong status [{response.status}]")
-                        return False
-            except ClientProxyConnectionError as e:
-                logger.error(f"({self._retries}){e}")
-            except ClientSSLError as e:
-                logger.error(f"({self._retries}){e}")
-            except ClientConnectionError as e:
-                logger.error(f"({self._retries}){e}")
-            except ClientHttpProxyError as e:
-                logger.error(f"({self._retries}){e}")
-            except ClientPayloadError as e:
-                logger.error(f"({self._retries}){e}")
-            except ClientResponseError as e:
-                logger.error(f"({self._retries}){e}")
-            except KeyboardInterrupt:
-                logger.error("KeyboardInterrupt")
-                self.download_task.status.set_status(DownloadStatus.CANCELLED)
-                return "cancel"
-            except asyncio.CancelledError:
-                logger.error("CancelledError")
-                self.download_task.status.set_status(DownloadStatus.CANCELLED)
-                return "cancel"
-            except Exception as e:
-                logger.error(f"({self._retries}){e}")
-    
-    def speed_check(self) -> bool:
+        await self.download_task.controller.start()
+        range_start = self.start_pos + self.now_size
         try:
-            if self.scheduler.wait_count <= 3 and \
-                self.download_task.prop.progress_tracker.get_speed(self.download_task.task_id) < 1024*1024 and \
-                (self.last_speed_check is None or (self.last_speed_check is not None and  now_time() - self.last_speed_check > self.speed_check_interval)):
-                self.last_speed_check = now_time()
-                return True
-        except:
-            pass
-        return False
+            async with self.open_response(range_start) as response:
+                if response.status == 206:
+                    self._stream_start = (now_time(), self.now_size)
+                    async with self.open_writer() as write:
+                        chunked_size = 0
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            if len(chunk) > self.remaining_size:
+                                # the range was split while streaming, the rest is downloaded by the new range
+                                chunk = chunk[:self.remaining_size]
+                            chunk_size = len(chunk)
+                            await write(chunk)
+                            self.now_size += chunk_size
+                            self.download_task.result.downloaded_size += chunk_size
+                            self.update_progress(chunk_size)
+                            if self.remaining_size <= 0:
+                                return True
+                            if todo(chunk_size):
+                                if await self.download_task.controller.handle_pause():
+                                    return "resume"
+                                if await self.download_task.controller.handle_cancel():
+                                    return "cancel"
+                                chunked_size = 0
+                        return True
+                elif response.status == 200:
+                    logger.warning(f"Download of file: {self.download_task.info.file_name} may have no range support")
+                    return False
+                elif response.status == 416:
+                    logger.warning(f"Download of file: {self.download_task.info.file_name} range {self.start_pos}-{self.end_pos} is out of bounds")
+                    return False
+                elif response.status == 429:
+                    logger.warning(f"Download of file: {self.download_task.info.file_name} rate limit exceeded")
+                    await asyncio.sleep(2)
+                elif response.status == 404:
+                    logger.error(f"Download of file: {self.download_task.info.file_name} not found, url: {self.download_task.info.url}")
+                elif response.status >= 500:
+                    logger.error(f"Download of file: {self.download_task.info.file_name} failed with Server Error [{response.status}]")
+                else:
+                    logger.error(f"Download of file: {self.download_task.info.file_name} failed with wrong status [{response.status}]")
+                    return False
+        except ClientProxyConnectionError as e:
+            logger.error(f"({self._retries}){e}")
+        except ClientSSLError as e:
+            logger.error(f"({self._retries}){e}")
+        except ClientConnectionError as e:
+            logger.error(f"({self._retries}){e}")
+        except ClientHttpProxyError as e:
+            logger.error(f"({self._retries}){e}")
+        except ClientPayloadError as e:
+            logger.error(f"({self._retries}){e}")
+        except ClientResponseError as e:
+            logger.error(f"({self._retries}){e}")
+        except KeyboardInterrupt:
+            logger.error("KeyboardInterrupt")
+            self.download_task.status.set_status(DownloadStatus.CANCELLED)
+            return "cancel"
+        except asyncio.CancelledError as e:
+            if self.hedge_won(e):
+                return "hedged"
+            logger.error("CancelledError")
+            self.download_task.status.set_status(DownloadStatus.CANCELLED)
+            return "cancel"
+        except Exception as e:
+            logger.error(f"({self._retries}){e}")
 
 class DownloadScheduler:
     def __init__(self, task: 'DownloadTask'):
         self.task = task
-        ranges = get_ranges(self.task.info.file_size, chunk_size=self.task.chunk_size, chunks=self.task.num_chunks)
+        self.direct_write = self.task.prop.direct_write
+        self.hasher: Optional[StreamingHasher] = None
+        self._hash_task: Optional[asyncio.Task] = None
+        if self.direct_write:
+            # written next to save_path, renamed to save_path when completed
+            part_path = os_fspath(self.task.info.save_path) + ".part"
+            self.writer = PositionalFileWriter(part_path, self.task.info.file_size)
+            self.state = ChunkStateFile(part_path + ".json", self.task.info.file_size).load()
+            if not self.writer.path.exists():
+                self.state.reset()
+            if self.task.info.file_sha256 is not None and self.task.prop.file_strict:
+                self.hasher = StreamingHasher(self.task.info.file_size, self.read_direct_file, self.task.prop.hash_window_size)
+        self.planner: Optional[ChunkPlanner] = None
+        if self.task.prop.adaptive_chunks and self.task.chunk_size is None and self.task.num_chunks is None:
+            self.planner = ChunkPlanner(self.task.prop.per_task_max_concurrent)
+        ranges = self.plan_ranges()
         self.running_count = 0
         self.wait_count = len(ranges)
         self.tasks = [
@@ -221,6 +377,48 @@ class DownloadScheduler:
         ]
         self.failed_tasks = []
         self.semaphore = asyncio.Semaphore(self.task.prop.per_task_max_concurrent)
+        self._running: dict[asyncio.Task, DownloadSchedulerTask] = {}
+        # speeds of finished ranges, a running range below straggler_ratio of their mean is a straggler
+        self.range_speeds: list[float] = []
+        self.straggler_ratio = 0.5
+        self.journal_interval = 1.0
+        self._journal_time = 0
+        self._journaled_ranges: Optional[dict[str, int]] = None
+    
+    def plan_ranges(self) -> list[tuple[int, int]]:
+        '''
+        Ranges of a previous run when there are any on disk or in the journal, otherwise the initial plan.
+        Any subset of the starts of a previous layout is a valid layout, a range never holds bytes past the
+        start of the range split off from it.
+        '''
+        size = self.task.info.file_size
+        if self.direct_write and self.state.ranges:
+            written = {int(range_str.split("-")[0]): written_size for range_str, written_size in self.state.ranges.items()}
+            ranges = ranges_from_starts(size, written)
+            # a range that never wrote is missing from the state, the range before it grows over it
+            self.state.ranges = {f"{start}-{end}": written.get(start, 0) for start, end in ranges}
+            return ranges
+        starts = {int(range_str.split("-")[0]) for range_str in self.task.resume_ranges or ()}
+        if not self.direct_write:
+            starts.update(self.find_part_starts())
+        if starts:
+            return ranges_from_starts(size, starts)
+        if self.planner is not None:
+            return self.planner.initial_ranges(size)
+        return get_ranges(size, chunk_size=self.task.chunk_size, chunks=self.task.num_chunks)
+    
+    def find_part_starts(self) -> list[int]:
+        tmp_path = Path(self.task.prop.tmp_path)
+        prefix = f"{self.task.part_name}_"
+        # the range at 0 is always started first, skip listing the tmp dir for fresh tasks
+        if not (tmp_path / f"{prefix}0.part").exists():
+            return []
+        starts = []
+        for path in tmp_path.iterdir():
+            start = path.name.removeprefix(prefix).removesuffix(".part")
+            if path.name.startswith(prefix) and path.name.endswith(".part") and start.isdigit():
+                starts.append(int(start))
+        return starts
     
     async def merge_files(self):
         async def merge_file(task: DownloadSchedulerTask, sha256_obj):
@@ -243,7 +441,54 @@ class DownloadScheduler:
             await merge_file(task, sha256_obj)
         return sha256_obj.hexdigest()
     
+    async def read_direct_file(self, offset: int, size: int) -> bytes:
+        async with aio_open(self.writer.path, 'rb') as f:
+            await f.seek(offset)
+            return await f.read(size)
+    
+    def written_prefix_end(self) -> int:
+        '''End position of the contiguous written bytes from the start of the file.'''
+        end = 0
+        for task in self.tasks:
+            if task.start_pos != end:
+                break
+            end = task.start_pos + self.state.get(task.range_str)
+            if end <= task.end_pos:
+                break
+        return end
+    
+    def trigger_hash_catch_up(self):
+        '''Hash written ranges in background, so the final digest only has to cover the tail.'''
+        if self.hasher is None:
+            return
+        if self._hash_task is None or self._hash_task.done():
+            self._hash_task = asyncio.create_task(self._hash_catch_up())
+    
+    async def _hash_catch_up(self):
+        try:
+            while self.hasher.offset < (end := self.written_prefix_end()):
+                await self.hasher.catch_up(end)
+        except Exception as e:
+            logger.warning(f"Task {self.task.task_id} {self.task.info.file_name} streaming hash catch up failed: {e}")
+    
+    async def calc_direct_file_sha256(self):
+        if self.hasher is None:
+            return None
+        if self._hash_task is not None:
+            await self._hash_task
+        return await self.hasher.hexdigest()
+    
+    def move_direct_file(self):
+        p = Path(self.task.info.save_path)
+        if not p.parent.exists():
+            p.parent.mkdir(parents=True)
+        os.replace(self.writer.path, p)
+        self.state.remove()
+    
     def remove_tmp_files(self):
+        if self.direct_write:
+            self.state.remove()
+            return
         for task in self.tasks:
             try:
                 task.chunk_path.unlink()
@@ -251,9 +496,24 @@ class DownloadScheduler:
                 logger.warning(f"Failed to remove tmp file: {task.chunk_path}, {e}")
     
     async def start_download(self, background_result: bool = False):
-        tasks = await asyncio.gather(*[self.task.semaphore_limited_task(task.download(), self.semaphore) for task in self.tasks])
-        if not all(tasks):
-            self.failed_tasks = [task for task, success in zip(self.tasks, tasks) if not success]
+        if self.direct_write:
+            self.writer.open()
+            # hash ranges resumed from a previous run
+            self.trigger_hash_catch_up()
+        try:
+            results = await self.run_tasks()
+        finally:
+            if self.direct_write:
+                self.writer.close()
+                self.state.save(force=True)
+            self.journal_ranges(force=True)
+        if not all(results.values()):
+            if self._hash_task is not None:
+                self._hash_task.cancel()
+            self.failed_tasks = [task for task, success in results.items() if not success]
+            if self.task.status.is_cancelled:
+                # resumable, the journal keeps cancelled tasks
+                return False
             self.task.status.set_status(DownloadStatus.FAILED)
             self.task.result.message = "有部分分片下载失败"
             return False
@@ -263,20 +523,127 @@ class DownloadScheduler:
             return True
         return await self.complete()
 
+    def spawn(self, task: DownloadSchedulerTask):
+        task.worker = asyncio.create_task(self.task.semaphore_limited_task(task.download(), self.semaphore))
+        self._running[task.worker] = task
+    
+    async def run_tasks(self) -> dict[DownloadSchedulerTask, bool]:
+        '''Download all ranges, ranges split off while running are awaited as well.'''
+        results: dict[DownloadSchedulerTask, bool] = {}
+        for task in self.tasks:
+            self.spawn(task)
+        timeout = self.planner.interval if self.planner is not None else settings.download.adaptive_interval
+        try:
+            while self._running:
+                done, _ = await asyncio.wait(self._running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finished = 0
+                for t in done:
+                    results[self._running.pop(t)] = success = t.result()
+                    finished += success
+                self.plan(finished)
+                self.journal_ranges()
+        finally:
+            for t in self._running:
+                t.cancel()
+            self._running.clear()
+        return results
+    
+    def journal_ranges(self, force: bool = False):
+        journal = self.task.prop.journal
+        if journal is None or (not force and now_time() - self._journal_time < self.journal_interval):
+            return
+        self._journal_time = now_time()
+        ranges = {task.range_str: task.now_size for task in self.tasks}
+        # a stalled task would repeat the same record every interval
+        if ranges != self._journaled_ranges:
+            self._journaled_ranges = ranges
+            journal.update_ranges(self.task, ranges)
+    
+    def plan(self, finished: int = 0):
+        '''
+        Split ranges when the planner asks for more connections or when `finished` ranges freed theirs,
+        the new range steals the second half of the slowest running range. Stragglers too small to split
+        are hedged instead.
+        '''
+        active = [task for task in self.tasks if not task.done]
+        if self.planner is not None:
+            count = self.planner.advise(self.task.result.downloaded_size, len(active))
+        else:
+            # static plans keep their connection count, ranges still waiting for a connection go first
+            count = min(finished, self.task.prop.per_task_max_concurrent - len(active))
+        while count > 0:
+            victim = self.pick_victim(active)
+            if victim is None:
+                break
+            active.append(self.split(victim))
+            count -= 1
+        self.hedge_stragglers(active)
+    
+    def pick_victim(self, active: list[DownloadSchedulerTask]) -> Optional[DownloadSchedulerTask]:
+        '''The splittable range expected to finish last, or the largest one when none is streaming yet.'''
+        candidates = [task for task in active if task.hedge is None and self.worth_split(task)]
+        streaming = [task for task in candidates if task.streaming]
+        if streaming:
+            return max(streaming, key=lambda task: (task.eta, task.remaining_size))
+        if candidates:
+            return max(candidates, key=lambda task: task.remaining_size)
+        return None
+    
+    def worth_split(self, task: DownloadSchedulerTask) -> bool:
+        # the bytes the worker is writing right now must stay in its own half
+        if task.remaining_size // 2 < task.chunk_size:
+            return False
+        if self.planner is not None:
+            return self.planner.worth_split(task.remaining_size, task.eta)
+        return task.remaining_size >= 2 * settings.download.adaptive_min_chunk_size and task.eta > settings.download.adaptive_interval
+    
+    def hedge_stragglers(self, active: list[DownloadSchedulerTask]):
+        if not self.task.prop.hedge_tail_size or not self.range_speeds:
+            return
+        typical_speed = sum(self.range_speeds) / len(self.range_speeds)
+        for task in active:
+            if task.streaming and task.hedge is None and task.remaining_size <= self.task.prop.hedge_tail_size \
+                and task.speed < typical_speed * self.straggler_ratio:
+                logger.debug(f"File: {self.task.info.file_name} hedging range {task.range_str}, {task.remaining_size} bytes left at {task.speed:.0f} B/s")
+                task.start_hedge()
+    
+    def split(self, task: DownloadSchedulerTask) -> DownloadSchedulerTask:
+        '''Truncate `task` in the middle of its remaining bytes and start a new range for the second half.'''
+        mid = task.start_pos + task.now_size + task.remaining_size // 2
+        new_task = DownloadSchedulerTask(self, (mid, task.end_pos))
+        task.truncate(mid - 1)
+        bisect.insort(self.tasks, new_task, key=lambda task: task.start_pos)
+        self.wait_count += 1
+        self.spawn(new_task)
+        logger.debug(f"File: {self.task.info.file_name} split range {task.range_str} at {mid}, {len(self._running)} ranges running")
+        return new_task
+    
     async def complete(self):
-        sha256 = await self.merge_files()
+        if self.direct_write:
+            sha256 = await self.calc_direct_file_sha256()
+            output_path = self.writer.path
+        else:
+            sha256 = await self.merge_files()
+            output_path = self.task.info.save_path
         if self.task.info.file_sha256 is not None:
             if self.task.prop.file_strict and sha256 != self.task.info.file_sha256:
                 logger.error(f"Task {self.task.task_id} {self.task.info.file_name} sha256 verification failed")
                 self.task.status.set_status(DownloadStatus.FAILED)
                 self.task.result.message = "文件校验失败"
-                os.remove(self.task.info.save_path)
+                os.remove(output_path)
+                if self.direct_write:
+                    self.state.remove()
                 return False
             elif self.task.prop.file_strict:
                 self.remove_tmp_files()
                 logger.info(f"Task {self.task.task_id} {self.task.info.file_name} sha256 verified")
         else:
             self.remove_tmp_files()
+        if self.direct_write:
+            self.move_direct_file()
+        if sha256 is not None and sha256 == self.task.info.file_sha256 and (cache := get_hash_service().cache) is not None:
+            # verified just now, the pre-check of the next run does not need to hash it again
+            cache.put(self.task.info.save_path, sha256)
         
         self.task.status.set_status(DownloadStatus.COMPLETED)
         return True
@@ -291,6 +658,7 @@ class DownloadTask:
         background_result: bool = False,
         num_chunks: Optional[int] = None,
         chunk_size: Optional[int] = None,
+        resume_ranges: Optional[dict[str, int]] = None,
     ):
         self.task_id: TaskId = IdGenerator.generate(self.__class__.__name__)
         self.info = info
@@ -299,6 +667,11 @@ class DownloadTask:
         self.__start = start
         self.num_chunks = num_chunks
         self.chunk_size = chunk_size
+        # range layout journaled by a previous run, None when the task is new
+        self.resume_ranges = resume_ranges
+        # True when the size was found by this task, not given by the caller
+        self.size_probed = False
+        self._first_response: Optional[tuple[AsyncExitStack, ClientResponse]] = None
         self.status = DownloadStatus()
         self.controller = DownloadController(self)
         self.scheduler = None
@@ -307,6 +680,11 @@ class DownloadTask:
         self._wait_complete = False
         self._background_result = background_result
         
+    @property
+    def part_name(self):
+        '''Prefix of the part files, attachment names repeat across posts while save paths do not.'''
+        return Path(self.info.save_path).name
+    
     def pre_start(self):
         self.prop.progress_tracker.add_task(self.task_id, "下载", self.info.file_name, self.info.file_size)
     
@@ -321,19 +699,68 @@ class DownloadTask:
             self.result.success = True
             return self.result
         
-        if self.info.file_size is None:
-            self.info.file_size = await self.info.get_file_size(session_pool=self.prop.session_pool)
+        try:
             if self.info.file_size is None:
-                raise ValueError(f"Failed to get file size of {self.info.file_name}")
-        
-        self.scheduler = DownloadScheduler(self)
-        self.pre_start()
-        
-        ret = await self.scheduler.start_download(self._background_result)
+                self.info.file_size = await self.probe_file_size()
+                if self.info.file_size is None:
+                    raise ValueError(f"Failed to get file size of {self.info.file_name}")
+                self.size_probed = True
+            
+            self.scheduler = DownloadScheduler(self)
+            self.pre_start()
+            
+            ret = await self.scheduler.start_download(self._background_result)
+        finally:
+            if self._first_response is not None:
+                await self._first_response[0].aclose()
+                self._first_response = None
         self.result.success = ret
         self.prop.progress_tracker.remove_task(self.task_id)
         return self.result
     
+    async def probe_file_size(self, retry = 3) -> Optional[int]:
+        '''
+        Size from the Content-Range of a GET of the whole file instead of a separate HEAD request.
+        The response is kept open, the range starting at 0 streams it.
+        '''
+        while retry > 0:
+            stack = AsyncExitStack()
+            try:
+                session = await stack.enter_async_context(self.prop.session_pool.get())
+                response = await stack.enter_async_context(session.get(self.info.url, headers={'Range': 'bytes=0-'}))
+                if response.status == 206:
+                    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                    if total.isdigit():
+                        self._first_response, stack = (stack, response), None
+                        return int(total)
+                    logger.warning(f"File: {self.info.file_name} has no size in Content-Range, falling back to HEAD")
+                    return await self.info.get_file_size(self.prop.session_pool)
+                elif response.status == 200:
+                    # no range support, the ranges fail with the same status
+                    return response.content_length
+                elif response.status == 429:
+                    retry -= 0.5
+                    await asyncio.sleep(1)
+                elif response.status == 404:
+                    logger.warning(f"File not found: {self.info.url}")
+                    return None
+                else:
+                    retry -= 1
+            except Exception as e:
+                logger.error(f"({retry})Error getting file size {self.info.url}: {e}")
+                retry -= 1
+            finally:
+                if stack is not None:
+                    await stack.aclose()
+        return None
+    
+    def take_first_response(self, range_start: int) -> Optional[tuple[AsyncExitStack, ClientResponse]]:
+        '''The open probe response, only for the range starting at 0 with nothing written yet.'''
+        if self._first_response is None or range_start != 0:
+            return None
+        first_response, self._first_response = self._first_response, None
+        return first_response
+    
     async def semaphore_limited_task(self, task, semaphore: Optional[asyncio.Semaphore] = None):
         if semaphore is None:
             return await task
@@ -356,6 +783,7 @@ class DownloadTask:
             "priority": ...,
             "num_chunks": ...,
             "chunk_size": ...,
+            "background_result": ...,
             "status": {
                 "status": ...,
                 "message": ...,
@@ -370,8 +798,26 @@ class DownloadTask:
             'priority': self.priority,
             'num_chunks': self.num_chunks,
             'chunk_size': self.chunk_size,
+            'background_result': self._background_result,
             'status': self.status.dump(),
         }
     
+    @property
+    def is_small(self):
+        if self.info.file_type in PREVIEW_FILE_TYPES:
+            return True
+        return self.info.file_size is not None and self.info.file_size <= self.prop.small_file_size
+    
+    @property
+    def sort_key(self):
+        '''
+        Queue order of the task. "fifo" keeps the priority order, "sjf" starts previews first and then the
+        smallest files, files of unknown size last; the priority only orders equal files there.
+        '''
+        if self.prop.schedule_policy == "sjf":
+            file_size = self.info.file_size if self.info.file_size is not None else sys.maxsize
+            return (self.info.file_type not in PREVIEW_FILE_TYPES, file_size, self.priority)
+        return (self.priority,)
+    
     def __lt__(self, other: 'DownloadTask'):
-        return self.priority < other.priority
+        return self.sort_key < other.sort_key
@@ -1,23 +1,18 @@
 import asyncio
+import heapq
 import signal
-from typing import Union, Optional, NewType, Any
+from typing import Union, Optional, NewType, Any, Callable
 
 from kemonobakend.kemono.builtins import get_sha256_from_path
 from kemonobakend.log import logger
 
 from .types import (
-    DownloadInfo, DownloadProperties, DownloadResult, DownloadStatus, ProgressTracker, AutoList, DownloadWaiter,
+    DownloadInfo, DownloadProperties, DownloadResult, DownloadStatus, DownloadStats, ProgressTracker, AutoList, DownloadWaiter,
     TaskId
 )
 from .download import DownloadTask
 
 
-class StopTask:
-    def __init__(self):
-        self.priority = -float("inf")
-    def __lt__(self, other):
-        return self.priority < other.priority
-
 class Downloader:
     download_tasks: dict[TaskId, DownloadTask] = {}
     running_tasks:   dict[TaskId, asyncio.Task] = {}
@@ -30,16 +25,21 @@ class Downloader:
     ):
         self._loop = loop
         self.prop = prop or DownloadProperties()
-        self.tasks_queue: asyncio.PriorityQueue[DownloadTask] = asyncio.PriorityQueue()
+        # heaps ordered by DownloadTask.sort_key, small files have their own lane when slots are reserved for them
+        self.tasks_queue: list[DownloadTask] = []
+        self.small_tasks_queue: list[DownloadTask] = []
+        self.stats = DownloadStats()
         self.semaphore = asyncio.Semaphore(self.prop.max_tasks_concurrent)
         self.is_running = False
         self.stop_event = asyncio.Event()
+        self._slot_event = asyncio.Event()
         self._looper_task: Optional[asyncio.Task] = None
         self._background_tasks: list[asyncio.Task] = []
         self._done_waiters: list[DownloadWaiter] = []
         self._put_waiters: list[DownloadWaiter] = []
         self._done_waiters_map: dict[TaskId, asyncio.Future] = {}
         self._put_waiters_map: dict[TaskId, asyncio.Future] = {}
+        self._done_callbacks: list[Callable[[DownloadTask, Optional[DownloadResult]], Any]] = []
         self.__priority_increment = 1
         # self._lock = asyncio.Lock()
         self._is_set_signal = False
@@ -94,10 +94,11 @@ class Downloader:
         await self.wait_forever()
         self.clear_waiters()
         self.is_running = False
+        self._close_journal()
     
     async def _stop(self):
         self.stop_event.set()
-        self.tasks_queue.put_nowait(StopTask())
+        self._slot_event.set()
         if self._is_set_signal:
             self.remove_signal()
     
@@ -109,6 +110,11 @@ class Downloader:
         await self.wait_forever()
         self.clear_waiters()
         self.is_running = False
+        self._close_journal()
+    
+    def _close_journal(self):
+        if self.prop.journal is not None:
+            self.prop.journal.close()
 
     def create_task(
         self,
@@ -117,6 +123,7 @@ class Downloader:
         file_name: Optional[str] = None,
         file_size: Optional[int] = None,
         file_sha256: Optional[str] = None,
+        file_type: Optional[str] = None,
         background_result: bool = True,
         start: bool = True,
         priority: int = None,
@@ -135,6 +142,7 @@ class Downloader:
             save_path=save_path,
             file_sha256=file_sha256,
             file_size=file_size,
+            file_type=file_type,
             json=json,
             headers=headers,
             cookies=cookies,
@@ -153,7 +161,7 @@ class Downloader:
                 try:
                     result = task.result()
                     if download_task._wait_complete:
-                        self._background_tasks.append(self._loop.create_task(download_task.scheduler.complete()))
+                        self._background_tasks.append(self._loop.create_task(self._background_complete(download_task)))
                 except asyncio.CancelledError:
                     logger.error(f"Task {download_task.task_id} {download_task.info.file_name} Cancelled")
                     self.prop.progress_tracker.on_cancel(download_task.task_id)
@@ -169,21 +177,112 @@ class Downloader:
             return inner
         
         while not self.stop_event.is_set():
+            await self._wait_free_slot()
+            if self.stop_event.is_set():
+                break
+            
+            download_task = await self._next_task()
+            if download_task is None:
+                break
+            
+            task = download_task.start(self.semaphore)
+            task.add_done_callback(done_callback(download_task))
+            self._put_task(download_task.task_id, task)
+    
+    async def _wait_free_slot(self):
+        '''
+        Wait until a concurrency slot is free. The slot event is set by `_clean_task` when a running task
+        finishes (or by `_put_download_task` and `_stop`), so the looper starts the next task immediately instead of polling.
+        '''
+        while len(self.running_tasks) >= self.prop.max_tasks_concurrent and not self.stop_event.is_set():
+            self._slot_event.clear()
+            await self._slot_event.wait()
+    
+    async def _next_task(self) -> Optional[DownloadTask]:
+        '''
+        Pop the first task by `sort_key` of the lanes allowed to start. Large files may not take the
+        `small_file_slots` reserved slots, so a batch of big archives can not hold back the small files.
+        Returns None when the downloader is stopped.
+        '''
+        while not self.stop_event.is_set():
+            small = self.small_tasks_queue[0] if self.small_tasks_queue else None
+            large = self.tasks_queue[0] if self.tasks_queue and self._large_slot_free() else None
+            if small is not None and (large is None or small < large):
+                return heapq.heappop(self.small_tasks_queue)
+            if large is not None:
+                return heapq.heappop(self.tasks_queue)
+            self._slot_event.clear()
+            await self._slot_event.wait()
+        return None
+    
+    def _large_slot_free(self):
+        if self.prop.small_file_slots <= 0:
+            return True
+        large_running = sum(not self.download_tasks[task_id].is_small for task_id in self.running_tasks)
+        return large_running < max(self.prop.max_tasks_concurrent - self.prop.small_file_slots, 1)
+    
+    def add_done_callback(self, callback: Callable[[DownloadTask, Optional[DownloadResult]], Any]):
+        '''
+        Add a callback called as `callback(download_task, result)` when a task is finished and its file is complete,
+        result is None if the task raised an exception.
+        '''
+        self._done_callbacks.append(callback)
+    
+    def _call_done_callbacks(self, download_task: DownloadTask, result: Optional[DownloadResult]):
+        self._journal_result(download_task, result)
+        for callback in self._done_callbacks:
             try:
-                if len(self.running_tasks) >= self.prop.max_tasks_concurrent:
-                    continue
-                
-                download_task = await self.tasks_queue.get()
-                if isinstance(download_task, StopTask):
-                    break
-                
-                task = download_task.start(self.semaphore)
-                task.add_done_callback(done_callback(download_task))
-                self._put_task(download_task.task_id, task)
-            finally:
-                await asyncio.sleep(1)
+                callback(download_task, result)
+            except Exception as e:
+                logger.error(f"Task {download_task.task_id} done callback failed: {e}")
+    
+    def _journal_result(self, download_task: DownloadTask, result: Optional[DownloadResult]):
+        '''Cancelled tasks stay unfinished in the journal, `resume_unfinished` puts them back.'''
+        journal = self.prop.journal
+        if journal is None:
+            return
+        try:
+            if result is not None and result.success:
+                journal.download_task_done(download_task)
+            elif download_task.status.is_cancelled:
+                journal.download_task_cancelled(download_task)
+            else:
+                journal.download_task_failed(download_task)
+        except Exception as e:
+            logger.error(f"Task {download_task.task_id} journal failed: {e}")
+    
+    def resume_unfinished(self) -> list[TaskId]:
+        '''
+        Put the unfinished tasks of the journal back into the queue, in their journaled order.
+        Their ranges continue from the journaled layout and the bytes on disk, nothing is planned from the database.
+        '''
+        if self.prop.journal is None:
+            return []
+        task_ids = []
+        for entry in self.prop.journal.get_all_unfinished_download_tasks():
+            dumped = entry["task"]
+            task = DownloadTask(
+                DownloadInfo(**dumped["info"]),
+                self.prop,
+                priority=self.__priority_increment,
+                background_result=dumped.get("background_result", True),
+                num_chunks=dumped.get("num_chunks"),
+                chunk_size=dumped.get("chunk_size"),
+                resume_ranges=entry["ranges"],
+            )
+            self.__priority_increment += 1
+            self._put_download_task(task)
+            task_ids.append(task.task_id)
+        return task_ids
+    
+    async def _background_complete(self, download_task: DownloadTask):
+        download_task.result.success = await download_task.scheduler.complete()
+        self._call_done_callbacks(download_task, download_task.result)
     
     def _clean_task(self, task_id: TaskId, result: Optional[DownloadResult]):
+        download_task = self.download_tasks.get(task_id)
+        if download_task is not None and not (result is not None and result.success and download_task._wait_complete):
+            self._call_done_callbacks(download_task, result)
         try:
             if result is None:
                 logger.info(f"Task {task_id} download failed")
@@ -194,14 +293,23 @@ class Downloader:
             else:
                 logger.info(f"Task {task_id} download failed {result}")
         finally:
+            self.stats.on_done()
             self.prop.progress_tracker.advance_main()
             self.running_tasks.pop(task_id, None)
+            self._slot_event.set()
             self._wakeup_waiter(self._done_waiters_map, task_id)
             self._wakeup_waiter(self._done_waiters)
     
     def _put_download_task(self, task: DownloadTask):
+        if self.prop.journal is not None and task.resume_ranges is None:
+            self.prop.journal.add_download_task(task)
         self.download_tasks[task.task_id] = task
-        self.tasks_queue.put_nowait(task)
+        if self.prop.small_file_slots > 0 and task.is_small:
+            heapq.heappush(self.small_tasks_queue, task)
+        else:
+            heapq.heappush(self.tasks_queue, task)
+        self.stats.on_put()
+        self._slot_event.set()
     
     def _put_task(self, task_id: TaskId, task: asyncio.Task):
         self.running_tasks[task_id] = task
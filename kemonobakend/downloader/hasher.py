@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+from typing import Callable, Awaitable
+
+
+class StreamingHasher:
+    '''
+    Hash a file in order while its ranges are downloaded out of order.
+    
+    Chunks at the current offset are hashed immediately, chunks ahead of it are held in a bounded window.
+    Chunks which do not fit in the window are dropped, `catch_up()` reads them back from disk later.
+    '''
+    def __init__(
+        self, 
+        size: int, 
+        read_at: Callable[[int, int], Awaitable[bytes]], 
+        window_size: int = 64 * 1024 * 1024,
+        read_size: int = 1024 * 1024 * 2,
+        hash_name: str = "sha256",
+    ):
+        self.size = size
+        self.offset = 0
+        self.window_size = window_size
+        self.read_size = read_size
+        self._hash_obj = hashlib.new(hash_name)
+        self._read_at = read_at
+        self._pending: dict[int, bytes] = {}
+        self._pending_size = 0
+        self._reading = False
+        self._lock = asyncio.Lock()
+    
+    def _update(self, data: bytes):
+        self._hash_obj.update(data)
+        self.offset += len(data)
+    
+    def _drain(self):
+        while (data := self._pending.pop(self.offset, None)) is not None:
+            self._pending_size -= len(data)
+            self._update(data)
+    
+    def feed(self, offset: int, data: bytes):
+        if offset == self.offset and not self._reading:
+            self._update(data)
+            self._drain()
+        elif offset > self.offset and self._pending_size + len(data) <= self.window_size:
+            self._pending[offset] = data
+            self._pending_size += len(data)
+    
+    async def catch_up(self, end: int):
+        '''Hash bytes up to `end`, which must already be on disk, reading only what is not in the window.'''
+        async with self._lock:
+            end = min(end, self.size)
+            self._drain()
+            while self.offset < end:
+                next_pending = min((o for o in self._pending if o > self.offset), default=end)
+                length = min(next_pending, end, self.offset + self.read_size) - self.offset
+                self._reading = True
+                try:
+                    data = await self._read_at(self.offset, length)
+                finally:
+                    self._reading = False
+                if len(data) != length:
+                    raise IOError(f"Short read at {self.offset}, expected {length} bytes but got {len(data)}")
+                self._update(data)
+                self._drain()
+    
+    async def hexdigest(self) -> str:
+        await self.catch_up(self.size)
+        self._pending.clear()
+        self._pending_size = 0
+        return self._hash_obj.hexdigest()
@@ -0,0 +1,71 @@
+from time import time as now_time
+from typing import Optional
+
+from kemonobakend.config import settings
+
+from .types import get_ranges
+
+
+class ChunkPlanner:
+    '''
+    Throughput driven connection planning of one download task.
+
+    A task starts with a few ranges. Every `interval` seconds the scheduler reports the downloaded bytes,
+    while the aggregate throughput of a window still rises by `min_gain` over the best one the connection
+    target is doubled (up to `max_connections`) and the scheduler splits the remaining ranges to reach it.
+    Once more connections stop paying off the target steps back to the best count and stays there.
+    '''
+    def __init__(
+        self,
+        max_connections: int,
+        initial_connections: int = settings.download.adaptive_initial_chunks,
+        min_split_size: int = settings.download.adaptive_min_chunk_size,
+        interval: float = settings.download.adaptive_interval,
+        min_gain: float = settings.download.adaptive_min_gain,
+    ):
+        self.max_connections = max(max_connections, 1)
+        self.initial_connections = max(min(initial_connections, self.max_connections), 1)
+        self.min_split_size = min_split_size
+        self.interval = interval
+        self.min_gain = min_gain
+        self.target = self.initial_connections
+        self.saturated = self.target >= self.max_connections
+        self.speed = 0.0
+        self.per_connection_speed = 0.0
+        self._best_speed = 0.0
+        self._best_target = self.target
+        self._mark: Optional[tuple[float, int]] = None
+
+    def initial_ranges(self, size: int) -> list[tuple[int, int]]:
+        chunks = max(min(self.initial_connections, size // self.min_split_size), 1)
+        return get_ranges(size, chunks=chunks)
+
+    def advise(self, downloaded_size: int, connections: int) -> int:
+        '''Number of connections the scheduler should add now, `connections` is the count of unfinished ranges.'''
+        now = now_time()
+        if self._mark is None:
+            self._mark = (now, downloaded_size)
+            return 0
+        start_time, start_size = self._mark
+        if now - start_time >= self.interval:
+            self._mark = (now, downloaded_size)
+            self.speed = (downloaded_size - start_size) / (now - start_time)
+            self.per_connection_speed = self.speed / max(connections, 1)
+            self._adjust()
+        return max(self.target - connections, 0)
+
+    def _adjust(self):
+        if self.saturated:
+            return
+        if self.speed > self._best_speed * (1 + self.min_gain):
+            self._best_speed = self.speed
+            self._best_target = self.target
+            self.target = min(self.target * 2, self.max_connections)
+        else:
+            # the extra connections did not raise the throughput, the link or proxy is the limit
+            self.target = self._best_target
+            self.saturated = True
+
+    def worth_split(self, remaining_size: int, eta: float) -> bool:
+        '''A split needs both halves above `min_split_size` and a range that outlives one measure window.'''
+        return remaining_size >= 2 * self.min_split_size and eta > self.interval
@@ -1,8 +1,9 @@
 import asyncio
 from aiohttp import  ClientTimeout
+from time import time as now_time
 from dataclasses import dataclass
 
-from typing import Optional, Union, NewType, Generic, TypeVar, Any
+from typing import Optional, Union, NewType, Generic, TypeVar, Any, TYPE_CHECKING
 
 from kemonobakend.session_pool import SessionPool
 from kemonobakend.utils import get_num_and_unit, to_bytes
@@ -10,8 +11,14 @@ from kemonobakend.utils.progress import DownloadProgress, ProgressTask
 from kemonobakend.config import settings
 from kemonobakend.log import logger
 
+if TYPE_CHECKING:
+    from kemonobakend.store.download_task import DownloadTaskStore
+
 TaskId = NewType('TaskId', int)
 
+# attachment types which are small previews, scheduled with the small files whatever their size
+PREVIEW_FILE_TYPES = ("cover", "thumbnail")
+
 class DownloadError(Exception):
     pass
 
@@ -127,6 +134,7 @@ class DownloadInfo:
     file_sha256: Optional[str] = None
     file_size: Optional[int] = None
     mime_type: Optional[str] = None
+    file_type: Optional[str] = None
     headers: Optional[dict] = None
     cookies: Optional[dict] = None
     json: Optional[Union[dict, list]] = None
@@ -157,6 +165,7 @@ class DownloadInfo:
             "file_sha256": self.file_sha256,
             "file_size": self.file_size,
             "mime_type": self.mime_type,
+            "file_type": self.file_type,
             "headers": self.headers,
             "cookies": self.cookies,
             "json": self.json,
@@ -223,6 +232,14 @@ class DownloadProperties:
         max_retries: int = 2,
         timeout: ClientTimeout = ClientTimeout(**settings.download.timeout_kwargs),
         file_strict: bool = True,
+        direct_write: bool = settings.download.direct_write,
+        hash_window_size: int = settings.download.hash_window_size,
+        adaptive_chunks: bool = settings.download.adaptive_chunks,
+        hedge_tail_size: int = settings.download.hedge_tail_size,
+        schedule_policy: str = settings.download.schedule_policy,
+        small_file_size: int = settings.download.small_file_size,
+        small_file_slots: int = settings.download.small_file_slots,
+        journal: Optional['DownloadTaskStore'] = None,
     ):
         self.tmp_path = tmp_path
         self.session_pool = session_pool or SessionPool(enabled_accounts_pool=True)
@@ -232,6 +249,16 @@ class DownloadProperties:
         self.max_retries = max_retries
         self.timeout = timeout
         self.file_strict = file_strict
+        self.direct_write = direct_write
+        self.hash_window_size = hash_window_size
+        self.adaptive_chunks = adaptive_chunks
+        self.hedge_tail_size = hedge_tail_size
+        assert schedule_policy in ["fifo", "sjf"], "Invalid schedule policy"
+        self.schedule_policy = schedule_policy
+        self.small_file_size = small_file_size
+        self.small_file_slots = small_file_slots
+        # tasks, range progress and results are journaled when set, see `Downloader.resume_unfinished`
+        self.journal = journal
 
 class DownloadResult:
     def __init__(self, success: bool = False, message: str = "Pending", *, total_size = None, task_id: TaskId = None):
@@ -256,6 +283,37 @@ class DownloadResult:
     def __repr__(self):
         return self.__str__()
 
+class DownloadStats:
+    '''Completion times of the tasks of a downloader, used to compare scheduling policies.'''
+    def __init__(self):
+        self.start_time: Optional[float] = None
+        self.done_times: list[float] = []
+    
+    def on_put(self):
+        if self.start_time is None:
+            self.start_time = now_time()
+    
+    def on_done(self):
+        if self.start_time is not None:
+            self.done_times.append(now_time() - self.start_time)
+    
+    def time_to_first(self, count: int) -> Optional[float]:
+        '''Seconds from the first task put until `count` tasks were done.'''
+        if count <= 0 or len(self.done_times) < count:
+            return None
+        return self.done_times[count - 1]
+    
+    @property
+    def makespan(self) -> Optional[float]:
+        return self.done_times[-1] if self.done_times else None
+    
+    def dump(self, firsts: tuple[int, ...] = (10, 100)):
+        return {
+            "done": len(self.done_times),
+            **{f"first_{count}": self.time_to_first(count) for count in firsts},
+            "makespan": self.makespan,
+        }
+
 class Status:
     PENDING = "pending"
     DOWNLOADING = "downloading"
@@ -332,3 +390,7 @@ def get_ranges(size, *, chunk_size=None, chunks=None, auto_chunks_dict=None):
         chunks = parse_splits(size, auto_chunks_dict)
     return [(i*size//chunks, min((i+1)*size//chunks-1, size)) for i in range(chunks)]
 
+def ranges_from_starts(size, starts) -> list[tuple[int, int]]:
+    '''Tile the file with ranges beginning at `starts`, ranges found on disk by a resumed task.'''
+    starts = sorted({0, *(start for start in starts if 0 <= start < size)})
+    return [(start, end - 1) for start, end in zip(starts, starts[1:] + [size])]
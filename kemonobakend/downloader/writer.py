@@ -0,0 +1,113 @@
+import os
+import asyncio
+from pathlib import Path
+from time import time as now_time
+from typing import Optional
+
+from kemonobakend.utils import json_load, json_dump
+
+
+class PositionalFileWriter:
+    '''
+    Write chunks at absolute offsets of a single preallocated file.
+    All ranges of a task share one file descriptor, so no per-range part files and no merge are needed.
+    '''
+    def __init__(self, path: str, size: int):
+        self.path = Path(path)
+        self.size = size
+        self._fd: Optional[int] = None
+        self._lock = asyncio.Lock()
+    
+    def open(self):
+        if self._fd is not None:
+            return
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        if os.fstat(self._fd).st_size != self.size:
+            # extending with truncate leaves a sparse file on filesystems that support it
+            os.ftruncate(self._fd, self.size)
+    
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+    
+    def _pwrite(self, offset: int, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+    
+    def _seek_write(self, offset: int, data: bytes):
+        os.lseek(self._fd, offset, os.SEEK_SET)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+    
+    async def write(self, offset: int, data: bytes):
+        loop = asyncio.get_running_loop()
+        if hasattr(os, "pwrite"):
+            await loop.run_in_executor(None, self._pwrite, offset, data)
+        else:
+            # no pwrite on Windows, seek + write must not interleave between ranges
+            async with self._lock:
+                await loop.run_in_executor(None, self._seek_write, offset, data)
+    
+    def remove(self):
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
+    
+    def __enter__(self):
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class ChunkStateFile:
+    '''
+    Sidecar json of a direct written file, records how many bytes of each range have been written.
+    ```json
+    {"file_size": ..., "ranges": {"0-1023": 512, ...}}
+    ```
+    '''
+    def __init__(self, path: str, file_size: int, save_interval: float = 1.0):
+        self.path = Path(path)
+        self.file_size = file_size
+        self.save_interval = save_interval
+        self.ranges: dict[str, int] = {}
+        self._last_save = 0
+    
+    def load(self):
+        data = json_load(self.path)
+        if isinstance(data, dict) and data.get("file_size") == self.file_size:
+            self.ranges = data.get("ranges", {})
+        else:
+            self.ranges = {}
+        return self
+    
+    def reset(self):
+        self.ranges = {}
+    
+    def get(self, range_str: str) -> int:
+        return self.ranges.get(range_str, 0)
+    
+    def update(self, range_str: str, size: int):
+        self.ranges[range_str] = size
+    
+    def rename(self, range_str: str, new_range_str: str):
+        '''Rekey a range whose end was moved by a split, its written size stays.'''
+        self.ranges[new_range_str] = self.ranges.pop(range_str, 0)
+    
+    def save(self, force: bool = False):
+        if not force and now_time() - self._last_save < self.save_interval:
+            return
+        self._last_save = now_time()
+        json_dump({"file_size": self.file_size, "ranges": self.ranges}, self.path, indent=None)
+    
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
@@ -1,5 +1,5 @@
 from collections import defaultdict
-from typing import Union, Coroutine, Type, TypeVar, Any
+from typing import Union, Coroutine, Type, TypeVar, Any, Optional
 
 from kemonobakend.files_formatter import FilesFormatterBase, FileNameZFillerToDo, NumWithZFiller
 from kemonobakend.database.models import KemonoAttachment, KemonoUser, KemonoPost, KemonoFile
@@ -12,8 +12,75 @@ from kemonobakend.utils.run_code import RunCoder, get_first_indent
 from kemonobakend.log import logger
 
 
+class SanitizedView:
+    '''Read-only view of a model for the folder/file expressions, `overrides` shadow the attributes of `source`.'''
+    __slots__ = ("_source", "_overrides")
+    
+    def __init__(self, source, **overrides):
+        object.__setattr__(self, "_source", source)
+        object.__setattr__(self, "_overrides", overrides)
+    
+    def __getattr__(self, name: str):
+        try:
+            return self._overrides[name]
+        except KeyError:
+            return getattr(self._source, name)
+    
+    def __setattr__(self, name: str, value):
+        raise AttributeError(f"{type(self._source).__name__} view is read-only")
+
+
+class KemonoFilesDiff:
+    '''Difference between the stored files of a (user, formatter) and a fresh generation.'''
+    # columns that change when the formatter params or the posts change, the rest is fixed by the attachment
+    compare_fields = ("hash_id", "sha256", "save_path", "root", "folder", "file_name", "file_size", "file_type")
+
+    def __init__(self):
+        self.added: list[dict] = []
+        self.removed: list[KemonoFile] = []
+        self.changed: list[tuple[KemonoFile, dict]] = []
+        self.unchanged: int = 0
+
+    @property
+    def renamed(self) -> list[tuple[KemonoFile, dict]]:
+        return [(old, new) for old, new in self.changed if old.save_path != new["save_path"]]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return (
+            f"<KemonoFilesDiff added={len(self.added)} removed={len(self.removed)} "
+            f"changed={len(self.changed)} unchanged={self.unchanged}>"
+        )
+
+def diff_kemono_files(files_exist: list[KemonoFile], files: list[Union[KemonoFile, dict]]) -> KemonoFilesDiff:
+    '''Match rows by (attachment_hash_id, idx), new rows are returned as plain dicts.'''
+    diff = KemonoFilesDiff()
+    exist_map: dict[tuple[str, int], list[KemonoFile]] = defaultdict(list)
+    for file in files_exist:
+        exist_map[(file.attachment_hash_id, file.idx)].append(file)
+    for file in files:
+        if not isinstance(file, dict):
+            file = file.model_dump(exclude={"id"})
+        olds = exist_map.get((file["attachment_hash_id"], file["idx"]))
+        if not olds:
+            diff.added.append(file)
+            continue
+        old = olds.pop(0)
+        if any(getattr(old, field) != file[field] for field in KemonoFilesDiff.compare_fields):
+            diff.changed.append((old, file))
+        else:
+            diff.unchanged += 1
+    for olds in exist_map.values():
+        diff.removed.extend(olds)
+    return diff
+
+
 class KemonoFilesFormatter(FilesFormatterBase):
     __return_class__: Type[KemonoFile] = KemonoFile
+    _post_view: Optional[SanitizedView] = None
+    _creator_view: Optional[SanitizedView] = None
 
     @staticmethod
     def default_folder_expr() -> str:
@@ -100,17 +167,14 @@ class KemonoFilesFormatter(FilesFormatterBase):
         file_type = get_file_type_by_name(attachment.name)
         local["file_type"] = file_type
         
-        try:
-            attachment = attachment.model_copy()
-            creator = creator.model_copy()
-            post = post.model_copy()
-            creator.name = sanitize_windows_path(creator.name)
-            attachment.name = sanitize_windows_path(attachment.name)
-            post.title = sanitize_windows_path(post.title)
-        except:
-            creator.name = sanitize_windows_path(creator.name)
-            attachment.name = sanitize_windows_path(attachment.name)
-            post.title = sanitize_windows_path(post.title)
+        # expressions see read-only views with the path related fields sanitized,
+        # post and creator views are built once and reused for all their attachments
+        if self._post_view is None or self._post_view._source is not post:
+            self._post_view = SanitizedView(post, title=sanitize_windows_path(post.title))
+        if self._creator_view is None or self._creator_view._source is not creator:
+            self._creator_view = SanitizedView(creator, name=sanitize_windows_path(creator.name))
+        post, creator = self._post_view, self._creator_view
+        attachment = SanitizedView(attachment, name=sanitize_windows_path(attachment.name))
         
         folder: str = self.folder_coder.run(root=self.root, file_type=file_type, creator=creator, post=post, attachment=attachment)
         file_name: str = sanitize_windows_path(self.file_coder.run(root=self.root, file_type=file_type, creator=creator, post=post, attachment=attachment))
@@ -166,7 +230,11 @@ class KemonoFilesFormatter(FilesFormatterBase):
         return kemono_file
     
     async def generate_files(self, creator: KemonoUser, posts: list[KemonoPost]):
-        return await super().generate_files(posts, creator=creator)
+        self._post_view = self._creator_view = None
+        try:
+            return await super().generate_files(posts, creator=creator)
+        finally:
+            self._post_view = self._creator_view = None
 
 
 
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from sqlalchemy.pool import NullPool
+
+from kemonobakend.config import settings
+from kemonobakend.database import AsyncCombineSession
+from kemonobakend.database.engine import create_sqlite_engine
+from kemonobakend.utils import json_dumps, json_loads
+
+from .files import KemonoFilesFormatter
+
+# per worker process state, set by _init_worker
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_engine = None
+_formatters: dict[str, KemonoFilesFormatter] = {}
+
+def _init_worker(database_path: str):
+    global _loop, _engine
+    _loop = asyncio.new_event_loop()
+    # NullPool: pooled aiosqlite threads would keep the worker alive on shutdown
+    _engine = create_sqlite_engine(
+        database_path, settings.program.database_pragmas, read_only=True, poolclass=NullPool
+    )
+
+def _get_formatter(formatter_name: str, params_json: str):
+    '''Formatters only differ by name across creators most of the time, compile their exprs once per worker.'''
+    formatter = _formatters.get(params_json)
+    if formatter is None:
+        formatter = _formatters[params_json] = KemonoFilesFormatter(formatter_name, **json_loads(params_json))
+    formatter.formatter_name = formatter_name
+    return formatter
+
+async def _generate_files(user_hash_id: str, formatter_name: str, params_json: str) -> list[dict]:
+    async with AsyncCombineSession(_engine) as session:
+        user = await session.kemono_user.get_user(user_hash_id)
+        posts = await session.kemono_post.get_posts_by_user(user_hash_id)
+    if user is None or not posts:
+        return []
+    formatter = _get_formatter(formatter_name, params_json)
+    files = await formatter.generate_files(user, list(posts))
+    return [file.model_dump(exclude={"id"}) for file in files]
+
+def generate_files(user_hash_id: str, formatter_name: str, params_json: str) -> list[dict]:
+    '''Worker entry: load the creator's posts from the db, return KemonoFile rows as plain dicts.'''
+    return _loop.run_until_complete(_generate_files(user_hash_id, formatter_name, params_json))
+
+
+class FilesGeneratePool:
+    '''
+    Generate KemonoFile rows for many creators across processes.
+    Workers read posts themselves from the (WAL) database, only formatter params go in
+    and plain rows come back, the caller writes them.
+    '''
+    def __init__(self, database_path: str, max_workers: Optional[int] = None):
+        self.database_path = database_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._params_json: dict[KemonoFilesFormatter, str] = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.max_workers,
+                # spawn: the parent holds an event loop and aiosqlite threads that must not be forked
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.database_path,),
+            )
+        return self._executor
+
+    def serialize(self, formatter: KemonoFilesFormatter) -> str:
+        if (params_json := self._params_json.get(formatter)) is None:
+            params_json = self._params_json[formatter] = json_dumps(formatter.get_params())
+        return params_json
+
+    def submit(self, user_hash_id: str, formatter: KemonoFilesFormatter) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self.executor, generate_files, user_hash_id, formatter.formatter_name, self.serialize(formatter)
+        )
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(wait=exc_type is None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            # the workers are idle by now, joining them still takes a moment off the loop
+            await asyncio.to_thread(self.shutdown)
+        else:
+            # on an error or cancel don't wait for the running workers, they exit once their creator is done
+            self.shutdown(wait=False)
@@ -0,0 +1,111 @@
+import ast
+from typing import Any, Optional
+
+from sqlmodel import select, or_
+from sqlalchemy import ColumnElement
+
+from kemonobakend.database.models import KemonoAttachment, KemonoPost
+from kemonobakend.utils.run_code import RunCoder
+
+_models = {
+    "attachment": KemonoAttachment,
+    "post": KemonoPost,
+}
+_ops = {
+    ast.Eq: "__eq__", ast.NotEq: "__ne__",
+    ast.Lt: "__lt__", ast.LtE: "__le__", ast.Gt: "__gt__", ast.GtE: "__ge__",
+}
+_mirror = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+class _NotPushable(Exception):
+    pass
+
+def _column(node: ast.AST):
+    '''`attachment.<col>` / `post.<col>` -> (model name, column)'''
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in _models:
+        model = _models[node.value.id]
+        if node.attr in model.__table__.columns:
+            return node.value.id, getattr(model, node.attr)
+    raise _NotPushable
+
+def _constant(node: ast.AST) -> Any:
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, SyntaxError, TypeError):
+        raise _NotPushable
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    raise _NotPushable
+
+def _constants(node: ast.AST) -> list:
+    if not isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        raise _NotPushable
+    values = [_constant(elt) for elt in node.elts]
+    if any(value is None for value in values):
+        raise _NotPushable
+    return values
+
+def _compare(node: ast.Compare):
+    if len(node.ops) != 1:
+        raise _NotPushable
+    op, left, right = type(node.ops[0]), node.left, node.comparators[0]
+    if op in (ast.In, ast.NotIn):
+        name, column = _column(left)
+        values = _constants(right)
+        if op is ast.In:
+            return name, column.in_(values)
+        # python keeps None values for `not in`, sql would drop NULL rows
+        return name, or_(column.not_in(values), column.is_(None))
+    if op in (ast.Is, ast.IsNot):
+        name, column = _column(left)
+        if _constant(right) is not None:
+            raise _NotPushable
+        return name, column.is_(None) if op is ast.Is else column.is_not(None)
+    if op not in _ops:
+        raise _NotPushable
+    try:
+        name, column = _column(left)
+        value = _constant(right)
+    except _NotPushable:
+        name, column = _column(right)
+        value = _constant(left)
+        op = _mirror[op]
+    if value is None:
+        if op is ast.Eq:
+            return name, column.is_(None)
+        if op is ast.NotEq:
+            return name, column.is_not(None)
+        raise _NotPushable
+    clause = getattr(column, _ops[op])(value)
+    if op is ast.NotEq:
+        clause = or_(clause, column.is_(None))
+    return name, clause
+
+def _conjuncts(node: ast.AST):
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        for value in node.values:
+            yield from _conjuncts(value)
+    else:
+        yield node
+
+def filter_to_where(filter_expr: Optional[RunCoder]) -> list[ColumnElement]:
+    '''
+    Translate the simple predicates of a single-expression filter into WHERE clauses on KemonoAttachment.
+    Only top level `and` terms like `attachment.type == "cover"`, `post.post_id in (...)` or
+    `attachment.size is not None` are taken; they are necessary conditions, so the python filter
+    still runs on the rows that pass and anything untranslatable is simply left to it.
+    '''
+    if filter_expr is None or filter_expr.expression is None:
+        return []
+    where = []
+    for node in _conjuncts(filter_expr.expression.body):
+        if not isinstance(node, ast.Compare):
+            continue
+        try:
+            name, clause = _compare(node)
+        except _NotPushable:
+            continue
+        if name == "post":
+            clause = KemonoAttachment.post_hash_id.in_(select(KemonoPost.hash_id).where(clause))
+        where.append(clause)
+    return where
@@ -0,0 +1,41 @@
+from typing import Any, Optional
+
+
+class FilterPost:
+    '''
+    Post column row as passed to download filters, with the `attachments` of the ORM model.
+    `attachments` is only filled when the filter reads it, see `KemonoProgram.download_files_by_users`.
+    '''
+    __slots__ = ("_row", "attachments")
+
+    def __init__(self, row: Any):
+        self._row = row
+        self.attachments: list[FilterAttachment] = []
+
+    def __getattr__(self, name: str):
+        return getattr(self._row, name)
+
+    def __repr__(self):
+        return f"FilterPost({self._row!r})"
+
+class FilterAttachment:
+    '''`AttachmentRow` as passed to download filters, with the `post` of the ORM model.'''
+    __slots__ = ("_row", "post")
+
+    def __init__(self, row: Any, post: Optional[FilterPost]):
+        self._row = row
+        self.post = post
+
+    def __getattr__(self, name: str):
+        return getattr(self._row, name)
+
+    def __eq__(self, other):
+        if isinstance(other, FilterAttachment):
+            return self._row == other._row
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._row)
+
+    def __repr__(self):
+        return f"FilterAttachment({self._row!r})"
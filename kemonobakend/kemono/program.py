@@ -1,41 +1,54 @@
 import asyncio
+import os
 from contextlib import asynccontextmanager
 from bidict import bidict
 from shutil import move as shutil_move
 from asyncstdlib.builtins import map as amap, list as alist
 from typing import Optional, Union
 
-from kemonobakend.database import AsyncCombineSession, create_all
+from kemonobakend.database import AsyncCombineSession, DatabaseWriter, create_all
 from kemonobakend.database.model_builder import build_kemono_posts_info
 from kemonobakend.database.models import KemonoUser, KemonoUserCreate, KemonoFile, KemonoAttachment, KemonoPostsInfo
+from kemonobakend.database.session_handle import AttachmentRow
 from kemonobakend.session_pool import SessionPool
 from kemonobakend.downloader import Downloader, DownloadProperties
 from kemonobakend.api import KemonoAPI, PartySuAPIError
-from kemonobakend.database.engine import engine as e
+from kemonobakend.database.engine import engine as e, read_engine as read_e
 from kemonobakend.utils import path_exists, MKLink
 from kemonobakend.utils.run_code import RunCoder
 from kemonobakend.utils.progress import NormalProgress, DownloadProgress
 from kemonobakend.log import logger
 
 from .builtins import parse_user_id
-from .files import KemonoFilesFormatter
+from .files import KemonoFilesFormatter, KemonoFilesDiff, diff_kemono_files
+from .files_pool import FilesGeneratePool
 from .resource_handler import ResourceHandler
+from .filter_pushdown import filter_to_where
+from .filter_views import FilterPost, FilterAttachment
 
 class ProgramTools:
     @staticmethod
-    async def async_with_progress(func, iterable, desc, remove_after=True, progress: Optional[DownloadProgress] = None):
+    async def async_with_progress(func, iterable, desc, remove_after=True, progress: Optional[DownloadProgress] = None, concurrency: int = 1):
+        '''Await `func` over `iterable` with at most `concurrency` items in flight, results keep the input order.'''
         async def async_wrap(item):
             try:
                 return await func(item)
             finally:
                 task.advance()
         
+        async def bounded_wrap(item):
+            async with semaphore:
+                return await async_wrap(item)
+        
         if progress is None:
             progress_ = NormalProgress().__enter__()
         else:
             progress_ = progress
         task = progress_.add_task(desc, "Awaiting", total=len(iterable))
         try:
+            if concurrency > 1:
+                semaphore = asyncio.Semaphore(concurrency)
+                return await asyncio.gather(*(bounded_wrap(item) for item in iterable))
             return await alist(amap(async_wrap, iterable))
         finally:
             if remove_after:
@@ -64,52 +77,73 @@ class ProgramTools:
                 progress_.__exit__(None, None, None)
 
 class KemonoProgram:
-    def __init__(self, session_pool=None, database_engine=e):
+    def __init__(self, session_pool=None, database_engine=e, read_engine=None):
         self.session_pool = session_pool or SessionPool(enabled_accounts_pool=True)
         self.kemono_api = KemonoAPI(session_pool=self.session_pool)
         self.database_engine = database_engine
+        if read_engine is None:
+            # a custom writer engine has no read only pool of its own
+            read_engine = read_e if database_engine is e else database_engine
+        self.read_engine = read_engine
+        # sqlite has a single writer, concurrent batch commands take turns on write sessions instead of hitting "database is locked"
+        self._write_lock = asyncio.Lock()
+        # bulk writes of posts, attachments and files are queued here and committed in batches
+        self.writer = DatabaseWriter(self.database_engine, lock=self._write_lock)
     
     async def init(self):
         await create_all(self.database_engine)
         await self.session_pool.wait_init_check_proxies()
     
+    async def close(self):
+        '''Release pooled database connections, their worker threads would otherwise keep the process alive.'''
+        await self.writer.close()
+        await self.database_engine.dispose()
+        if self.read_engine is not self.database_engine:
+            await self.read_engine.dispose()
+    
     @asynccontextmanager
     async def session_context(self):
-        async with AsyncCombineSession(self.database_engine) as session:
+        '''Write session, one at a time. Keep network requests out of it.'''
+        async with self._write_lock:
+            async with AsyncCombineSession(self.database_engine) as session:
+                yield session
+    
+    @asynccontextmanager
+    async def read_session_context(self):
+        '''Session on the read only pool, for queries that must not wait for the writer.'''
+        async with AsyncCombineSession(self.read_engine) as session:
             yield session
     
     async def get_user(self, user_id=None, service=None, server_id=None, url=None, all_users=True):
         if isinstance(user_id, KemonoUser):
             return user_id
         user_id, user_hash_id, service = parse_user_id(user_id, service, server_id, url)
-        async with self.session_context() as session:
+        async with self.read_session_context() as session:
             return await session.kemono_user.get_user(user_hash_id, all_users=all_users)
     
     async def get_formatter(self, formatter_name: str):
-        async with self.session_context() as session:
+        async with self.read_session_context() as session:
             params = await session.formatter_params.get_param(formatter_name)
             if params is None:
                 return None
             return KemonoFilesFormatter.from_formatter_params(formatter_name, params)
 
     async def get_all_users(self) -> list[KemonoUser]:
-        async with self.session_context() as session:
+        async with self.read_session_context() as session:
             return await session.kemono_user.get_all()
     
     async def get_posts_infos(self) -> list[KemonoPostsInfo]:
-        async with self.session_context() as session:
+        async with self.read_session_context() as session:
             return await session.kemono_posts_info.get_all()
     
     async def get_files(self, user_hash_id, formatter_name: str):
-        async with self.session_context() as session:
+        async with self.read_session_context() as session:
             return await session.kemono_file.get_files_by_user(user_hash_id, formatter_name)
     
-    async def add_kemono_user(self, user_id=None, service=None, server_id=None, url=None):
-        def get_current_user(users: list[Union[KemonoUser, KemonoUserCreate]], is_index: bool = False) -> Optional[Union[KemonoUser, KemonoUserCreate, int]]:
-            for i, user in enumerate(users):
+    async def add_kemono_user(self, user_id=None, service=None, server_id=None, url=None, full_sync=False):
+        def get_current_user(users: list[Union[KemonoUser, KemonoUserCreate]]) -> Optional[Union[KemonoUser, KemonoUserCreate]]:
+            for user in users:
                 if user.user_id == user_id:
-                    if is_index:
-                        return i
                     return user
             return None
         
@@ -125,133 +159,249 @@ class KemonoProgram:
         if kemono_user_now is None:
             raise PartySuAPIError(f"Uncertain Error: Kemono user {user_id} not found in creator")
         
-        async with self.session_context() as session:
-            kemono_user_exist: KemonoUser = await session.kemono_user.get_user(user_hash_id, all_users=True)
-            all_users_exist = None
-            creator_exist = None
-            if kemono_user_exist:
-                creator_exist = kemono_user_exist.kemono_creator
-                # await session.run_sync(lambda _ : creator_exist.kemono_users)
-            else:
-                # first try get users by link accounts
-                all_users_exist = await session.kemono_user.get_users([u.hash_id for u in creator_now.kemono_users])
-                if all_users_exist:
-                    creator_exist = all_users_exist[0].kemono_creator
-            
-            commit = False
-            kemono_user = None
-            if creator_exist is None:
-                # add new creator
-                await session.kemono_creator.add_creator(creator_now, commit=False)
-                for i in range(len(creator_now.kemono_users)):
-                    creator_now.kemono_users[i] = await session.kemono_user.add_user(creator_now.kemono_users[i], commit=False)
-                kemono_user = get_current_user(creator_now.kemono_users)
-                commit = True
-            else:
-                # first check current user's updated time
-                if kemono_user_exist is not None and kemono_user_exist.updated < kemono_user_now.updated:
-                    kemono_user_exist.sqlmodel_update(kemono_user_now)
-                    session.kemono_user.update(kemono_user_exist, commit=False)
-                    commit = True
-                
-                # check creator public data
-                if creator_now.hash_id != creator_exist.hash_id:
-                    # update creator public data
-                    for user in creator_now.kemono_users:
-                        user_exist = await session.kemono_user.get_user(user.hash_id)
-                        if user_exist:
-                            user_exist.sqlmodel_update(user)
-                            session.kemono_user.update(user_exist, commit=False)
-                        else:
-                            session.kemono_user.add_user(user, commit=False)
-                    kemono_user = get_current_user(creator_now.kemono_users)
-                    commit = True
-                else:
-                    kemono_user = get_current_user(creator_exist.kemono_users)
-
-            try:
-                # commit users and creator to database
-                if commit:
-                    await session.commit()
-            except Exception as e:
-                logger.error(f"Error getting kemono users and creator: {e}")
-                await session.rollback()
-            
+        async def write_creator(session: AsyncCombineSession):
+            # creator and all of its linked users in two statements, rows that exist are updated in place
+            await session.kemono_creator.upsert_creators([creator_now], commit=False)
+            await session.kemono_user.upsert_users(creator_now.kemono_users, commit=False)
+        
+        try:
+            await self.writer.submit(write_creator)
+        except Exception as e:
+            logger.error(f"Error getting kemono users and creator: {e}")
+        
+        async with self.read_session_context() as session:
             posts_info_exist = await session.kemono_posts_info.get_info_by_user_hash_id(user_hash_id)
-            if (posts_info_exist and posts_info_exist.updated < kemono_user_now.updated) or posts_info_exist is None:
-                posts = await self.kemono_api.kemono_posts.build_all_posts(kemono_user_now)
-                info = posts[0].info
-                if posts_info_exist is not None:
-                    posts_info_exist.sqlmodel_update(info)
-                    await session.kemono_posts_info.update(posts_info_exist, commit=False)
-                    await session.kemono_post.delete_all_by_info(info.hash_id, commit=False)
-                    await session.kemono_attachment.delete_all_by_user(user_hash_id, commit=False)
-                else:
-                    await session.kemono_posts_info.add_info(info, commit=False)
-                await session.kemono_post.add_posts(posts, commit=False)
-                for post in posts:
-                    await session.kemono_attachment.add_attachments(post.attachments, commit=False)
-                try:
-                    # commit posts and attachments to database
-                    await session.commit()
-                except Exception as e:
-                    await session.rollback()
-                    logger.error(f"Error adding kemono user: {e}")
-        return kemono_user
+        if (posts_info_exist and posts_info_exist.updated < kemono_user_now.updated) or posts_info_exist is None:
+            if posts_info_exist is None or full_sync or not await self.update_kemono_posts(kemono_user_now):
+                await self.add_kemono_posts(kemono_user_now)
+        
+        async with self.read_session_context() as session:
+            return await session.kemono_user.get_user(user_hash_id)
     
     async def update_kemono_user(self, user_id=None, service=None, server_id=None, url=None):
         pass
     
-    async def add_kemono_posts(self):
-        pass
+    async def add_kemono_posts(self, kemono_user_now: KemonoUserCreate):
+        '''Fetch every post of the user and replace the stored ones.'''
+        posts = await self.kemono_api.kemono_posts.build_all_posts(kemono_user_now)
+        info = posts[0].info
+        
+        async def write(session: AsyncCombineSession):
+            posts_info_exist = await session.kemono_posts_info.get_info_by_user_hash_id(kemono_user_now.hash_id)
+            if posts_info_exist is not None:
+                posts_info_exist.sqlmodel_update(info.model_dump(exclude={"posts"}))
+                await session.kemono_posts_info.update(posts_info_exist, commit=False)
+                # posts_info_exist already carries the new hash_id, drop old posts by user instead
+                await session.kemono_post.delete_all_by_user(kemono_user_now.hash_id, commit=False)
+                await session.kemono_attachment.delete_all_by_user(kemono_user_now.hash_id, commit=False)
+            else:
+                await session.kemono_posts_info.add_info(info, commit=False)
+            await session.kemono_post.bulk_add_posts(posts, commit=False)
+            await session.kemono_attachment.bulk_add_attachments(
+                [attachment for post in posts for attachment in post.attachments or ()], commit=False
+            )
+        
+        try:
+            await self.writer.submit(write)
+        except Exception as e:
+            logger.error(f"Error adding kemono posts: {e}")
 
-    async def update_kemono_posts(self):
-        pass
+    async def update_kemono_posts(self, kemono_user_now: KemonoUserCreate) -> bool:
+        '''
+        Fetch pages from the newest until one holds no new or edited post and write only those posts.
+        Posts deleted on the server stay until a full sync. Returns False when the user can't be synced this way
+        or the write fails, the caller then falls back to the full sync.
+        '''
+        user_hash_id = kemono_user_now.hash_id
+        async with self.read_session_context() as session:
+            known = await session.kemono_post.get_edited_by_user(user_hash_id)
+        info = build_kemono_posts_info(kemono_user_now, 0)
+        posts = await self.kemono_api.kemono_posts.build_new_posts(kemono_user_now, known, info)
+        if posts is None:
+            return False
+        edited = [post.hash_id for post in posts if post.hash_id in known]
+        info.posts_length = len(known) + len(posts) - len(edited)
+        
+        async def write(session: AsyncCombineSession):
+            posts_info_exist = await session.kemono_posts_info.get_info_by_user_hash_id(user_hash_id)
+            # info hash_id follows the user's updated time, move the kept posts to it first
+            await session.kemono_post.set_posts_info_by_user(user_hash_id, info.hash_id, commit=False)
+            posts_info_exist.sqlmodel_update(info.model_dump(exclude={"posts"}))
+            await session.kemono_posts_info.update(posts_info_exist, commit=False)
+            if edited:
+                # attachments of an edited post may be added or removed, they are replaced while the post row is upserted
+                await session.kemono_attachment.delete_all_by_posts(edited, commit=False)
+            await session.kemono_post.bulk_upsert_posts(posts, commit=False)
+            await session.kemono_attachment.bulk_add_attachments(
+                [attachment for post in posts for attachment in post.attachments or ()], commit=False
+            )
+        
+        try:
+            await self.writer.submit(write)
+        except Exception as e:
+            logger.error(f"Error syncing kemono posts: {e}")
+            return False
+        logger.info(f"Synced {len(posts) - len(edited)} new and {len(edited)} edited posts for user {kemono_user_now.user_id}")
+        return True
 
-    async def add_kemono_files(self, formatter: KemonoFilesFormatter, user_id=None, service=None, server_id=None, url=None, update=True):
+    async def add_kemono_files(self, formatter: KemonoFilesFormatter, user_id=None, service=None, server_id=None, url=None, update=True, incremental=True):
         kemono_user = await self.get_user(user_id, service, server_id, url)
-        async with self.session_context() as session:
+        async with self.read_session_context() as session:
             posts = await session.kemono_post.get_posts_by_user(kemono_user.hash_id)
             if not posts:
                 logger.warning(f"No posts found for user {kemono_user.user_id}")
                 return
-            files_exist = await self.get_files(kemono_user.hash_id, formatter.formatter_name)
-            formatter_params = await session.formatter_params.get_param(formatter.formatter_name)
-        need_delete = False
+            files_exist = not update and await self.get_files(kemono_user.hash_id, formatter.formatter_name)
         # We not use db data in session, may ROLLBACK in case of relation loaded.
         if files_exist:
-            if not update:
-                logger.warning(f"Kemono files already exist for user {kemono_user.user_id} with formatter {formatter.formatter_name}")
-                return
-            need_delete = True
+            logger.warning(f"Kemono files already exist for user {kemono_user.user_id} with formatter {formatter.formatter_name}")
+            return
         files = await formatter.generate_files(kemono_user, posts)
-        
-        async with self.session_context() as session:
+        # the stored rows are diffed inside the write, a snapshot read here may be stale by then
+        return await self.save_kemono_files(formatter, kemono_user.hash_id, files, incremental=incremental)
+
+    async def save_kemono_files(
+        self, 
+        formatter: KemonoFilesFormatter, 
+        user_hash_id: str, 
+        files: list[Union[KemonoFile, dict]], 
+        incremental: bool = True,
+        relink: bool = True
+    ) -> Optional[KemonoFilesDiff]:
+        '''
+        Write generated files of one user for a formatter. `files` may be plain row dicts.
+        With `incremental` only the difference against the stored rows is written and already linked
+        files are moved to their new save path, otherwise all rows of the user and formatter are replaced.
+        '''
+        async def write(session: AsyncCombineSession):
+            formatter_params = await session.formatter_params.get_param(formatter.formatter_name)
             if formatter_params is None:
                 await session.formatter_params.add_param_by_kwd(formatter.formatter_name, commit=False, **formatter.get_params())
             else:
                 formatter_params.sqlmodel_update(formatter.get_params())
                 await session.formatter_params.update(formatter_params, commit=False)
-            if need_delete:
-                await session.kemono_file.delete_files_by_formatter_name(formatter.formatter_name, commit=False)
-            await session.kemono_file.add_files(files, commit=False)
             
+            if not incremental:
+                # only this user's files, a formatter name may be shared by many users
+                await session.kemono_file.delete_files_by_user(user_hash_id, formatter.formatter_name, commit=False)
+                if files and isinstance(files[0], dict):
+                    await session.kemono_file.bulk_insert(files, commit=False)
+                else:
+                    await session.kemono_file.add_files(files, commit=False)
+                return None
+            diff = diff_kemono_files(await session.kemono_file.get_files_by_user(user_hash_id, formatter.formatter_name), files)
+            await session.kemono_file.delete_all(diff.removed, commit=False)
+            await session.kemono_file.bulk_update(
+                [{"id": old.id, **{field: new[field] for field in KemonoFilesDiff.compare_fields}} for old, new in diff.changed],
+                commit=False
+            )
+            await session.kemono_file.bulk_insert(diff.added, commit=False)
+            return diff
+        
+        try:
+            diff = await self.writer.submit(write)
+        except Exception as e:
+            logger.error(f"Error adding kemono files: {e}")
+            return
+        if diff is not None:
+            logger.debug(f"Kemono files of user {user_hash_id} with formatter {formatter.formatter_name}: {diff}")
+            if relink:
+                self.relink_files(diff)
+        return diff
+
+    async def add_kemono_files_multi(
+        self, 
+        jobs: list[tuple[KemonoUser, KemonoFilesFormatter]], 
+        update: bool = True, 
+        max_workers: Optional[int] = None,
+        incremental: bool = True,
+        progress: Optional[DownloadProgress] = None
+    ):
+        '''
+        Generate files of many users in a process pool, rows are written here as each user completes.
+        '''
+        async def generate(kemono_user: KemonoUser, formatter: KemonoFilesFormatter):
+            return kemono_user, formatter, await pool.submit(kemono_user.hash_id, formatter)
+        
+        async def save(next_done):
             try:
-                await session.commit()
+                kemono_user, formatter, files = await next_done
             except Exception as e:
-                await session.rollback()
-                logger.error(f"Error adding kemono files: {e}")
+                logger.error(f"Error generating files: {e}")
+                return
+            if not files:
+                logger.warning(f"No posts found for user {kemono_user.user_id}")
+                return
+            await self.save_kemono_files(formatter, kemono_user.hash_id, files, incremental=incremental)
+            logger.info(f"Generated {len(files)} files for ({kemono_user.service})\t{kemono_user.public_name}")
+        
+        async with FilesGeneratePool(self.read_engine.url.database, max_workers) as pool:
+            generating = []
+            for kemono_user, formatter in jobs:
+                if not update and await self.get_files(kemono_user.hash_id, formatter.formatter_name):
+                    logger.warning(f"Kemono files already exist for user {kemono_user.user_id} with formatter {formatter.formatter_name}")
+                    continue
+                generating.append(generate(kemono_user, formatter))
+            # rows are written on this loop one user at a time, in completion order, while workers keep generating
+            await ProgramTools.async_with_progress(save, list(asyncio.as_completed(generating)), "Generating files", progress=progress)
 
-    async def update_kemono_files(self, formatter):
-        pass
+    async def update_kemono_files(self, formatter: KemonoFilesFormatter, user_id=None, service=None, server_id=None, url=None):
+        '''
+        Regenerate the files of a user and apply only the difference to the stored rows and links.
+        The whole post list is formatted again, serial numbers and pages are counted over all posts,
+        so a new post can shift the names of older ones.
+        '''
+        return await self.add_kemono_files(formatter, user_id, service, server_id, url, update=True, incremental=True)
     
-    async def hard_link_files(self, res_root: str, kemono_files: list[KemonoFile], warn = False, progress: Optional[DownloadProgress] = None):
+    @staticmethod
+    def relink_files(diff: KemonoFilesDiff):
+        '''Move hard links of renamed files to their new save path, drop the links of removed files.'''
+        # two steps, a new save path is often the old one of another file (serial numbers shifted)
+        moving = []
+        for old, new in diff.renamed:
+            if not path_exists(old.save_path):
+                continue
+            tmp_path = f"{old.save_path}.{old.id}.relink"
+            try:
+                os.replace(old.save_path, tmp_path)
+                moving.append((tmp_path, old.save_path, new["save_path"]))
+            except OSError as e:
+                logger.error(f"Failed to move {old.save_path}, {e}")
+        for tmp_path, old_path, new_path in moving:
+            if path_exists(new_path):
+                if path_exists(old_path):
+                    logger.warning(f"Files {new_path} and {old_path} already exist, keep {tmp_path}")
+                    continue
+                logger.warning(f"File {new_path} already exists, keep {old_path}")
+                new_path = old_path
+            try:
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.replace(tmp_path, new_path)
+            except OSError as e:
+                logger.error(f"Failed to move {old_path} -> {new_path}, {e}")
+        for old in diff.removed:
+            try:
+                # never drop the last link, the resource may have been removed since
+                if path_exists(old.save_path) and os.stat(old.save_path).st_nlink > 1:
+                    os.remove(old.save_path)
+            except OSError as e:
+                logger.error(f"Failed to remove {old.save_path}, {e}")
+    
+    async def hard_link_files(
+        self, 
+        res_root: Union[str, ResourceHandler], 
+        kemono_files: list[KemonoFile], 
+        warn = False, 
+        progress: Optional[DownloadProgress] = None
+    ):
+        '''Link `kemono_files` to their resources, pass a shared `ResourceHandler` when linking for many users.'''
         hard_link_map = {}
-        res_handler = ResourceHandler(res_root)
+        res_handler = res_root if isinstance(res_root, ResourceHandler) else ResourceHandler(res_root)
+        await res_handler.load_index()
         
         def get_need_link_files(kemono_file: KemonoFile):
             res_path = res_handler.get_path(kemono_file.sha256, kemono_file.attachment_hash_id)
-            if not res_path.exists():
+            if not res_handler.exists(kemono_file.sha256, kemono_file.attachment_hash_id):
                 if warn:
                     logger.warning(f"File {res_path} not exists, skip hard link")
             elif path_exists(kemono_file.save_path):
@@ -276,25 +426,33 @@ class KemonoProgram:
         sha256_map = bidict() # K: original sha256(file_name), V: actual sha256
         with NormalProgress() as progress:
             task = progress.add_task("Checking resource", total=len(files))
+            files_map: dict[str, KemonoFile] = {}
             for file in files:
-                if file.sha256 is not None and resource_handler.exists(file.sha256):
-                    sha256_calc = await resource_handler.async_get_file_hash(file.sha256)
-                    if sha256_calc != file.sha256:
-                        if resource_handler.exists(sha256_calc):
-                            sha256_map[file.sha256] = sha256_calc
-                            resource_handler.move_to_tmp(file.sha256)
-                            logger.warning(f"Current file {file.file_name}'s sha256 is another file's sha256")
-                        else:
-                            logger.warning(f"Current file {file.file_name} has different sha256: {file.sha256} -> {sha256_calc}, remove it")
-                            resource_handler.remove(file.sha256)
+                if file.sha256 is not None and file.sha256 not in files_map and resource_handler.exists(file.sha256):
+                    files_map[file.sha256] = file
+                else:
+                    task.advance()
+            async for sha256, sha256_calc in resource_handler.async_get_files_hash(files_map.keys()):
+                file = files_map[sha256]
+                if sha256_calc is not None and sha256_calc != file.sha256:
+                    if resource_handler.exists(sha256_calc):
+                        sha256_map[file.sha256] = sha256_calc
+                        resource_handler.move_to_tmp(file.sha256)
+                        logger.warning(f"Current file {file.file_name}'s sha256 is another file's sha256")
+                    else:
+                        logger.warning(f"Current file {file.file_name} has different sha256: {file.sha256} -> {sha256_calc}, remove it")
+                        resource_handler.remove(file.sha256)
                 task.advance()
             
             for sha256, actual_sha256 in sha256_map.items():
                 if actual_sha256 in sha256_map:
                     logger.info(f"File {sha256} has been linked to {actual_sha256}")
                     shutil_move(resource_handler.get_tmp_path(sha256), resource_handler.get_path(actual_sha256))
+                    resource_handler.mark_exists(actual_sha256)
                 else:
                     logger.info(f"File {sha256} -> {actual_sha256}")
+            if resource_handler.hash_service.cache is not None:
+                logger.info(f"Hash cache: {resource_handler.hash_service.cache.stats()}")
     
     async def download_files_by_users(
         self, 
@@ -303,35 +461,68 @@ class KemonoProgram:
         downloader: Optional[Downloader] = None, 
         filter_expr: Optional[Union[str, RunCoder]] = None
     ):
-        def remove_duplicates(files: list[KemonoAttachment]):
-            seen = set()
-            return [file for file in files if file.sha256 is None or (file.sha256 not in seen and not seen.add(file.sha256))]
-        def remove_existed(files: list[KemonoAttachment]):
-            return [file for file in files if not resource_handler.exists(file.sha256, file.hash_id)]
         async def get_all_attachments(user: KemonoUser):
-            posts = await session.kemono_post.get_posts_by_user(user.hash_id)
+            seen = set()
             attachments = []
-            raw_attachments_count = 0
-            for post in posts:
-                raw_attachments_count += len(post.attachments)
-                if filter_expr is not None:
-                    _attachments = filter(lambda att: filter_expr.run(user = user, post = post, attachment = att), post.attachments)
-                else:
-                    _attachments = post.attachments
-                attachments.extend(_attachments)
-            filtered_count = len(attachments)
-            filter_count = raw_attachments_count - filtered_count
-            attachments = remove_duplicates(attachments)
-            removed_duplicates_count = len(attachments)
-            remove_duplicates_count = filtered_count - removed_duplicates_count
-            attachments = remove_existed(attachments)
-            remove_existed_count = removed_duplicates_count - len(attachments)
+            raw_attachments_count = filter_count = remove_duplicates_count = remove_existed_count = 0
+            # filters see column rows with the ORM attributes instead of ORM objects,
+            # posts are only loaded when a filter needs them, their attachments when it reads `attachments`
+            posts = None
+            if filter_expr is not None:
+                posts = {
+                    hash_id: FilterPost(row)
+                    for hash_id, row in (await session.kemono_post.get_post_rows_by_user(user.hash_id)).items()
+                }
+                if "attachments" in filter_expr.attributes:
+                    async for rows in session.kemono_attachment.stream_attachment_rows([user.hash_id]):
+                        for row in rows:
+                            if (post := posts.get(row.post_hash_id)) is not None:
+                                post.attachments.append(FilterAttachment(row, post))
+            if where:
+                # rows rejected in sql never reach the python filter but still count as filtered
+                raw_attachments_count = await session.kemono_attachment.count_by_user(user.hash_id)
+            passed_count = 0
+            async for rows in session.kemono_attachment.stream_attachment_rows([user.hash_id], where):
+                passed_count += len(rows)
+                for attachment in rows:
+                    if filter_expr is not None and not filter_expr.run(
+                        user = user, 
+                        post = (post := posts.get(attachment.post_hash_id)), 
+                        attachment = FilterAttachment(attachment, post)
+                    ):
+                        filter_count += 1
+                    elif attachment.sha256 is not None and attachment.sha256 in seen:
+                        remove_duplicates_count += 1
+                    elif resource_handler.exists(attachment.sha256, attachment.hash_id):
+                        seen.add(attachment.sha256)
+                        remove_existed_count += 1
+                    else:
+                        seen.add(attachment.sha256)
+                        attachments.append(attachment)
+            if where:
+                filter_count += raw_attachments_count - passed_count
+            else:
+                raw_attachments_count = passed_count
             
             all_attachments.extend(attachments)
             logger.info(f"User {user.name} has {len(attachments)} attachments. All({raw_attachments_count}) Filtered({filter_count}) RemovedDuplicates({remove_duplicates_count}) RemovedExisted({remove_existed_count})")
         
+        def on_download_done(download_task, result):
+            if result is not None and result.success:
+                resource_handler.mark_path_exists(download_task.info.save_path)
+            if download_task.size_probed and (hash_id := unknown_sizes.pop(str(download_task.info.save_path), None)):
+                found_sizes[hash_id] = download_task.info.file_size
+                if len(found_sizes) >= 500:
+                    write_found_sizes()
+        
+        def write_found_sizes():
+            if found_sizes:
+                size_writes.append(asyncio.create_task(self.writer.write("kemono_attachment", "set_sizes", found_sizes.copy())))
+                found_sizes.clear()
+        
         if filter_expr is not None and isinstance(filter_expr, str):
             filter_expr = RunCoder(filter_expr)
+        where = filter_to_where(filter_expr)
         
         if downloader is None:
             prop = DownloadProperties(
@@ -343,17 +534,57 @@ class KemonoProgram:
         if not downloader.is_running:
             downloader.start()
         downloader.set_signal_cancel()
+        downloader.add_done_callback(on_download_done)
+        await resource_handler.load_index()
         
-        async with self.session_context() as session:
-            all_attachments: list[KemonoAttachment] = []
+        async with self.read_session_context() as session:
+            all_attachments: list[AttachmentRow] = []
             await ProgramTools.async_with_progress(get_all_attachments, users, "Getting attachments")
+        
+        # sizes recorded on the attachments are trusted, the others are taken from the first GET of their download
+        # (no HEAD request) and written back, so the next run knows them too
+        unknown_sizes: dict[str, str] = {}
+        found_sizes: dict[str, int] = {}
+        size_writes: list[asyncio.Task] = []
+        for attachment in all_attachments:
+            if attachment.size is None:
+                unknown_sizes[str(resource_handler.get_path(attachment.sha256, attachment.hash_id))] = attachment.hash_id
+        if unknown_sizes:
+            logger.info(f"{len(unknown_sizes)} of {len(all_attachments)} attachments have no recorded size")
+        
         downloader.prop.progress_tracker.add_main_task(f"Downloading {len(all_attachments)} files", len(all_attachments))
         for attachment in all_attachments:
             save_path = resource_handler.get_path(attachment.sha256, attachment.hash_id)
-            downloader.create_task(attachment.path, save_path, attachment.sha256, attachment.size, attachment.sha256)
+            downloader.create_task(
+                attachment.path, save_path,
+                file_name=attachment.name,
+                file_size=attachment.size,
+                file_sha256=attachment.sha256,
+                file_type=attachment.type,
+            )
     
         await downloader.wait_any_tasks_done(len(all_attachments))
         await downloader.stop()
+        write_found_sizes()
+        await asyncio.gather(*size_writes)
+        resource_handler.save_index()
+    
+    async def resume_downloads(self, resource_handler: ResourceHandler, downloader: Downloader):
+        '''Continue the unfinished tasks in the journal of `downloader`, left by an interrupted download run.'''
+        def on_download_done(download_task, result):
+            if result is not None and result.success:
+                resource_handler.mark_path_exists(download_task.info.save_path)
+        
+        if not downloader.is_running:
+            downloader.start()
+        downloader.set_signal_cancel()
+        downloader.add_done_callback(on_download_done)
+        task_ids = downloader.resume_unfinished()
+        logger.info(f"Resuming {len(task_ids)} unfinished downloads")
+        downloader.prop.progress_tracker.add_main_task(f"Downloading {len(task_ids)} files", len(task_ids))
+        await downloader.wait_any_tasks_done(len(task_ids))
+        await downloader.stop()
+        resource_handler.save_index()
 
 
 class CompressHandler:
@@ -1,11 +1,37 @@
 import os
 import shutil
+import asyncio
 from pathlib import Path
-from kemonobakend.utils import verify_file_sha256, async_verify_file_sha256, async_calc_file_sha256, calc_file_sha256
+from typing import Iterable, AsyncGenerator, Optional
+from kemonobakend.utils import (
+    verify_file_sha256, async_verify_file_sha256, async_calc_file_sha256, calc_file_sha256,
+    calc_str_md5, HashService, get_hash_service
+)
+from kemonobakend.config import settings
+
+from .resource_index import ResourceIndex
 
 class ResourceHandler:
-    def __init__(self, root: str):
+    def __init__(
+        self, 
+        root: str, 
+        hash_service: Optional[HashService] = None, 
+        use_index: Optional[bool] = None,
+        persist_index: Optional[bool] = None,
+    ):
         self.root = root
+        self.hash_service = hash_service or get_hash_service()
+        if use_index is None:
+            use_index = settings.program.resource_index_enabled
+        if persist_index is None:
+            persist_index = settings.program.resource_index_persist
+        self.index: Optional[ResourceIndex] = None
+        if use_index:
+            persist_path = None
+            if persist_index:
+                root_id = calc_str_md5(os.path.abspath(root))
+                persist_path = Path(settings.program.database_path).with_name(f"resource_index_{root_id}.bin")
+            self.index = ResourceIndex(root, persist_path)
     
     def get_path(self, sha256, hash_id = None):
         if sha256 is None:
@@ -18,9 +44,39 @@ class ResourceHandler:
         return Path(os.path.join(self.root, "tmp", sha256))
     
     def exists(self, sha256, hash_id = None):
+        if self.index is not None:
+            return self.index.exists(sha256, hash_id)
         path = self.get_path(sha256, hash_id)
         return os.path.exists(path)
     
+    def mark_exists(self, sha256, hash_id = None):
+        '''Record a resource that has been added to the store, e.g. a completed download.'''
+        if self.index is not None:
+            self.index.add(sha256, hash_id)
+    
+    def mark_path_exists(self, path: str):
+        path = Path(path)
+        if self.index is None or not path.exists():
+            return
+        if path.parent.name == "no_hash":
+            self.index.add(None, path.name)
+        else:
+            self.index.add(path.name)
+    
+    async def load_index(self):
+        '''Load or scan the index in a thread, so the first `exists` doesn't block the event loop.'''
+        if self.index is not None and not self.index.is_loaded:
+            await asyncio.to_thread(self.index.load_or_build)
+        return self
+    
+    def rebuild_index(self):
+        if self.index is not None:
+            self.index.build()
+    
+    def save_index(self):
+        if self.index is not None:
+            self.index.save()
+    
     def get_all_resources(self):
         all_files = []
         for root, dirs, files in os.walk(self.root):
@@ -32,29 +88,45 @@ class ResourceHandler:
     def remove(self, sha256, hash_id = None):
         path = self.get_path(sha256, hash_id)
         if path.exists():
+            if self.hash_service.cache is not None:
+                self.hash_service.cache.invalidate(path)
             path.unlink()
+        if self.index is not None:
+            self.index.discard(sha256, hash_id)
     
     def get_file_hash(self, sha256):
         path = self.get_path(sha256)
         if path.exists():
-            return calc_file_sha256(path)
+            return self.hash_service.hash_file_sync(path)
     
     async def async_get_file_hash(self, sha256):
         path = self.get_path(sha256)
         if os.path.exists(path):
-            return await async_calc_file_sha256(path)
+            return await self.hash_service.hash_file(path)
+    
+    async def async_get_files_hash(self, sha256_list: Iterable[str]) -> AsyncGenerator[tuple[str, Optional[str]], None]:
+        '''Yield `(sha256, actual sha256)` of existing resources as they are hashed, in completion order.'''
+        path_map = {self.get_path(sha256): sha256 for sha256 in sha256_list}
+        async for path, sha256_calc in self.hash_service.hash_files(path_map.keys()):
+            yield path_map[path], sha256_calc
     
     def verify_file(self, sha256):
         path = self.get_path(sha256)
-        return verify_file_sha256(path, sha256, True)
+        if not path.exists():
+            return False
+        return self.hash_service.hash_file_sync(path) == sha256
 
     async def async_verify_file(self, sha256):
         path = self.get_path(sha256)
-        return await async_verify_file_sha256(path, sha256, True)
+        if not path.exists():
+            return False
+        return await self.hash_service.hash_file(path) == sha256
     
     def move_to_tmp(self, sha256):
         path = self.get_path(sha256)
         tmp_path = Path(os.path.join(self.root, "tmp", sha256))
         if not tmp_path.parent.exists():
             tmp_path.parent.mkdir(parents=True)
-        shutil.move(path, tmp_path)
\ No newline at end of file
+        shutil.move(path, tmp_path)
+        if self.index is not None:
+            self.index.discard(sha256)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import struct
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from kemonobakend.log import logger
+
+
+class DigestSet:
+    '''
+    Compact set of 32-byte digests: a sorted byte array searched by bisection,
+    plus small sets of digests added/removed since the last compaction.
+    '''
+    SIZE = 32
+    
+    def __init__(self, data: bytes = b"", compact_threshold: int = 4096):
+        self._data = data
+        self._count = len(data) // self.SIZE
+        self._added: set[bytes] = set()
+        self._removed: set[bytes] = set()
+        self.compact_threshold = compact_threshold
+    
+    @classmethod
+    def from_iterable(cls, digests: Iterable[bytes]):
+        return cls(b"".join(sorted(set(digests))))
+    
+    def _search(self, key: bytes) -> bool:
+        lo, hi = 0, self._count
+        data, size = self._data, self.SIZE
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = data[mid*size:(mid+1)*size]
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return True
+        return False
+    
+    def __contains__(self, key: bytes) -> bool:
+        if key in self._added:
+            return True
+        if key in self._removed:
+            return False
+        return self._search(key)
+    
+    def add(self, key: bytes):
+        if self._search(key):
+            self._removed.discard(key)
+            return
+        self._added.add(key)
+        if len(self._added) + len(self._removed) >= self.compact_threshold:
+            self.compact()
+    
+    def discard(self, key: bytes):
+        self._added.discard(key)
+        if self._search(key):
+            self._removed.add(key)
+    
+    def compact(self):
+        if not self._added and not self._removed:
+            return
+        size = self.SIZE
+        keys = (self._data[i*size:(i+1)*size] for i in range(self._count))
+        keys = [k for k in keys if k not in self._removed]
+        keys.extend(self._added)
+        keys.sort()
+        self._data = b"".join(keys)
+        self._count = len(keys)
+        self._added.clear()
+        self._removed.clear()
+    
+    def to_bytes(self) -> bytes:
+        self.compact()
+        return self._data
+    
+    def __len__(self):
+        return self._count + len(self._added) - len(self._removed)
+
+class ResourceIndex:
+    '''
+    In-memory index of the resources under `root`, laid out as `{sha256[:2]}/{sha256[2:4]}/{sha256}`
+    and `no_hash/{hash_id}`. Built once with os.scandir, then existence checks don't touch the disk.
+    If `persist_path` is given, the index is loaded from and saved to that file instead of scanning.
+    '''
+    MAGIC = b"KMRI\x01"
+    
+    def __init__(self, root: str, persist_path: Optional[Union[str, Path]] = None):
+        self.root = root
+        self.persist_path = Path(persist_path) if persist_path is not None else None
+        self.digests = DigestSet()
+        self.no_hash: set[str] = set()
+        self.is_loaded = False
+    
+    @staticmethod
+    def _is_hex(name: str, length: int) -> bool:
+        if len(name) != length:
+            return False
+        try:
+            int(name, 16)
+        except ValueError:
+            return False
+        return True
+    
+    def build(self):
+        digests = []
+        no_hash = set()
+        if os.path.isdir(self.root):
+            with os.scandir(self.root) as level1:
+                for d1 in level1:
+                    if d1.name == "no_hash" and d1.is_dir():
+                        with os.scandir(d1.path) as files:
+                            no_hash.update(f.name for f in files if f.is_file())
+                        continue
+                    if not self._is_hex(d1.name, 2) or not d1.is_dir():
+                        continue
+                    with os.scandir(d1.path) as level2:
+                        for d2 in level2:
+                            if not self._is_hex(d2.name, 2) or not d2.is_dir():
+                                continue
+                            with os.scandir(d2.path) as files:
+                                for f in files:
+                                    # skip '.part' files of unfinished direct downloads
+                                    if self._is_hex(f.name, 64) and f.is_file():
+                                        digests.append(bytes.fromhex(f.name))
+        self.digests = DigestSet.from_iterable(digests)
+        self.no_hash = no_hash
+        self.is_loaded = True
+        logger.debug(f"Resource index of {self.root} built, {len(self.digests)} resources, {len(self.no_hash)} no hash resources")
+        return self
+    
+    def load(self) -> bool:
+        if self.persist_path is None or not self.persist_path.exists():
+            return False
+        try:
+            with open(self.persist_path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    return False
+                count, = struct.unpack("<Q", f.read(8))
+                data = f.read(count * DigestSet.SIZE)
+                no_hash = f.read().decode("utf-8")
+        except (OSError, struct.error, UnicodeDecodeError) as e:
+            logger.warning(f"Failed to load resource index {self.persist_path}: {e}")
+            return False
+        self.digests = DigestSet(data)
+        self.no_hash = set(no_hash.split("\n")) if no_hash else set()
+        self.is_loaded = True
+        return True
+    
+    def load_or_build(self):
+        if not self.load():
+            self.build()
+        return self
+    
+    def save(self):
+        if self.persist_path is None or not self.is_loaded:
+            return
+        if not self.persist_path.parent.exists():
+            self.persist_path.parent.mkdir(parents=True)
+        data = self.digests.to_bytes()
+        tmp_path = self.persist_path.with_name(self.persist_path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack("<Q", len(data) // DigestSet.SIZE))
+            f.write(data)
+            f.write("\n".join(self.no_hash).encode("utf-8"))
+        os.replace(tmp_path, self.persist_path)
+    
+    def exists(self, sha256: Optional[str], hash_id: Optional[str] = None) -> bool:
+        if not self.is_loaded:
+            self.load_or_build()
+        if sha256 is None:
+            return hash_id in self.no_hash
+        try:
+            return bytes.fromhex(sha256) in self.digests
+        except ValueError:
+            return False
+    
+    def add(self, sha256: Optional[str], hash_id: Optional[str] = None):
+        if sha256 is None:
+            self.no_hash.add(hash_id)
+        else:
+            self.digests.add(bytes.fromhex(sha256))
+    
+    def discard(self, sha256: Optional[str], hash_id: Optional[str] = None):
+        if sha256 is None:
+            self.no_hash.discard(hash_id)
+        else:
+            self.digests.discard(bytes.fromhex(sha256))
+    
+    def __len__(self):
+        return len(self.digests) + len(self.no_hash)
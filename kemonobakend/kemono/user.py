@@ -1,3 +1,4 @@
+from typing import Optional
 from kemonobakend.downloader import Downloader, DownloadProperties
 from kemonobakend.database import AsyncCombineSession
 from kemonobakend.database.models import KemonoAttachment
@@ -18,11 +19,14 @@ async def download_by_user(
     session_pool=None, 
     filter=None,
     wait: bool = True,
+    res_handler: Optional[ResourceHandler] = None,
 ):
     def remove_duplicates(files: list[KemonoAttachment]):
         seen = set()
         return [file for file in files if file.sha256 is None or (file.sha256 not in seen and not seen.add(file.sha256))]
-    res_handler = ResourceHandler(root)
+    if res_handler is None:
+        res_handler = ResourceHandler(root)
+    await res_handler.load_index()
     
     user_id, user_hash_id, service = parse_user_id(user_id, service, server_id, url)
     async with AsyncCombineSession(engine) as session:
@@ -48,7 +52,7 @@ async def download_by_user(
 
     for file in files:
         save_path = res_handler.get_path(file.sha256, file.hash_id)
-        await downloader.create_task(file.path, save_path, file.sha256, file.size)
+        downloader.create_task(file.path, save_path, file_name=file.name, file_size=file.size, file_sha256=file.sha256, file_type=file.type)
     
     if wait:
         await downloader.wait_forever()
@@ -1,35 +1,157 @@
+import os
+from pathlib import Path
+from functools import cached_property
+from typing import Optional, TYPE_CHECKING
 
-from kemonobakend.downloader.download import DownloadTask
+from kemonobakend.utils import path_join, json_dumps, json_loads
+from kemonobakend.log import logger
 from .base import StoreBase
 
+if TYPE_CHECKING:
+    from kemonobakend.downloader.download import DownloadTask
+
 class DownloadTaskStore(StoreBase):
-    def add_download_tasks(self, download_tasks: list):
-        data = self.load()
-        data.extend(download_tasks)
-        self.dump(data)
-    
-    def add_download_task(self, download_task: DownloadTask):
-        data = self.load()
-        data.append(download_task)
-        self.dump(data)
-    
-    def get_all_unfinished_download_tasks(self):
-        return 
+    '''
+    Append-only journal of download tasks, one json record per line, keyed by the save path of the file:
+    ```json
+    {"op": "put", "key": ..., "task": {...DownloadTask.dump()}}
+    {"op": "ranges", "key": ..., "ranges": {"0-1023": 512, ...}}
+    {"op": "done" | "failed" | "cancelled" | "remove", "key": ...}
+    ```
+    Replaying the lines gives the unfinished tasks with their last range layout. Cancelled tasks are
+    unfinished, they are what a Ctrl+C leaves behind. The file is compacted to the unfinished tasks when opened,
+    closed and every `compact_records` appended records.
+    Request headers and cookies are never written, a resumed task gets them from the session pool again.
+    '''
+    SECRET_INFO_KEYS = ("headers", "cookies")
     
-    def remove_download_task(self, download_task: DownloadTask):
-        pass
+    def __init__(self, path: Optional[str] = None, compact_records: int = 1000):
+        super().__init__()
+        if path is not None:
+            self._path = Path(path)
+        self.compact_records = compact_records
+        self.tasks: dict[str, dict] = {}
+        self._file = None
+        self._appended = 0
+
+    @cached_property
+    def _path(self):
+        return Path(path_join("data", "stores", self.__class__.__name__.lower() + '.jsonl'))
+
+    def load(self):
+        tasks: dict[str, dict] = {}
+        if not self._path.exists():
+            return tasks
+        with open(self._path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json_loads(line)
+                except ValueError:
+                    # the last line of a crashed process may be cut off
+                    logger.warning(f"Skipping broken download journal line: {line[:100]!r}")
+                    continue
+                self._replay(tasks, record)
+        return tasks
+
+    @staticmethod
+    def _replay(tasks: dict[str, dict], record: dict):
+        key, op = record.get("key"), record.get("op")
+        if op == "put":
+            tasks[key] = {"task": DownloadTaskStore._strip_secrets(record["task"]), "ranges": {}}
+        elif key not in tasks:
+            return
+        elif op == "ranges":
+            tasks[key]["ranges"] = record["ranges"]
+        elif op in ("done", "failed", "remove"):
+            tasks.pop(key)
+
+    @classmethod
+    def _strip_secrets(cls, task: dict) -> dict:
+        info = task.get("info")
+        if not info or not any(key in info for key in cls.SECRET_INFO_KEYS):
+            return task
+        return {**task, "info": {key: value for key, value in info.items() if key not in cls.SECRET_INFO_KEYS}}
     
-    def download_task_done(self, download_task: DownloadTask):
-        pass
+    def dump(self, tasks: dict[str, dict]):
+        '''Rewrite the journal with only `tasks`, replaced atomically.'''
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, entry in tasks.items():
+                f.write(json_dumps({"op": "put", "key": key, "task": entry["task"]}, default=str) + "\n")
+                if entry["ranges"]:
+                    f.write(json_dumps({"op": "ranges", "key": key, "ranges": entry["ranges"]}) + "\n")
+        os.replace(tmp_path, self._path)
+
+    def _init(self):
+        self.init = True
+        self.tasks = self.load()
+        self.dump(self.tasks)
+
+    def _append(self, record: dict):
+        if not self.init:
+            self._init()
+        if self._file is None:
+            self._file = open(self._path, 'a', encoding='utf-8')
+        self._replay(self.tasks, record)
+        # save paths may be Path objects
+        self._file.write(json_dumps(record, default=str) + "\n")
+        # range records are only hints next to the part files, they may stay in the buffer
+        if record["op"] != "ranges":
+            self._file.flush()
+        self._appended += 1
+        if self._appended >= max(self.compact_records, 2 * len(self.tasks)):
+            self.compact()
     
-    def download_task_failed(self, download_task: DownloadTask):
-        pass
+    def compact(self):
+        '''Rewrite the journal with only the unfinished tasks, the next append reopens it.'''
+        self._close_file()
+        self.dump(self.tasks)
+        self._appended = 0
+
+    @staticmethod
+    def get_key(download_task: 'DownloadTask') -> str:
+        return str(download_task.info.save_path)
+
+    def add_download_tasks(self, download_tasks: list['DownloadTask']):
+        for download_task in download_tasks:
+            self.add_download_task(download_task)
+
+    def add_download_task(self, download_task: 'DownloadTask'):
+        self._append({"op": "put", "key": self.get_key(download_task), "task": self._strip_secrets(download_task.dump())})
+
+    def update_ranges(self, download_task: 'DownloadTask', ranges: dict[str, int]):
+        '''Record the range layout of a task and the bytes written to each range.'''
+        self._append({"op": "ranges", "key": self.get_key(download_task), "ranges": ranges})
+
+    def get_all_unfinished_download_tasks(self) -> list[dict]:
+        '''`{"task": DownloadTask.dump(), "ranges": {...}}` of every task not done or failed, in put order.'''
+        if not self.init:
+            self._init()
+        return list(self.tasks.values())
+
+    def download_task_done(self, download_task: 'DownloadTask'):
+        self._append({"op": "done", "key": self.get_key(download_task)})
+
+    def download_task_failed(self, download_task: 'DownloadTask'):
+        self._append({"op": "failed", "key": self.get_key(download_task)})
+
+    def download_task_cancelled(self, download_task: 'DownloadTask'):
+        self._append({"op": "cancelled", "key": self.get_key(download_task)})
+
+    def remove_download_task(self, download_task: 'DownloadTask'):
+        self._append({"op": "remove", "key": self.get_key(download_task)})
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
     
-    def download_task_cancelled(self, download_task: DownloadTask):
-        pass
+    def close(self):
+        if self.init:
+            self.compact()
+        else:
+            self._close_file()
 
-    def load(self):
-        d = super().load()
-        if d is None:
-            return []
-        return d
+    def __del__(self):
+        self._close_file()
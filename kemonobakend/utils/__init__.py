@@ -1,4 +1,6 @@
 from .tools import *
 from .data_type import InputSetMeta
 from .helpers import *
-from .mklink import MKLink
\ No newline at end of file
+from .mklink import MKLink
+from .hash_cache import HashCache
+from .hash_service import HashService, get_hash_service
\ No newline at end of file
@@ -44,4 +44,20 @@ def pre_gather_tasks(
     return [
         pre_task(task, start=start, semaphore=semaphore, callback=callback)
         for task in tasks
-    ]
\ No newline at end of file
+    ]
+
+class RateLimiter:
+    '''Space `acquire` calls at least `1 / rate` seconds apart, a rate <= 0 disables it.'''
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+    
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        # reserve the slot before sleeping, concurrent callers queue up behind it
+        wait = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
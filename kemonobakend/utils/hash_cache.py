@@ -0,0 +1,153 @@
+import os
+import sqlite3
+from threading import Lock
+from time import time as now_time
+from pathlib import Path
+from typing import Optional, Union
+
+
+class HashCache:
+    '''
+    Persistent cache of verified file hashes, stored in a small SQLite database.
+    
+    Entries are keyed by (st_dev, st_ino) and only valid while st_size and st_mtime_ns are unchanged,
+    so a file that was replaced or modified is hashed again and its stale entry is dropped.
+    '''
+    def __init__(self, path: Union[str, Path], max_entries: Optional[int] = None, commit_interval: int = 256):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.commit_interval = commit_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._uncommitted = 0
+        self._lock = Lock()
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hash_cache ("
+            "dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "sha256 TEXT NOT NULL, path TEXT, checked_at REAL NOT NULL, PRIMARY KEY (dev, ino))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_hash_cache_checked_at ON hash_cache (checked_at)")
+        self._conn.commit()
+        if max_entries is not None:
+            self.evict(max_entries)
+    
+    def lookup(self, path: Union[str, Path]) -> tuple[Optional[str], Optional[os.stat_result]]:
+        '''
+        Return `(sha256, stat)` of the file, sha256 is None on cache miss.
+        Pass the returned stat to `put()`, so a file changed while hashing is never cached.
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, sha256 FROM hash_cache WHERE dev = ? AND ino = ?", 
+                (st.st_dev, st.st_ino)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, st
+            if row[0] != st.st_size or row[1] != st.st_mtime_ns:
+                self._conn.execute("DELETE FROM hash_cache WHERE dev = ? AND ino = ?", (st.st_dev, st.st_ino))
+                self._mark_dirty()
+                self.invalidations += 1
+                self.misses += 1
+                return None, st
+            self.hits += 1
+            return row[2], st
+    
+    def get(self, path: Union[str, Path]) -> Optional[str]:
+        return self.lookup(path)[0]
+    
+    def put(self, path: Union[str, Path], sha256: str, st: Optional[os.stat_result] = None):
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hash_cache (dev, ino, size, mtime_ns, sha256, path, checked_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, sha256, os.fspath(path), now_time())
+            )
+            self._mark_dirty()
+    
+    def invalidate(self, path: Union[str, Path]):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM hash_cache WHERE dev = ? AND ino = ?", (st.st_dev, st.st_ino))
+            self._mark_dirty()
+            self.invalidations += 1
+    
+    def evict(self, max_entries: Optional[int] = None, max_age: Optional[float] = None) -> int:
+        '''Remove entries older than `max_age` seconds, then the oldest entries above `max_entries`.'''
+        with self._lock:
+            removed = 0
+            if max_age is not None:
+                removed += self._conn.execute("DELETE FROM hash_cache WHERE checked_at < ?", (now_time() - max_age,)).rowcount
+            if max_entries is not None:
+                count = self._conn.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0]
+                if count > max_entries:
+                    removed += self._conn.execute(
+                        "DELETE FROM hash_cache WHERE rowid IN (SELECT rowid FROM hash_cache ORDER BY checked_at LIMIT ?)", 
+                        (count - max_entries,)
+                    ).rowcount
+            self._conn.commit()
+            self._uncommitted = 0
+            return removed
+    
+    def prune(self) -> int:
+        '''Remove entries whose file no longer exists or has changed, this stats every cached path.'''
+        with self._lock:
+            rows = self._conn.execute("SELECT dev, ino, size, mtime_ns, path FROM hash_cache").fetchall()
+        stale = []
+        for dev, ino, size, mtime_ns, path in rows:
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns) == (dev, ino, size, mtime_ns):
+                    continue
+            except (OSError, TypeError):
+                pass
+            stale.append((dev, ino))
+        with self._lock:
+            self._conn.executemany("DELETE FROM hash_cache WHERE dev = ? AND ino = ?", stale)
+            self._conn.commit()
+            self._uncommitted = 0
+        return len(stale)
+    
+    def _mark_dirty(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_interval:
+            self._conn.commit()
+            self._uncommitted = 0
+    
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
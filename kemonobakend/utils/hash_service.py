@@ -0,0 +1,120 @@
+import asyncio
+import atexit
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from os import cpu_count
+from typing import Iterable, AsyncGenerator, Optional, Union
+from pathlib import Path
+
+from .tools import calc_file_sha256
+from .hash_cache import HashCache
+
+
+class HashService:
+    '''
+    Hash files in a thread or process pool instead of on the event loop thread.
+    hashlib releases the GIL for large updates, so a thread pool hashes several files in parallel,
+    a process pool can be used when hashing is CPU bound (fast SSD, many small files).
+    If a `HashCache` is given, files unchanged since they were last hashed are not read again.
+    '''
+    def __init__(
+        self, 
+        max_workers: Optional[int] = None, 
+        use_process: bool = False, 
+        block_size: int = 1024 * 1024,
+        cache: Optional[HashCache] = None,
+    ):
+        self.max_workers = max_workers or min(8, cpu_count() or 1)
+        self.use_process = use_process
+        self.block_size = block_size
+        self.cache = cache
+        self._executor: Optional[Executor] = None
+    
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_process:
+                self._executor = ProcessPoolExecutor(self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="HashService")
+        return self._executor
+    
+    def hash_file_sync(self, path: Union[str, Path]) -> str:
+        '''Hash a file in the current thread, using the cache if enabled.'''
+        if self.cache is None:
+            return calc_file_sha256(path, self.block_size)
+        sha256, st = self.cache.lookup(path)
+        if sha256 is None:
+            sha256 = calc_file_sha256(path, self.block_size)
+            self.cache.put(path, sha256, st)
+        return sha256
+    
+    async def hash_file(self, path: Union[str, Path]) -> str:
+        loop = asyncio.get_running_loop()
+        if not self.use_process:
+            return await loop.run_in_executor(self.executor, self.hash_file_sync, path)
+        # the cache can't be shared with worker processes, look it up in a thread of this process
+        sha256, st = None, None
+        if self.cache is not None:
+            sha256, st = await loop.run_in_executor(None, self.cache.lookup, path)
+        if sha256 is None:
+            sha256 = await loop.run_in_executor(self.executor, calc_file_sha256, path, self.block_size)
+            if self.cache is not None:
+                self.cache.put(path, sha256, st)
+        return sha256
+    
+    async def hash_files(
+        self, 
+        paths: Iterable[Union[str, Path]], 
+        max_pending: Optional[int] = None
+    ) -> AsyncGenerator[tuple[Union[str, Path], Optional[str]], None]:
+        '''
+        Yield `(path, sha256)` as soon as each file is hashed, not in input order.
+        sha256 is None if the file can't be read. At most `max_pending` files are submitted at once.
+        '''
+        max_pending = max_pending or self.max_workers * 2
+        pending: dict[asyncio.Future, Union[str, Path]] = {}
+        paths = iter(paths)
+        
+        def submit():
+            for path in paths:
+                future = asyncio.ensure_future(self.hash_file(path))
+                pending[future] = path
+                if len(pending) >= max_pending:
+                    break
+        
+        submit()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        yield path, future.result()
+                    except OSError:
+                        yield path, None
+                submit()
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+        if self.cache is not None:
+            self.cache.flush()
+
+_hash_service: Optional[HashService] = None
+
+def get_hash_service() -> HashService:
+    '''Default HashService configured by settings.program'''
+    global _hash_service
+    if _hash_service is None:
+        from kemonobakend.config import settings
+        cache = None
+        if settings.program.hash_cache_enabled:
+            cache_path = Path(settings.program.database_path).with_name("hash_cache.db")
+            cache = HashCache(cache_path, settings.program.hash_cache_max_entries)
+            atexit.register(cache.close)
+        _hash_service = HashService(settings.program.hash_workers, settings.program.hash_use_process, cache=cache)
+    return _hash_service
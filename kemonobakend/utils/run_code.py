@@ -1,5 +1,7 @@
 from random import randint
+from types import CodeType, FunctionType
 from typing import Optional
+import ast
 from PIL import Image
 import os
 from .tools import get_file_type_by_name
@@ -67,18 +69,25 @@ class RunCoder:
         self.pre_run()
     
     def run(self, **locals_vars):
-        _locals_vars = locals_vars.copy()
-        _locals_vars.update(self.local_vars)
-        return _run_code(self.code, self.rt_name, _locals_vars)
+        # one compiled function per set of passed names, the passed names it reads become its parameters
+        key = tuple(locals_vars)
+        func = self.funcs.get(key)
+        if func is None:
+            func = self.funcs[key] = compile_func(self.body, self.global_vars, self.get_params(key))
+        return func(**locals_vars)
+
+    def get_params(self, names):
+        # names nobody passed stay global lookups, a typo raises NameError as in plain python
+        return sorted(name for name in names if name in self.loads and name not in self.global_vars)
 
     def pre_run(self):
-        self.code, self.rt_name, self.local_vars = pre_run(self.raw_code, self.raw_locals)
+        self.body, self.global_vars, self.expression = pre_run(self.raw_code, self.raw_locals)
+        self.loads, _, self.attributes = get_names(self.body)
+        self.funcs = {}
 
     def __call__(self, *args, **kwargs):
         return self.run(*args, **kwargs)
 
-class ReturnVal:
-    val = None
 def get_first_indent(line:str):
     '''将有效的第一行的缩进作为需要去除的缩进'''
     space = 0
@@ -99,50 +108,69 @@ def strip_indent(line:str, space):
         elif c == '\t': space -= 4; index += 1
         else: break
     return line[index:]
-def pre_code(code:str, rt_name, local_vars):
-    '''将代码封装到main函数中'''
-    # code = code.strip()
-    func = 'main'
-    while func in code or func in local_vars:
-        func = 'main' + str(randint(10000000, 99999999))
-    first_append_line = f'def {func}():\n'
-    first = True
+def pre_code(code:str):
+    '''去除公共缩进, 得到函数体'''
+    body = ''
+    space = None
     for line in code.split('\n'):
         if line.strip() == '': continue
-        if first:
-            space = get_first_indent(line); first=False
-        if locals().get('space') is None: 
-            continue
-        first_append_line += f'    {strip_indent(line, space)}\n'
-    first_append_line += f'{rt_name}.val = {func}()\n'
-    return first_append_line
+        if space is None:
+            space = get_first_indent(line)
+        body += f'    {strip_indent(line, space)}\n'
+    return body
+
+def get_names(body:str):
+    '''函数体中读取和定义的变量名, 以及访问的属性名'''
+    loads, stores, attributes = set(), set(), set()
+    for node in ast.walk(ast.parse(f'def _():\n{body}')):
+        if isinstance(node, ast.Attribute):
+            attributes.add(node.attr)
+        elif isinstance(node, ast.Name):
+            (loads if isinstance(node.ctx, ast.Load) else stores).add(node.id)
+        elif isinstance(node, ast.arg):
+            stores.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stores.add(node.name)
+        elif isinstance(node, ast.alias):
+            stores.add((node.asname or node.name).split('.')[0])
+    return loads, stores, attributes
+
+def compile_func(body:str, global_vars:dict, params:list[str]):
+    '''将函数体编译为以`params`为关键字参数的函数, 其余传入的变量被忽略'''
+    func, kwargs = 'main', 'kwargs'
+    while func in params or func in global_vars:
+        func = 'main' + str(randint(10000000, 99999999))
+    while kwargs in params:
+        kwargs = 'kwargs' + str(randint(10000000, 99999999))
+    args = ''.join(f'{name}, ' for name in params)
+    module = compile(f'def {func}({args}**{kwargs}):\n{body}', '<run_code>', 'exec')
+    func_code = next(const for const in module.co_consts if isinstance(const, CodeType))
+    return FunctionType(func_code, global_vars, func)
 
 def pre_run(code:str, local_vars):
+    '''
+    得到函数体和全局变量, 由`compile_func`按调用时传入的变量名编译, 每组变量名只编译一次.
+    传入的变量按原样覆盖同名的内置函数, 函数体中也可以重新赋值. 单个表达式时同时返回其ast, 供条件下推使用.
+    '''
+    expression = None
     if 'return' not in code and '\n' not in code:
+        try:
+            expression = ast.parse(code.strip(), mode='eval')
+        except SyntaxError:
+            pass
         code = "return " + code
     
-    locs = py_default_funcs.copy()
-    if local_vars is None: 
-        local_vars = {}
-    locs.update(local_vars)
-    rt_name = 'rt_value'
-    while rt_name in locs or rt_name in code:
-        rt_name = 'rt_value' + str(randint(10000, 99999))
-    rt_val = ReturnVal()
-    # print(code)
-    code = pre_code(code, rt_name, locs)
-    # print(code)
-    locs.update({rt_name: rt_val})
-    return code, rt_name, locs
+    global_vars = py_default_funcs.copy()
+    if local_vars is not None: 
+        global_vars.update(local_vars)
+    return pre_code(code), global_vars, expression
 
 def run_code(code:str, local_vars:Optional[dict]):
-    return _run_code(*pre_run(code, local_vars))
-def _run_code(code, rt_name, locs):
-    exec(code, locs)
-    return locs[rt_name].val
+    body, global_vars, _ = pre_run(code, local_vars)
+    return compile_func(body, global_vars, [])()
 
 
 if __name__ == '__main__':
     r = RunCoder("print(f'hello world', test)")
     for i in range(10):
-        r.run({'test': i})
+        r.run(test=i)
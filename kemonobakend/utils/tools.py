@@ -100,27 +100,23 @@ def get_file_type_by_name(path: str):
                 return type_name
     return 'other'
 
-def calc_file_sha256(path: str):
+def calc_file_sha256(path: str, block_size: int = 1024 * 1024):
     '''计算文件的sha256值'''
-    with open(path, 'rb') as f:
+    with open(path, 'rb', buffering=0) as f:
         sha256_obj = sha256()
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
         while True:
-            data = f.read(65536)
-            if not data:
+            size = f.readinto(buffer)
+            if not size:
                 break
-            sha256_obj.update(data)
+            sha256_obj.update(view[:size])
         return sha256_obj.hexdigest()
 
 async def async_calc_file_sha256(path: str):
-    '''异步计算文件的sha256值'''
-    async with aio_open(path, 'rb') as f:
-        sha256_obj = sha256()
-        while True:
-            data = await f.read(65536)
-            if not data:
-                break
-            sha256_obj.update(data)
-        return sha256_obj.hexdigest()
+    '''异步计算文件的sha256值, 在线程池中计算'''
+    from .hash_service import get_hash_service
+    return await get_hash_service().hash_file(path)
     
 def calc_str_sha256(s: str):
     '''计算字符串的sha256值'''
@@ -213,10 +209,11 @@ def count_leading_zeros_after_decimal(number):
     
     return count
 
+# '\t\n\r\a\f\v' 表示的字符
+_control_chars = ''.join(map(chr, range(0, 32)))  # 包含所有控制字符
+_windows_path_invalid = re.compile(f'[{re.escape(_control_chars)}<>:"/\\|?*]')
 def sanitize_windows_path(path):
-    # '\t\n\r\a\f\v' 表示的字符
-    control_chars = ''.join(map(chr, range(0, 32)))  # 包含所有控制字符
-    return re.sub(f'[{re.escape(control_chars)}<>:"/\\|?*]', '', path)
+    return _windows_path_invalid.sub('', path)
 
 if __name__ == '__main__':
     print(sanitize_windows_path(""))
\ No newline at end of file
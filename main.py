@@ -73,11 +73,12 @@ async def hard_link_files(program: KemonoProgram, urls = None):
         try:
             f = get_formatter(user)
             files = await program.get_files_by_formatter_name(f.formatter_name)
-            await program.hard_link_files(root, files, progress=progress)
+            await program.hard_link_files(resource_handler, files, progress=progress)
             logger.info(f"Hard linked files for {user.public_name}\t({user.service})")
         except Exception as e:
             logger.exception(e)
     
+    resource_handler = ResourceHandler(root)
     if urls is not None:
         users = await get_users(urls, program)
     else:
@@ -9,9 +9,11 @@ from kemonobakend.downloader import Downloader, DownloadProperties
 from kemonobakend.kemono.files import KemonoFilesFormatter
 from kemonobakend.kemono.resource_handler import ResourceHandler
 from kemonobakend.session_pool import SessionPool
+from kemonobakend.store.download_task import DownloadTaskStore
 from kemonobakend.utils import json_load
 from kemonobakend.utils.progress import NormalProgress
 from kemonobakend.log import logger
+from kemonobakend.config import settings
 
 
 def add_get_user_actions(parser: argparse.ArgumentParser):
@@ -23,6 +25,9 @@ def add_get_user_actions(parser: argparse.ArgumentParser):
 def add_urls_actions(parser: argparse.ArgumentParser):
     parser.add_argument("-u", "-urls", type=str, required=True, help="Urls of the kemono-users' main page, separated by comma, like https://kemono.su/{service}/user/{id}")
 
+def add_concurrency_actions(parser: argparse.ArgumentParser):
+    parser.add_argument("-concurrency", type=int, required=False, default=settings.program.batch_concurrency, help="Users processed at the same time, requests are still rate limited per site and database writes take turns, default is from config")
+
 def add_formatter_actions(parser: argparse.ArgumentParser):
     '''
     formatter_name: str,
@@ -73,14 +78,20 @@ def add_formatter_actions(parser: argparse.ArgumentParser):
                                                                                                 "like '...,imgs/1997_post1,imgs/1998_post1,imgs_01/0001_post2,imgs_01/0002_post2,...'")
 
 def add_download_actions(parser: argparse.ArgumentParser):
-    parser.add_argument("-filter", type=str, required=False, help="python code or expression to filter attachments, more details in examples/filter.py")
+    parser.add_argument("-filter", type=str, required=False, help="python code or expression to filter attachments, sees `user`, `post` and `attachment` (table columns plus `attachment.post` and `post.attachments`)")
     parser.add_argument("-root", "-res_root", type=str, required=False, default="downloads/Resource", help="Root directory of the downloaded resources, path like '{sha256[:2]}/{sha256[2:4]}/{sha256}' or 'no_hash/{hashable(url)}'")
     parser.add_argument("-tmp", "-tmp_path", type=str, required=False, default="downloads/Temp", help="Root directory of the downloaded temporary files")
     parser.add_argument("--disable_strict", action="store_true", help="Strict mode, If not disabled and has sha256, file must be verified the sha256 then store to resource directory, otherwise will be removed. !Temp files will not be removed!")
+    parser.add_argument("--direct_write", action="store_true", help="Write ranges directly into a preallocated '{save_path}.part' file (resume state in '{save_path}.part.json'), no part files merging")
+    parser.add_argument("--static_chunks", action="store_true", help="Split files by the size buckets of 'download.auto_chunks_dict' instead of adding ranges while the throughput still rises")
     parser.add_argument("-proxies", type=str, required=False, help =  "Proxy list, separated by comma, like 'http://127.0.0.1:41001,https://127.0.0.1:41002'. "
                                                                         "Path like 'proxies.json' is also supported, this path is absolute or relative to 'data/proxies/'. Json schema see examples/proxies.json")
     parser.add_argument("-max_concurrent", type=int, required=False, default=8, help="Maximum concurrent downloads, default is 10")
     parser.add_argument("-max_concurrent_per_task", type=int, required=False, default=10, help="Maximum concurrent downloads per task, default is 4")
+    parser.add_argument("-schedule", type=str, required=False, choices=["fifo", "sjf"], default=settings.download.schedule_policy, help="Task order, 'sjf' starts covers/thumbnails and then the smallest files first, 'fifo' keeps the attachments order")
+    parser.add_argument("-small_file_slots", type=int, required=False, default=settings.download.small_file_slots, help="Concurrent downloads reserved for small files, 0 disables the small files lane")
+    parser.add_argument("-journal", type=str, required=False, help="Download journal path, unfinished tasks in it are continued by 'download-resume', default is 'data/stores/downloadtaskstore.jsonl'")
+    parser.add_argument("--no_journal", action="store_true", help="Do not journal the download tasks")
 
 def get_args(*args):
     parser = argparse.ArgumentParser(description='Kemono-Manager CLI')
@@ -88,10 +99,13 @@ def get_args(*args):
     # add user
     add_user = sub_parser.add_parser("add-user", help="Add(update) a kemono-user and all-posts to the database")
     add_get_user_actions(add_user)
+    add_user.add_argument("-full", action="store_true", help="Fetch all posts again, instead of only the pages with new or edited posts")
     
     # add users
     add_users = sub_parser.add_parser("add-users", help="Add(update) multiple kemono-users and all-posts to the database, only url is required")
     add_urls_actions(add_users)
+    add_users.add_argument("-full", action="store_true", help="Fetch all posts again, instead of only the pages with new or edited posts")
+    add_concurrency_actions(add_users)
     
     # KemonoFilesFormatter()
     # add formatter
@@ -106,11 +120,15 @@ def get_args(*args):
     gen_files = sub_parser.add_parser("gen-files", help="Generate files by kemono-user's posts, that could be used for hardlink or backup")
     add_get_user_actions(gen_files)
     add_formatter_actions(gen_files)
+    gen_files.add_argument("-full", action="store_true", help="Delete and rewrite all files of the user, instead of only writing the changed ones")
     
     # generate files multi
     gen_files_multi = sub_parser.add_parser("gen-files-multi", help="Generate files by multiple kemono-users' posts. You can input config file or input formatter name that you used before.")
     add_urls_actions(gen_files_multi)
     add_formatter_actions(gen_files_multi)
+    gen_files_multi.add_argument("-workers", type=int, required=False, default=settings.program.files_gen_workers, help="Processes to generate files with, 0 means cpu count, 1 generates in this process, default is from config")
+    add_concurrency_actions(gen_files_multi)
+    gen_files_multi.add_argument("-full", action="store_true", help="Delete and rewrite all files of the users, instead of only writing the changed ones")
     
     # download attachments
     download = sub_parser.add_parser("download", help="Download kemono-user's attachments to local directory")
@@ -122,6 +140,10 @@ def get_args(*args):
     add_urls_actions(download_multi)
     add_download_actions(download_multi)
     
+    # download resume
+    download_resume = sub_parser.add_parser("download-resume", help="Continue the unfinished downloads journaled by an interrupted download / download-multi, without planning them from the database again")
+    add_download_actions(download_resume)
+    
     # hardlink files
     hardlink = sub_parser.add_parser("hardlink", help="Create hardlink of kemono-user's files to local directory, must gen-files first, you can download files first and then hardlink them")
     add_get_user_actions(hardlink)
@@ -132,15 +154,16 @@ def get_args(*args):
     hardlink_multi = sub_parser.add_parser("hardlink-multi", help="Create hardlink of multiple kemono-users' files to local directory. Only you can use it when formatter name is default 'public_name_{user_hash_id}'.")
     add_urls_actions(hardlink_multi)
     hardlink_multi.add_argument("-root", "-res_root", type=str, required=False, default="downloads/Resource", help="Root directory of the downloaded resources, default is 'downloads/Resource'")
+    add_concurrency_actions(hardlink_multi)
     
     args = args if args else sys.argv[1:]
     return parser.parse_args(args=args)
 
-async def add_users(urls: list[str], program: KemonoProgram):
+async def add_users(urls: list[str], program: KemonoProgram, full_sync: bool = False, concurrency: int = 1):
     async def add_user(url):
         try:
             old_user = await program.get_user(url=url)
-            await program.add_kemono_user(url = url)
+            await program.add_kemono_user(url = url, full_sync = full_sync)
             user = await program.get_user(url = url)
             if user is None:
                 raise Exception(f"Failed to get user from {url}")
@@ -153,7 +176,7 @@ async def add_users(urls: list[str], program: KemonoProgram):
         except Exception as e:
             logger.exception(e)
     
-    await ProgramTools.async_with_progress(add_user, urls, f"Adding kemono-users")
+    await ProgramTools.async_with_progress(add_user, urls, f"Adding kemono-users", concurrency=concurrency)
 
 def try_load_file(path_like: str):
     try:
@@ -250,46 +273,68 @@ async def get_users(urls: list[str], program: KemonoProgram):
         users.append(user)
     return users
 
-async def gen_files(user: KemonoUser, formatter: KemonoFilesFormatter, program: KemonoProgram):
-    await program.add_kemono_files(formatter, user)
+async def gen_files(user: KemonoUser, formatter: KemonoFilesFormatter, program: KemonoProgram, incremental: bool = True):
+    await program.add_kemono_files(formatter, user, incremental=incremental)
 
 async def gen_files_multi(namespace, program: KemonoProgram):
+    async def get_user_formatter(url):
+        user = await program.get_user(url=url)
+        if user is None:
+            raise Exception(f"Kemono user not found for {url}")
+        
+        if namespace.config is not None:
+            formatter = KemonoFilesFormatter.from_config(namespace.config)
+        else:
+            if namespace.fn is not None:
+                formatter = await program.get_formatter(namespace.fn)
+            else:
+                formatter = get_formatter(namespace, user)
+        return user, formatter
+    
     async def gen_user_files(url):
         try:
-            user = await program.get_user(url=url)
-            if user is None:
-                raise Exception(f"Kemono user not found for {url}")
-            
-            if namespace.config is not None:
-                formatter = KemonoFilesFormatter.from_config(namespace.config)
-            else:
-                if namespace.fn is not None:
-                    formatter = await program.get_formatter(namespace.fn)
-                else:
-                    formatter = get_formatter(namespace, user)
-            await program.add_kemono_files(formatter, user)
+            user, formatter = await get_user_formatter(url)
+            await program.add_kemono_files(formatter, user, incremental=not namespace.full)
             logger.info(f"Generating files for ({user.service})\t{user.public_name}")
         except Exception as e:
             logger.exception(e)
     
     urls = get_urls(namespace)
-    await ProgramTools.async_with_progress(gen_user_files, urls, f"Generating files for kemono-users")
+    if namespace.workers == 1:
+        await ProgramTools.async_with_progress(gen_user_files, urls, f"Generating files for kemono-users", concurrency=namespace.concurrency)
+        return
+    
+    jobs = []
+    for url in urls:
+        try:
+            jobs.append(await get_user_formatter(url))
+        except Exception as e:
+            logger.exception(e)
+    await program.add_kemono_files_multi(jobs, max_workers=namespace.workers or None, incremental=not namespace.full)
 
-async def download_users_attachments(users: list[KemonoUser], program: KemonoProgram, namespace):
-    resource_handler = ResourceHandler(namespace.root)
+def get_downloader(program: KemonoProgram, namespace):
     prop = DownloadProperties(
         program.session_pool,
         tmp_path=namespace.tmp,
         max_tasks_concurrent=namespace.max_concurrent,
         per_task_max_concurrent=namespace.max_concurrent_per_task,
         file_strict=not namespace.disable_strict,
+        direct_write=namespace.direct_write,
+        adaptive_chunks=not namespace.static_chunks,
+        schedule_policy=namespace.schedule,
+        small_file_slots=namespace.small_file_slots,
+        journal=None if namespace.no_journal else DownloadTaskStore(namespace.journal),
     )
-    downloader = Downloader(prop)
+    return Downloader(prop)
+
+async def download_users_attachments(users: list[KemonoUser], program: KemonoProgram, namespace):
+    resource_handler = ResourceHandler(namespace.root)
+    downloader = get_downloader(program, namespace)
     f = try_load_file(namespace.filter)
     filter_expr = f if f is not None else namespace.filter
     await program.download_files_by_users(users, resource_handler, downloader, filter_expr=filter_expr)
 
-async def hardlink_files(res_root: str, program: KemonoProgram, users = None, formatter_name = None):
+async def hardlink_files(res_root: str, program: KemonoProgram, users = None, formatter_name = None, concurrency: int = 1):
     async def hard_link_file(t: tuple[KemonoUser, str]):
         user, formatter_name = t
         try:
@@ -303,18 +348,20 @@ async def hardlink_files(res_root: str, program: KemonoProgram, users = None, fo
                 user_hash_id = files[0].user_hash_id
                 user = await program.get_user(user_hash_id)
             
-            await program.hard_link_files(res_root, files, progress=progress)
+            await program.hard_link_files(resource_handler, files, progress=progress)
             logger.info(f"Hard linked files for {user.public_name}\t({user.service})")
         except Exception as e:
             logger.exception(e)
     
+    # one index scan for every user
+    resource_handler = ResourceHandler(res_root)
     if users is None:
         users = [(None, formatter_name)]
     else:
         users = [(user, formatter_name) for user in users]
     
     with NormalProgress() as progress:
-        await ProgramTools.async_with_progress(hard_link_file, users, "Hard linking files...", progress=progress)
+        await ProgramTools.async_with_progress(hard_link_file, users, "Hard linking files...", progress=progress, concurrency=concurrency)
 
 
 async def main():
@@ -324,18 +371,24 @@ async def main():
     
     program = KemonoProgram()
     await program.init()
+    try:
+        await run_command(main_action, namespace, program)
+    finally:
+        await program.close()
+
+async def run_command(main_action: str, namespace, program: KemonoProgram):
     match main_action:
         case "add-user":
             id, service, url = namespace.i, namespace.s, namespace.u
             try:
-                await program.add_kemono_user(id, service, url=url)
+                await program.add_kemono_user(id, service, url=url, full_sync=namespace.full)
                 logger.info(f"Add(update) user for ({service})\t{id}")
             except Exception as e:
                 logger.exception(e)
         
         case "add-users":
             urls = get_urls(namespace)
-            await add_users(urls, program)
+            await add_users(urls, program, namespace.full, namespace.concurrency)
         
         case "add-formatter":
             if namespace.fn is None:
@@ -353,7 +406,7 @@ async def main():
                     logger.error(f"Failed to get user from {namespace.i}, {namespace.s}, {namespace.si}, {namespace.u}")
                     return
                 formatter = get_formatter(namespace, user)
-                await gen_files(user, formatter, program)
+                await gen_files(user, formatter, program, not namespace.full)
             except Exception as e:
                 logger.exception(e)
             logger.info(f"Generating files for ({user.service})\t{user.public_name}")
@@ -370,6 +423,9 @@ async def main():
             users = await get_users(urls, program)
             await download_users_attachments(users, program, namespace)
         
+        case "download-resume":
+            await program.resume_downloads(ResourceHandler(namespace.root), get_downloader(program, namespace))
+        
         case "hardlink":
             formatter_name = namespace.fn
             if formatter_name is None:
@@ -381,14 +437,16 @@ async def main():
         case "hardlink-multi":
             urls = get_urls(namespace)
             users = await get_users(urls, program)
-            await hardlink_files(namespace.root, program, users=users)
+            await hardlink_files(namespace.root, program, users=users, concurrency=namespace.concurrency)
         
         case _:
             logger.error(f"Unknown action: {main_action}")
             return
 
-if sys.platform == "win32":
-    policy = asyncio.WindowsSelectorEventLoopPolicy()
-    asyncio.set_event_loop_policy(policy)
+# guarded: process pool workers are spawned and re-import this module
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        policy = asyncio.WindowsSelectorEventLoopPolicy()
+        asyncio.set_event_loop_policy(policy)
 
-asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file